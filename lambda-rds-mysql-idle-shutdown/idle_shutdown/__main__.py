@@ -0,0 +1,6 @@
+import sys
+
+from cli import main
+
+# python idle_shutdown --help, from lambda-rds-mysql-idle-shutdown/
+sys.exit(main())
@@ -0,0 +1,117 @@
+import logging
+import time
+
+from instrumentation import timed
+from probing import instanceLabel
+from state import MemoryStateStore
+
+DETECTOR_TAG = "RDS_IDLE_DETECTOR"
+GENERAL_LOG = "general_log"
+STATUS_COUNTERS = "status_counters"
+DETECTORS = (GENERAL_LOG, STATUS_COUNTERS)
+
+# one cheap read, no log table involved
+# - statements run by anyone other than rdsadmin and the idle check user since startup.
+#   events_statements_summary_by_account_by_event_name is used instead of the Questions/Com_*
+#   global status counters because it's broken down by user, so the exclusions can be applied
+# - foreground sessions currently connected, with the same exclusions (Threads_connected would
+#   count our own session and rdsadmin's). the server's own daemon threads, like the event
+#   scheduler (on by default in MySQL 8.0), show up as foreground threads too but aren't anyone
+#   using the instance
+# - uptime, so a restart can be told apart from the counters going backwards
+sqlActiveSessions = (
+    "select count(*) from performance_schema.threads "
+    "where TYPE = 'FOREGROUND' and PROCESSLIST_USER is not null and PROCESSLIST_USER not like %s and PROCESSLIST_USER not like %s "
+    "and PROCESSLIST_USER not in ('event_scheduler', 'system user') and coalesce(PROCESSLIST_COMMAND, '') <> 'Daemon'"
+)
+sqlActivityCounters = (
+    "select "
+    "(select coalesce(sum(COUNT_STAR), 0) from performance_schema.events_statements_summary_by_account_by_event_name "
+    "where USER is not null and USER not like %s and USER not like %s) as statements, "
+    f"({sqlActiveSessions}) as sessions, "
+    "(select VARIABLE_VALUE from performance_schema.global_status where VARIABLE_NAME = 'Uptime') as uptime"
+)
+
+# used when no state store is passed in. only lives as long as the container
+_defaultStore = MemoryStateStore()
+
+
+def detectorFor(instance, default=GENERAL_LOG):
+    # the RDS_IDLE_DETECTOR tag picks the detector for one instance, otherwise the default is used
+    for tag in instance.get("TagList") or []:
+        if str(tag["Key"]).upper() == DETECTOR_TAG:
+            value = str(tag["Value"]).strip().lower()
+            if value in DETECTORS:
+                return value
+            logging.warning(
+                f'{instanceLabel(instance)}: Found tag {DETECTOR_TAG} but value was not one of {", ".join(DETECTORS)}, so using {default}.  Found value was {tag["Value"]}'
+            )
+    return default
+
+
+def readActivityCounters(cursor, user):
+    excluded = ("%rdsadmin%", "%" + user + "%")
+    with timed("query_activity_counters"):
+        cursor.execute(sqlActivityCounters, excluded + excluded)
+        result = cursor.fetchone()
+    return {
+        "statements": int(result["statements"]),
+        "sessions": int(result["sessions"]),
+        "uptime": int(result["uptime"]),
+    }
+
+
+def evaluateCounters(counters, previous, idleSeconds, now):
+    # works out when the instance was last active from two counter snapshots, and whether that
+    # was long enough ago to call it idle. returns (idle, snapshot to keep for next time)
+    restarted = (
+        previous is None
+        or counters["uptime"] < previous["uptime"]
+        or counters["statements"] < previous["statements"]
+    )
+
+    if counters["sessions"] > 0:
+        # somebody is connected right now
+        lastActive = now
+    elif restarted:
+        # no baseline to compare against. if nothing has run since startup then it was last
+        # active when it booted, otherwise we can't tell when so assume it was just now
+        lastActive = now if counters["statements"] > 0 else now - counters["uptime"]
+    elif counters["statements"] > previous["statements"]:
+        lastActive = now
+    else:
+        lastActive = previous["last_active"]
+
+    snapshot = {
+        "statements": counters["statements"],
+        "uptime": counters["uptime"],
+        "observed_at": now,
+        "last_active": lastActive,
+    }
+    idle = now - lastActive >= idleSeconds and counters["uptime"] >= idleSeconds
+    return idle, snapshot
+
+
+def isIdleByCounters(instance, cursor, user, store=None, idleSeconds=60 * 60, now=None):
+    if store is None:
+        store = _defaultStore
+    if now is None:
+        now = time.time()
+    counters = readActivityCounters(cursor, user)
+
+    previous = store.get(instance["DBInstanceIdentifier"])
+    if previous is not None and "statements" not in previous:
+        # last written by the general_log detector, so there's no counter baseline
+        previous = None
+    idle, snapshot = evaluateCounters(counters, previous, idleSeconds, now)
+    store.put(instance["DBInstanceIdentifier"], snapshot)
+
+    if idle:
+        logging.warning(
+            f'{instanceLabel(instance)}: Deemed idle.  Server has been up for {counters["uptime"] // 60} minutes, no statements or sessions for {int(now - snapshot["last_active"]) // 60} minutes'
+        )
+    else:
+        logging.warning(
+            f'{instanceLabel(instance)}: Not idle.  {counters["sessions"]} sessions connected, {counters["statements"]} statements since startup, uptime {counters["uptime"] // 60} minutes'
+        )
+    return idle
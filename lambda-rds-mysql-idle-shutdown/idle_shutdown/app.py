@@ -1,120 +1,181 @@
-import pymysql.cursors
+import time
+
+# how long this module's imports take is reported in the output, see coldStart
+_importStarted = time.perf_counter()
+
 import logging, sys
 import math
+import os
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import json
-import boto3
+from datetime import datetime, timezone
 
+from activity import STATUS_COUNTERS, detectorFor, isIdleByCounters
+from cloudwatch import (
+    ACTIVE,
+    BORDERLINE,
+    IDLE,
+    METRICS_ONLY,
+    METRICS_OFF,
+    classifyFleet,
+)
+from clients import DEFAULT_POOL_SIZE, configureClients, lazyClient
+from clusters import (
+    clusterDecision,
+    clusterResult,
+    isClusterExempt,
+    isClusterMember,
+    listClusters,
+    stopCluster,
+)
+from connections import (
+    IAM_AUTH,
+    authToken,
+    closeIdleConnections,
+    invalidateToken,
+    reusableConnection,
+    sslOptions,
+)
+from credentials import getCredentials, invalidateCredentials
+from endpoints import CLEANUP_DUE_KEY, cleanupEndpoints
+from fleet import sweepFleet, targetLabel
+from exemptions import resolveExemptions
+from instrumentation import emfDocuments, emitEmf, finishRun, startRun, timed
+from pipeline import runPipeline, stage
+from probing import probeInstances, probeResult
+from settings import loadSettings
+from shards import LOCAL_DISPATCHER, LambdaDispatcher, LocalDispatcher, coordinate
+from reachability import (
+    STOP,
+    UNREACHABLE_ERRORS,
+    Unreachable,
+    checkReachable,
+    remainingMillis,
+)
+from scheduler import planProbes
+from throttling import apiStats, configureThrottling
+from state import MemoryStateStore, PrefixedStateStore, openStateStore
+from stops import STOP_WORKERS, confirmStops, dispatchStops
 
-### FOR MANAGING VPC ENDPOINTS
-def get_tag(tags, search_tag):
-    for tag in tags:
-        if tag["Key"].upper() == str(search_tag).upper():
-            if str(tag["Value"]).upper() == "TRUE":
-                return True
-    return False
+# what a deferred stop turns each outcome into once the instance has actually been stopped
+DEFERRED_STOPS = {"idle": "stopped", "idle_unreachable": "stopped_unreachable"}
+# instances that are (or are now being) shut down, so their VPC endpoints aren't needed
+STOPPED_OUTCOMES = ("stopped", "stopped_unreachable", "not_available")
+# pymysql.constants.ER.ACCESS_DENIED_ERROR, kept here so pymysql isn't imported up front
+ER_ACCESS_DENIED_ERROR = 1045
+# imported by loadPyMySQL when it's first needed
+pymysql = None
 
+# once per container, not on every invocation
+logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+IMPORT_SECONDS = time.perf_counter() - _importStarted
+_invocations = {"count": 0}
+_lock = threading.Lock()
 
-def shutdown_endpoints():
-    client = boto3.client("ec2")
 
-    # could use Filter but its case sensitive sadface
-    response = client.describe_vpc_endpoints()
+# last command, server time and uptime in one statement, so only one round trip
+sqlSingleProbe = (
+    "select "
+    "(select event_time from mysql.general_log where user_host not like %s and user_host not like %s order by event_time desc limit 1) as db_last_command_time, "
+    "now() as db_now, "
+    "(select VARIABLE_VALUE from performance_schema.global_status where VARIABLE_NAME='Uptime') as uptime_seconds"
+)
 
-    count_endpoints_total = 0
-    count_endpoints_deleted = 0
-    count_endpoints_retained = 0
 
-    for endpoint in response["VpcEndpoints"]:
-        count_endpoints_total += 1
-        # if vpcendpoints_idle_exempt tag is present and set to true, then this won't run
-        # but if its not present, or present and set to false, then it will run
-        if get_tag(endpoint["Tags"], "VPCENDPOINTS_IDLE_EXEMPT") == False:
-            try:
-                client.delete_vpc_endpoints(VpcEndpointIds=[endpoint["VpcEndpointId"]])
-                count_endpoints_deleted += 1
-            except Exception as e:
-                print(
-                    f"{endpoint['VpcEndpointId']} in {endpoint['VpcId']}: Failed to delete - {str(e)}"
-                )
-                count_endpoints_retained += 1
+def isIdleSingleQuery(instance, cursor, user, observation=None, idleMinutes=60):
+    with timed("query_single_probe"):
+        cursor.execute(sqlSingleProbe, ("%rdsadmin%", "%" + user + "%"))
+        result = cursor.fetchone()
 
-        else:
-            count_endpoints_retained += 1
+    if not result or result["db_last_command_time"] is None:
+        logging.error(
+            f'{instance["Endpoint"]["Address"]}: Database did not return result!'
+        )
+        return False
 
-    print(
-        f"Finished endpoint check. {count_endpoints_deleted} deleted, {count_endpoints_retained} retained, {count_endpoints_total} endpoints total."
-    )
-
-
-###
+    elapsed = result["db_now"] - result["db_last_command_time"]
+    uptime = int(result["uptime_seconds"])
+    if observation is not None:
+        observation["last_active"] = time.time() - elapsed.total_seconds()
+        observation["uptime"] = uptime
 
+    if elapsed.total_seconds() < idleMinutes * 60:
+        logging.warning(
+            f'{instance["Endpoint"]["Address"]}: Processed last command less than {idleMinutes} minutes ago, at {result["db_last_command_time"]}'
+        )
+        return False
 
-# handler for pulling config from SSM
-def getSSMParameter(ssmClient, path, encryptionOption=False):
-    return (
-        ssmClient.get_parameter(Name=path, WithDecryption=encryptionOption)
-        .get("Parameter")
-        .get("Value")
-    )
-
+    if uptime < idleMinutes * 60:
+        logging.warning(
+            f'{instance["Endpoint"]["Address"]}: Server has been online less than {idleMinutes} minutes.  Uptime is {uptime // 3600} hours {uptime % 3600 // 60} minutes'
+        )
+        return False
 
-def isIdleExempt(rds, instance):
-    tags = rds.list_tags_for_resource(ResourceName=instance["DBInstanceArn"])
-    for tag in tags["TagList"]:
-        if str(tag["Key"]).upper() == "RDS_IDLE_EXEMPT":
-            if str(tag["Value"]).upper() == "TRUE":
-                return True
-            elif str(tag["Value"]).upper() == "FALSE":
-                return False
-            else:
-                logging.warning(
-                    f'{instance["Endpoint"]["Address"]}: Found tag RDS_IDLE_EXEMPT but value was not TRUE or FALSE, so defaulting to NOT idle exempt.  Found value was {tag["Value"]}'
-                )
-                return False
-    # nothing found so assume not exempt
     logging.warning(
-        f'{instance["Endpoint"]["Address"]}: Unable to find tag RDS_IDLE_EXEMPT, so defaulting to NOT idle exempt'
+        f'{instance["Endpoint"]["Address"]}: Deemed idle.  Server has been up for {uptime // 3600} hours {uptime % 3600 // 60} minutes, last command executed {result["db_last_command_time"]}'
     )
-    return False
+    return True
+
 
+# if observation is passed in, it gets filled in with what was learnt about the instance
+# (when it was last active and how long it has been up) so it can be kept for next time
+def isIdle(instance, cursor, user, observation=None, idleMinutes=60, singleQuery=False):
+    if singleQuery:
+        return isIdleSingleQuery(
+            instance, cursor, user, observation=observation, idleMinutes=idleMinutes
+        )
 
-def isIdle(instance, cursor, user):
     sqlSelect = "select event_time as db_last_command_time, user_host from mysql.general_log where user_host not like %s and user_host not like %s order by event_time desc limit 1"
-    cursor.execute(sqlSelect, ("%rdsadmin%", "%" + user + "%"))
-    result = cursor.fetchone()
+    with timed("query_last_command"):
+        cursor.execute(sqlSelect, ("%rdsadmin%", "%" + user + "%"))
+        result = cursor.fetchone()
 
     if "db_last_command_time" in result.keys():
         # have queries been processsed since last check?
         sqlSelectNow = "select now()"
-        cursor.execute(sqlSelectNow)
-        resultNow = cursor.fetchone()
+        with timed("query_now"):
+            cursor.execute(sqlSelectNow)
+            resultNow = cursor.fetchone()
         elapsed = resultNow["now()"] - result["db_last_command_time"]
-        if math.floor(elapsed.total_seconds() / (60 * 60)) < 1:
-            # its been less than 1 hour since a command was executed
+        if observation is not None:
+            observation["last_active"] = time.time() - elapsed.total_seconds()
+        if math.floor(elapsed.total_seconds() / 60) < idleMinutes:
+            # its been less than idleMinutes since a command was executed
             logging.warning(
-                f'{instance["Endpoint"]["Address"]}: Processed last command less than 1 hour ago, at {result["db_last_command_time"]}'
+                f'{instance["Endpoint"]["Address"]}: Processed last command less than {idleMinutes} minutes ago, at {result["db_last_command_time"]}'
             )
 
             # returns False because the instance is not idle
             return False
 
         else:
-            # its been more than an hour since a command was executed
-            # but how long has the server been up? if less than an hour, give it a stay of execution
+            # its been more than idleMinutes since a command was executed
+            # but how long has the server been up? if less than idleMinutes, give it a stay of execution
             sqlUptime = "select TIME_FORMAT(SEC_TO_TIME(VARIABLE_VALUE ),'%H') as hours, TIME_FORMAT(SEC_TO_TIME(VARIABLE_VALUE ),'%i') as minutes from performance_schema.global_status      where VARIABLE_NAME='Uptime'"
-            cursor.execute(sqlUptime)
-            uptimeResult = cursor.fetchone()
+            with timed("query_uptime"):
+                cursor.execute(sqlUptime)
+                uptimeResult = cursor.fetchone()
+            if observation is not None:
+                observation["uptime"] = (
+                    int(uptimeResult["hours"]) * 60 * 60
+                    + int(uptimeResult["minutes"]) * 60
+                )
 
-            if int(uptimeResult["hours"]) < 1:
-                # started up less than an hour ago
+            if (
+                int(uptimeResult["hours"]) * 60 + int(uptimeResult["minutes"])
+                < idleMinutes
+            ):
+                # started up less than idleMinutes ago
                 logging.warning(
-                    f'{instance["Endpoint"]["Address"]}: Server has been online less than an hour.  Uptime is {uptimeResult["hours"]} hours {uptimeResult["minutes"]} minutes'
+                    f'{instance["Endpoint"]["Address"]}: Server has been online less than {idleMinutes} minutes.  Uptime is {uptimeResult["hours"]} hours {uptimeResult["minutes"]} minutes'
                 )
 
                 # hasn't executed stuff since it came online, but hasn't been online long enough to really call it idle
                 return False
             else:
-                # no commands in an hour and has been online for at least an hour, so its idle
+                # no commands in idleMinutes and has been online for at least idleMinutes, so its idle
                 logging.warning(
                     f'{instance["Endpoint"]["Address"]}: Deemed idle.  Server has been up for {uptimeResult["hours"]} hours {uptimeResult["minutes"]} minutes, last command executed {result["db_last_command_time"]}'
                 )
@@ -125,101 +186,989 @@ def isIdle(instance, cursor, user):
     return False
 
 
-def lambda_handler(event, context):
-    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
-    ssmClient = boto3.client("ssm")
-    rds = boto3.client("rds")
-    # rds = boto3.client("rds-data")
+def loadPyMySQL():
+    # pymysql is imported the first time an instance actually needs a login, so runs that only
+    # list instances (nothing due, exempt, stopped, or decided by CloudWatch) never pay for it
+    global pymysql
+    if pymysql is None:
+        with timed("pymysql_import"):
+            import pymysql as module
+            import pymysql.cursors
+
+        pymysql = module
+    return pymysql
+
+
+def operationalError():
+    # the exception to catch for a failed login or lost connection, without importing pymysql
+    # just to catch it - if it hasn't been imported, nothing can have raised it
+    if pymysql is None:
+        return NotLoaded
+    return pymysql.err.OperationalError
+
+
+class NotLoaded(Exception):
+    pass
+
+
+def connectToInstance(
+    instance, user, password, connectTimeout=10, queryTimeout=None, ssl=None
+):
+    # the timeouts stop one broken instance from eating the whole Lambda budget
+    # only failing to connect makes an instance unreachable, so those errors become Unreachable
+    db = loadPyMySQL()
+    with timed("connect"):
+        try:
+            return db.connect(
+                host=instance["Endpoint"]["Address"],
+                port=instance["Endpoint"].get("Port", 3306),
+                user=user,
+                password=password,
+                database="sys",
+                cursorclass=db.cursors.DictCursor,
+                connect_timeout=connectTimeout,
+                read_timeout=queryTimeout,
+                write_timeout=queryTimeout,
+                ssl=ssl,
+            )
+        except db.err.OperationalError as e:
+            if e.args[0] not in UNREACHABLE_ERRORS:
+                raise
+            raise Unreachable(str(e)) from e
+
+
+def isIdleBySQL(instance, ssmClient, settings, store, now, rds=None):
+    # rds is only needed for IAM logins, to sign the auth token
+    detector = settings["idle_detector"]
+    loadPyMySQL()
+    iam = settings["db_auth"] == IAM_AUTH
+    address = instance["Endpoint"]["Address"]
+    port = instance["Endpoint"].get("Port", 3306)
+
+    # hold on to user - its used later
+    if iam:
+        user = settings["iam_db_user"]
+    else:
+        user, _ = getCredentials(ssmClient, ttl=settings["credentials_ttl"])
+
+    def login():
+        if iam:
+            return user, authToken(rds, address, port, user)
+        return getCredentials(ssmClient, ttl=settings["credentials_ttl"])
+
+    def connect():
+        nonlocal user
+        try:
+            user, password = login()
+            return connectToInstance(
+                instance,
+                user,
+                password,
+                connectTimeout=settings["connect_timeout"],
+                queryTimeout=settings["query_timeout"],
+                ssl=sslOptions(iam, settings["db_ssl_ca"]),
+            )
+        except operationalError() as e:
+            if e.args[0] != ER_ACCESS_DENIED_ERROR:
+                raise
+        # the password may have been changed since it was cached (or the token signed with
+        # credentials that have since expired), so try once more with a fresh one
+        if iam:
+            logging.warning(f"{address}: Login refused, signing a new IAM auth token")
+            invalidateToken(address, port, user)
+        else:
+            logging.warning(
+                f"{address}: Login refused, fetching credentials from SSM again"
+            )
+            invalidateCredentials(ssmClient)
+        user, password = login()
+        return connectToInstance(
+            instance,
+            user,
+            password,
+            connectTimeout=settings["connect_timeout"],
+            queryTimeout=settings["query_timeout"],
+            ssl=sslOptions(iam, settings["db_ssl_ca"]),
+        )
+
+    with reusableConnection(
+        (address, port, user),
+        connect,
+        reuse=settings["connection_reuse"],
+        maxIdleSeconds=settings["connection_max_idle"],
+    ) as mydb:
+        with mydb.cursor() as cursor:
+            if detectorFor(instance, default=detector) == STATUS_COUNTERS:
+                return isIdleByCounters(
+                    instance=instance,
+                    cursor=cursor,
+                    user=user,
+                    store=store,
+                    idleSeconds=settings["idle_minutes"] * 60,
+                    now=now,
+                )
+
+            observation = {}
+            idle = isIdle(
+                cursor=cursor,
+                instance=instance,
+                user=user,
+                observation=observation,
+                idleMinutes=settings["idle_minutes"],
+                singleQuery=settings["single_query_probe"],
+            )
+            if observation:
+                observation["observed_at"] = now
+                store.put(instance["DBInstanceIdentifier"], observation)
+            return idle
+
+
+def stopInstance(rds, instance):
+    try:
+        with timed("stop"):
+            rds.stop_db_instance(DBInstanceIdentifier=instance["DBInstanceIdentifier"])
+        logging.warning(
+            f'{instance["Endpoint"]["Address"]}: Successfully issued shutdown command.'
+        )
+
+    except Exception as e:
+        logging.error(
+            f'{instance["Endpoint"]["Address"]}: Failed to stop RDS instance. Traceback follows.'
+        )
+
+        logging.error(str(e))
+        raise
+
+
+def unreachableInstance(instance, rds, settings, deferStop=False):
+    # couldn't get a MySQL session with it at all. either leave it alone, or assume nobody else
+    # can use it either and shut it down
+    if settings["unreachable_policy"] == STOP:
+        logging.warning(
+            f'{instance["Endpoint"]["Address"]}: Instance is unreachable, stopping it anyway.'
+        )
+        if deferStop:
+            return probeResult(instance, "idle_unreachable")
+        stopInstance(rds, instance)
+        return probeResult(instance, "stopped_unreachable")
+
+    logging.warning(
+        f'{instance["Endpoint"]["Address"]}: Instance is unreachable.  Skipping.'
+    )
+    return probeResult(instance, "unreachable")
+
+
+def checkInstance(
+    instance,
+    ssmClient,
+    rds,
+    settings=None,
+    store=None,
+    metricsVerdict=None,
+    reachable=True,
+    deferStop=False,
+):
+    # with deferStop, idle instances come back as "idle" (or "idle_unreachable") for something
+    # else to stop, rather than being stopped here
+    logging.warning(f'{instance["Endpoint"]["Address"]}: Checking instance')
+    if settings is None:
+        settings = loadSettings({})
+    if store is None:
+        store = MemoryStateStore()
+    now = time.time()
+
+    # check if its online
+    if instance["DBInstanceStatus"] != "available":
+        # skipping instance, its not powered on
+        logging.warning(
+            f'{instance["Endpoint"]["Address"]}: Instance is not powered on.  Ignoring.'
+        )
+        return probeResult(instance, "not_available")
+
+    # how long the check of each instance that's up takes, for p50/p99 and the slowest ones
+    with timed("probe", instance):
+        if metricsVerdict == ACTIVE:
+            # CloudWatch already shows someone using it, no need to log in
+            state = store.get(instance["DBInstanceIdentifier"]) or {}
+            state.update({"last_active": now, "observed_at": now})
+            store.put(instance["DBInstanceIdentifier"], state)
+            idle = False
+        elif metricsVerdict == IDLE:
+            # no connections, CPU or IO for the whole window - no need to log in either
+            idle = True
+        elif metricsVerdict == BORDERLINE and settings["metrics_mode"] == METRICS_ONLY:
+            idle = False
+        elif not reachable:
+            return unreachableInstance(instance, rds, settings, deferStop=deferStop)
+        else:
+            try:
+                idle = isIdleBySQL(
+                    instance,
+                    ssmClient,
+                    settings=settings,
+                    store=store,
+                    now=now,
+                    rds=rds,
+                )
+            except Unreachable as e:
+                logging.warning(
+                    f'{instance["Endpoint"]["Address"]}: Unable to connect to the instance - {str(e)}'
+                )
+                return unreachableInstance(instance, rds, settings, deferStop=deferStop)
+
+        if not idle:
+            logging.warning(
+                f'{instance["Endpoint"]["Address"]}: Instance not idle.  Skipping.'
+            )
+            return probeResult(instance, "not_idle")
+
+        if deferStop:
+            return probeResult(instance, "idle")
+        stopInstance(rds, instance)
+        return probeResult(instance, "stopped")
+
+
+def stopDeferred(rds, instance, result, dryRun=False):
+    # stops an instance that checkInstance(deferStop=True) found idle
+    # in a dry run it's left running, and stays "idle" (or "idle_unreachable") in the results
+    if result["outcome"] not in DEFERRED_STOPS:
+        return result
+    if dryRun:
+        logging.warning(
+            f'{instance["Endpoint"]["Address"]}: Dry run, not stopping idle instance.'
+        )
+        return result
+    try:
+        stopInstance(rds, instance)
+    except Exception as e:
+        return probeResult(instance, "error", error=str(e))
+    return probeResult(instance, DEFERRED_STOPS[result["outcome"]])
 
+
+def dropExempt(instances, exempt):
     rdsInstances = []
+    for dbinstance in instances:
+        if exempt[dbinstance["DBInstanceArn"]]:
+            logging.warning(
+                f'{dbinstance["Endpoint"]["Address"]}: Instance is exempt from idle shutdown'
+            )
+        else:
+            logging.warning(
+                f'{dbinstance["Endpoint"]["Address"]}: Instance is NOT exempt from idle shutdown'
+            )
+
+            rdsInstances.append(dbinstance)
+    return rdsInstances
+
+
+def standaloneInstances(settings, instances):
+    # in cluster mode, Aurora instances are left for checkClusters to check with the rest of
+    # their cluster
+    if not settings["cluster_mode"]:
+        return instances
+    return [i for i in instances if not isClusterMember(i)]
+
+
+def metricsVerdictsFor(settings, clientFor, instances):
+    # CloudWatch can rule instances in or out without logging in to any of them
+    if settings["metrics_mode"] == METRICS_OFF:
+        return {}, None
+    available = [i for i in instances if i["DBInstanceStatus"] == "available"]
+    try:
+        return classifyFleet(
+            clientFor("cloudwatch"),
+            available,
+            end=datetime.now(timezone.utc),
+            windowSeconds=settings["idle_minutes"] * 60,
+            cpuThreshold=settings["metrics_cpu_threshold"],
+            iopsThreshold=settings["metrics_iops_threshold"],
+        )
+    except Exception as e:
+        # without metrics, prefilter logs in to everything like METRICS_MODE=off would, and
+        # only leaves everything alone rather than guess
+        logging.warning(f"Unable to get CloudWatch metrics - {str(e)}")
+        verdicts = {}
+        if settings["metrics_mode"] == METRICS_ONLY:
+            verdicts = {i["DBInstanceIdentifier"]: BORDERLINE for i in available}
+        return verdicts, {"get_metric_data_failures": 1, "error": str(e)}
+
+
+def reachabilityFor(settings, instances, metricsVerdicts):
+    # optionally make sure every instance we're about to log in to is reachable at all first,
+    # all at the same time, so dead endpoints don't each burn a connect timeout in the sweep
+    if not settings["tcp_precheck"]:
+        return {}
+    return checkReachable(
+        [
+            i
+            for i in instances
+            if i["DBInstanceStatus"] == "available"
+            and metricsVerdicts.get(i["DBInstanceIdentifier"]) not in (ACTIVE, IDLE)
+        ],
+        timeout=settings["connect_timeout"],
+    )
+
+
+def findCandidates(settings, store, clientFor):
+    # enumerate the instances, drop the exempt ones and the ones that can't be idle yet
+    rds = clientFor("rds")
+    # rds = boto3.client("rds-data")
 
     # get rds instances
     try:
-        paginator = rds.get_paginator("describe_db_instances").paginate()
-        for page in paginator:
-            for dbinstance in page["DBInstances"]:
-                if isIdleExempt(rds=rds, instance=dbinstance):
-                    logging.warning(
-                        f'{dbinstance["Endpoint"]["Address"]}: Instance is exempt from idle shutdown'
-                    )
-                else:
-                    logging.warning(
-                        f'{dbinstance["Endpoint"]["Address"]}: Instance is NOT exempt from idle shutdown'
-                    )
-
-                    rdsInstances.append(dbinstance)
+        allInstances = []
+        with timed("enumerate"):
+            paginator = rds.get_paginator("describe_db_instances").paginate()
+            for page in paginator:
+                allInstances.extend(standaloneInstances(settings, page["DBInstances"]))
+
+        # resolve exemptions for the whole fleet in one go rather than one tag lookup per instance
+        with timed("tag_lookup"):
+            exempt, exemptionStats = resolveExemptions(
+                rds=rds,
+                instances=allInstances,
+                tagging=clientFor("resourcegroupstaggingapi"),
+            )
+        logging.warning(
+            f'Resolved idle exemptions for {exemptionStats["instances"]} instances, saving {exemptionStats["api_calls_saved"]} tag API calls'
+        )
+
+        rdsInstances = dropExempt(allInstances, exempt)
 
     except Exception as e:
         logging.error("Failed to enumerate RDS instances. Traceback follows.")
         logging.error(str(e))
         raise
 
-    # just to make sure this variable isn't unintentionally accessed later
-    dbinstance = None
-
     # now try and connect to the RDS instances
     # if the instance is online, see if its been idle
     # if it has, turn it off
-    for instance in rdsInstances:
-        logging.warning(f'{instance["Endpoint"]["Address"]}: Checking instance')
-
-        # check if its online
-        if instance["DBInstanceStatus"] == "available":
-            # try connect to it
-            # hold on to user - its used later
-            user = getSSMParameter(
-                ssmClient=ssmClient,
-                path="/platform/rds-idle-shutdown-username",
+    # only log in to instances that could actually be idle by now, based on what was learnt last time
+    dueInstances, schedule = planProbes(
+        rdsInstances,
+        store=store,
+        idleSeconds=settings["idle_minutes"] * 60,
+        now=time.time(),
+    )
+    logging.warning(
+        f'Checking {schedule["probes_executed"]} instances, skipping {schedule["probes_skipped"]} that cannot be idle yet'
+    )
+
+    return dueInstances, {"exemptions": exemptionStats, "schedule": schedule}
+
+
+def checkInstances(
+    settings,
+    store,
+    dueInstances,
+    context=None,
+    clientFor=None,
+    slots=None,
+    cleanEndpoints=True,
+    deadline=None,
+):
+    # check every instance in dueInstances and stop the idle ones
+    if clientFor is None:
+        clientFor = lazyClient
+    ssmClient = clientFor("ssm")
+    rds = clientFor("rds")
+
+    # CloudWatch can rule instances in or out for the whole fleet without logging in to any of them
+    metricsVerdicts, metricsSummary = metricsVerdictsFor(
+        settings, clientFor, dueInstances
+    )
+    reachability = reachabilityFor(settings, dueInstances, metricsVerdicts)
+    hasTimeLeft = timeLeftCheck(settings, context, deadline)
+
+    # each instance is checked independently, so a failure on one doesn't stop the others
+    results = probeInstances(
+        dueInstances,
+        lambda instance: checkInstance(
+            instance,
+            ssmClient=ssmClient,
+            rds=rds,
+            settings=settings,
+            store=store,
+            metricsVerdict=metricsVerdicts.get(instance["DBInstanceIdentifier"]),
+            reachable=reachability.get(instance["DBInstanceIdentifier"], True),
+            deferStop=True,
+        ),
+        maxWorkers=settings["probe_concurrency"],
+        shouldStart=hasTimeLeft,
+        slots=slots,
+    )
+    # then all the idle ones are stopped together
+    results = dispatchStops(
+        zip(dueInstances, results),
+        lambda item: stopDeferred(rds, item[0], item[1], dryRun=settings["dry_run"]),
+    )
+    report = summariseResults(
+        results, clientFor, cleanEndpoints and not settings["dry_run"]
+    )
+    report["metrics"] = metricsSummary
+    report["stops"] = confirmStopped(results, settings, store, rds, hasTimeLeft)
+    return report
+
+
+def confirmStopped(results, settings, store, rds, hasTimeLeft):
+    # which of the instances stopped this run (and earlier ones still stopping) got to stopped
+    if not settings["stop_confirm"]:
+        return None
+    stoppedIds = [
+        r["instance"]
+        for r in results
+        if r["outcome"] in ("stopped", "stopped_unreachable")
+    ]
+    try:
+        return confirmStops(
+            rds,
+            store,
+            stoppedIds,
+            waitSeconds=settings["stop_confirm_seconds"],
+            hasTimeLeft=hasTimeLeft,
+        )
+    except Exception as e:
+        logging.error("Failed to confirm stopped instances. Traceback follows.")
+        logging.error(str(e))
+        return {"error": str(e)}
+
+
+def timeLeftCheck(settings, context, deadline=None):
+    # stop starting new checks once there isn't enough time left to finish one, before the
+    # Lambda times out or (for a shard worker) before its coordinator's deadline
+    def hasTimeLeft():
+        remaining = remainingMillis(context)
+        if deadline is not None:
+            untilDeadline = (deadline - time.time()) * 1000
+            remaining = (
+                untilDeadline if remaining is None else min(remaining, untilDeadline)
             )
-            mydb = pymysql.connect(
-                host=instance["Endpoint"]["Address"],
-                user=user,
-                password=getSSMParameter(
-                    ssmClient=ssmClient,
-                    path="/platform/rds-idle-shutdown-password",
-                    encryptionOption=True,
+        return remaining is None or remaining > settings["min_remaining_ms"]
+
+    return hasTimeLeft
+
+
+def summariseResults(results, clientFor, cleanEndpoints=True):
+    # also kill off VPC endpoints - I'm assuming no RDS means no need for VPC endpoints
+    # done once for the whole sweep, rather than once for every instance that is stopped
+    endpointStats = None
+    if cleanEndpoints and any(r["outcome"] in STOPPED_OUTCOMES for r in results):
+        with timed("endpoint_cleanup"):
+            endpointStats = cleanupEndpoints(clientFor("ec2"))
+
+    unreachable = [
+        r["instance"]
+        for r in results
+        if r["outcome"] in ("unreachable", "stopped_unreachable")
+    ]
+    outOfTime = [r["instance"] for r in results if r["outcome"] == "out_of_time"]
+    if unreachable:
+        logging.warning(
+            f'{len(unreachable)} instances were unreachable: {", ".join(unreachable)}'
+        )
+    if outOfTime:
+        logging.warning(
+            f"Ran out of time before checking {len(outOfTime)} instances, they'll be checked next run"
+        )
+
+    return {
+        "results": results,
+        "unreachable": unreachable,
+        "out_of_time": outOfTime,
+        "endpoints": endpointStats,
+    }
+
+
+def streamSweep(settings, store, context=None, clientFor=None, slots=None):
+    # the same sweep as findCandidates + checkInstances, but as stages joined by bounded queues:
+    # page -> filter -> probe -> stop. the first login happens as soon as the first page of
+    # instances is filtered, rather than after the whole account has been listed, and only a
+    # few pages' worth of instances are ever held at once
+    if clientFor is None:
+        clientFor = lazyClient
+    ssmClient = clientFor("ssm")
+    rds = clientFor("rds")
+    hasTimeLeft = timeLeftCheck(settings, context)
+    order = itertools.count()
+    totals = {
+        "exemptions": {},
+        "schedule": {"probes_executed": 0, "probes_skipped": 0, "next_deadline": None},
+        "metrics": None,
+    }
+    totalsLock = threading.Lock()
+
+    def pages():
+        # each page is timed on its own, the time between pages is spent in the other stages
+        paginator = iter(rds.get_paginator("describe_db_instances").paginate())
+        while True:
+            with timed("enumerate"):
+                page = next(paginator, None)
+            if page is None:
+                return
+            yield page["DBInstances"]
+
+    def filterPage(instances):
+        # per page rather than per fleet: describe_db_instances already returns each instance's
+        # TagList, so the tagging API is only needed (per instance) if it didn't
+        instances = standaloneInstances(settings, instances)
+        with timed("tag_lookup"):
+            exempt, exemptionStats = resolveExemptions(rds=rds, instances=instances)
+        dueInstances, schedule = planProbes(
+            dropExempt(instances, exempt),
+            store=store,
+            idleSeconds=settings["idle_minutes"] * 60,
+            now=time.time(),
+        )
+        metricsVerdicts, metricsSummary = metricsVerdictsFor(
+            settings, clientFor, dueInstances
+        )
+        reachability = reachabilityFor(settings, dueInstances, metricsVerdicts)
+
+        with totalsLock:
+            addCounts(totals["exemptions"], exemptionStats)
+            deadline = schedule.pop("next_deadline")
+            addCounts(totals["schedule"], schedule)
+            soonest = totals["schedule"]["next_deadline"]
+            if deadline is not None and (soonest is None or deadline < soonest):
+                totals["schedule"]["next_deadline"] = deadline
+            if metricsSummary is not None:
+                totals["metrics"] = addCounts(totals["metrics"] or {}, metricsSummary)
+
+        for instance in dueInstances:
+            yield {
+                "order": next(order),
+                "instance": instance,
+                "metricsVerdict": metricsVerdicts.get(instance["DBInstanceIdentifier"]),
+                "reachable": reachability.get(instance["DBInstanceIdentifier"], True),
+            }
+
+    def probe(item):
+        # probeInstances with one instance keeps the same error isolation, deadline and
+        # shared slot handling as the batch sweep
+        item["result"] = probeInstances(
+            [item["instance"]],
+            lambda instance: checkInstance(
+                instance,
+                ssmClient=ssmClient,
+                rds=rds,
+                settings=settings,
+                store=store,
+                metricsVerdict=item["metricsVerdict"],
+                reachable=item["reachable"],
+                deferStop=True,
+            ),
+            shouldStart=hasTimeLeft,
+            slots=slots,
+        )[0]
+        yield item
+
+    def stop(item):
+        yield item["order"], stopDeferred(
+            rds, item["instance"], item["result"], dryRun=settings["dry_run"]
+        )
+
+    queueSize = settings["pipeline_queue_size"]
+    try:
+        ordered, stages = runPipeline(
+            pages(),
+            [
+                stage("filter", filterPage, queueSize=2),
+                stage(
+                    "probe",
+                    probe,
+                    workers=settings["probe_concurrency"],
+                    queueSize=queueSize,
                 ),
-                database="sys",
-                cursorclass=pymysql.cursors.DictCursor,
-            )
-
-            with mydb:
-                with mydb.cursor() as cursor:
-                    if isIdle(
-                        cursor=cursor,
-                        instance=instance,
-                        user=user,
-                    ):
-                        try:
-                            rds.stop_db_instance(
-                                DBInstanceIdentifier=instance["DBInstanceIdentifier"]
-                            )
-                            logging.warning(
-                                f'{instance["Endpoint"]["Address"]}: Instance is idle.  Successfully issued shutdown command.'
-                            )
-
-                        except Exception as e:
-                            logging.error(
-                                f'{instance["Endpoint"]["Address"]}: Failed to stop RDS instance. Traceback follows.'
-                            )
-
-                            logging.error(str(e))
-                            raise
-
-                        # also kill off VPC endpoints - I'm assuming no RDS means no need for VPC endpoints
-                        shutdown_endpoints()
-                    else:
-                        logging.warning(
-                            f'{instance["Endpoint"]["Address"]}: Instance not idle.  Skipping.'
-                        )
-        else:
-            # skipping instance, its not powered on
+                stage("stop", stop, workers=STOP_WORKERS, queueSize=queueSize),
+            ],
+            sourceName="page",
+        )
+    except Exception as e:
+        logging.error("Failed to sweep RDS instances. Traceback follows.")
+        logging.error(str(e))
+        raise
+
+    # reported in the order RDS listed them, same as the batch sweep
+    results = [result for _, result in sorted(ordered, key=lambda r: r[0])]
+    report = summariseResults(
+        results, clientFor, cleanEndpoints=not settings["dry_run"]
+    )
+    report.update(totals)
+    report["pipeline"] = stages
+    report["stops"] = confirmStopped(results, settings, store, rds, hasTimeLeft)
+    return report
+
+
+def addCounts(total, counts):
+    # adds every number in counts onto the same key in total
+    for key, value in counts.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def planCluster(cluster, members, settings, store):
+    # returns the members to probe, or the cluster's result if it can't be stopped this run
+    if cluster["Status"] != "available":
+        logging.warning(
+            f'{cluster["DBClusterIdentifier"]}: Cluster is not available.  Ignoring.'
+        )
+        return None, clusterResult(cluster, "not_available")
+
+    # if any one instance can't be idle yet, neither can the cluster
+    dueMembers, schedule = planProbes(
+        members,
+        store=store,
+        idleSeconds=settings["idle_minutes"] * 60,
+        now=time.time(),
+    )
+    if schedule["probes_skipped"]:
+        return None, clusterResult(cluster, "not_due")
+    return dueMembers, None
+
+
+def checkCluster(
+    cluster,
+    dueMembers,
+    settings,
+    store,
+    clientFor,
+    hasTimeLeft,
+    slots,
+    metricsVerdicts,
+    reachability,
+):
+    # all the cluster's instances are checked at the same time, and the cluster is stopped with
+    # one stop_db_cluster if every one of them is idle
+    rds = clientFor("rds")
+    ssmClient = clientFor("ssm")
+    memberResults = probeInstances(
+        dueMembers,
+        lambda instance: checkInstance(
+            instance,
+            ssmClient=ssmClient,
+            rds=rds,
+            settings=settings,
+            store=store,
+            metricsVerdict=metricsVerdicts.get(instance["DBInstanceIdentifier"]),
+            reachable=reachability.get(instance["DBInstanceIdentifier"], True),
+            deferStop=True,
+        ),
+        maxWorkers=settings["probe_concurrency"],
+        shouldStart=hasTimeLeft,
+        slots=slots,
+    )
+
+    outcome = clusterDecision(memberResults, DEFERRED_STOPS)
+    if outcome != "idle":
+        logging.warning(
+            f'{cluster["DBClusterIdentifier"]}: Cluster not idle ({outcome}).  Skipping.'
+        )
+        return clusterResult(cluster, outcome, members=memberResults)
+    if settings["dry_run"]:
+        logging.warning(
+            f'{cluster["DBClusterIdentifier"]}: Dry run, not stopping idle cluster.'
+        )
+        return clusterResult(cluster, "idle", members=memberResults)
+
+    try:
+        stopCluster(rds, cluster)
+    except Exception as e:
+        return clusterResult(cluster, "error", members=memberResults, error=str(e))
+    unreachable = all(r["outcome"] == "idle_unreachable" for r in memberResults)
+    return clusterResult(
+        cluster,
+        "stopped_unreachable" if unreachable else "stopped",
+        members=memberResults,
+    )
+
+
+def checkClusters(settings, store, context=None, clientFor=None, slots=None):
+    # Aurora clusters are checked and stopped as a whole, rather than instance by instance
+    if clientFor is None:
+        clientFor = lazyClient
+    hasTimeLeft = timeLeftCheck(settings, context)
+    report = {"clusters": 0, "exempt": 0, "not_due": 0, "results": []}
+
+    def failed(cluster, e):
+        logging.error(
+            f'{cluster["DBClusterIdentifier"]}: Failed to check cluster. Traceback follows.'
+        )
+        logging.error(str(e))
+        return clusterResult(cluster, "error", error=str(e))
+
+    # first work out which clusters could be idle, without logging in to anything
+    results = []
+    due = []
+    for cluster, members in listClusters(clientFor("rds")):
+        report["clusters"] += 1
+        if isClusterExempt(cluster, members):
             logging.warning(
-                f'{instance["Endpoint"]["Address"]}: Instance is not powered on.  Ignoring.'
+                f'{cluster["DBClusterIdentifier"]}: Cluster is exempt from idle shutdown'
+            )
+            report["exempt"] += 1
+            continue
+        try:
+            dueMembers, result = planCluster(cluster, members, settings, store)
+        except Exception as e:
+            dueMembers, result = None, failed(cluster, e)
+        if result is not None and result["outcome"] == "not_due":
+            report["not_due"] += 1
+            continue
+        if result is None:
+            due.append((len(results), cluster, dueMembers))
+        results.append(result)
+
+    # CloudWatch is asked about the members of every due cluster at once, as for the instances
+    allMembers = [m for _, _, dueMembers in due for m in dueMembers]
+    metricsVerdicts, _ = metricsVerdictsFor(settings, clientFor, allMembers)
+    reachability = reachabilityFor(settings, allMembers, metricsVerdicts)
+
+    # the clusters are checked side by side. the member probes all take the same slots, so
+    # PROBE_CONCURRENCY still limits how many instances are logged in to at once
+    if slots is None:
+        slots = threading.BoundedSemaphore(settings["probe_concurrency"])
+
+    def run(item):
+        index, cluster, dueMembers = item
+        try:
+            results[index] = checkCluster(
+                cluster,
+                dueMembers,
+                settings,
+                store,
+                clientFor,
+                hasTimeLeft,
+                slots,
+                metricsVerdicts,
+                reachability,
+            )
+        except Exception as e:
+            results[index] = failed(cluster, e)
+
+    if due:
+        workers = min(settings["probe_concurrency"], len(due))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(run, due))
+
+    report["results"] = results
+    return report
+
+
+def addClusters(report, settings, store, context=None, clientFor=None, slots=None):
+    # checks the Aurora clusters after the instances, and cleans up the VPC endpoints if only a
+    # cluster was stopped
+    if clientFor is None:
+        clientFor = lazyClient
+    if not settings["cluster_mode"]:
+        return report
+    report["clusters"] = checkClusters(
+        settings, store, context=context, clientFor=clientFor, slots=slots
+    )
+    if (
+        report.get("endpoints") is None
+        and not settings["dry_run"]
+        and any(r["outcome"] in STOPPED_OUTCOMES for r in report["clusters"]["results"])
+    ):
+        with timed("endpoint_cleanup"):
+            report["endpoints"] = cleanupEndpoints(clientFor("ec2"))
+    return report
+
+
+def sweep(settings, store, context=None, clientFor=None, slots=None):
+    # one full pass over the instances in one account and region
+    # clientFor(service) returns the boto3 client to use for that account and region
+    if clientFor is None:
+        clientFor = lazyClient
+    if settings["stream_pipeline"]:
+        report = streamSweep(
+            settings, store, context=context, clientFor=clientFor, slots=slots
+        )
+    else:
+        dueInstances, report = findCandidates(settings, store, clientFor)
+        report.update(
+            checkInstances(
+                settings,
+                store,
+                dueInstances,
+                context=context,
+                clientFor=clientFor,
+                slots=slots,
+            )
+        )
+    return addClusters(
+        report, settings, store, context=context, clientFor=clientFor, slots=slots
+    )
+
+
+def sweepTargets(settings, store, context=None):
+    # every region/account in FLEET_TARGETS is swept at the same time. they all share one pool
+    # of probe slots, so PROBE_CONCURRENCY is the limit for the whole fleet, not per target
+    slots = threading.BoundedSemaphore(settings["probe_concurrency"])
+
+    def sweepTarget(target):
+        def clientFor(service):
+            return lazyClient(
+                service, region=target["region"], roleArn=target.get("role_arn")
             )
-            shutdown_endpoints()
 
-    return {"statusCode": 200, "body": json.dumps("Success")}
+        return sweep(
+            settings,
+            PrefixedStateStore(store, targetLabel(target)),
+            context=context,
+            clientFor=clientFor,
+            slots=slots,
+        )
+
+    return sweepFleet(settings["fleet_targets"], sweepTarget)
+
+
+def coordinatorSweep(settings, store, context=None):
+    # enumerate here, then hand the instances that need checking out to workers in shards
+    dueInstances, report = findCandidates(settings, store, lazyClient)
+
+    # fire and forget workers from the last run that stopped something leave the endpoint
+    # cleanup to this run
+    report["endpoints"] = None
+    if store.get(CLEANUP_DUE_KEY) and not settings["dry_run"]:
+        with timed("endpoint_cleanup"):
+            report["endpoints"] = cleanupEndpoints(lazyClient("ec2"))
+        store.put(CLEANUP_DUE_KEY, {})
+
+    if settings["dispatcher"] == LOCAL_DISPATCHER:
+        dispatcher = LocalDispatcher(lambda event: lambda_handler(event, context))
+    else:
+        dispatcher = LambdaDispatcher(
+            settings["worker_function"],
+            waitForResults=not settings["dispatch_async"],
+        )
+    # workers run with the same timeout as the coordinator waiting on them, so they're told to
+    # finish while the coordinator still has time to clean up after them
+    deadline = None
+    remaining = remainingMillis(context)
+    if dispatcher.waitsForResults and remaining is not None:
+        deadline = time.time() + (remaining - settings["min_remaining_ms"]) / 1000
+    report.update(
+        coordinate(dueInstances, settings["shard_size"], dispatcher, deadline=deadline)
+    )
+
+    # the workers leave VPC endpoint cleanup to us when we wait for their results
+    if (
+        report["endpoints"] is None
+        and dispatcher.waitsForResults
+        and not settings["dry_run"]
+        and any(r["outcome"] in STOPPED_OUTCOMES for r in report["results"])
+    ):
+        with timed("endpoint_cleanup"):
+            report["endpoints"] = cleanupEndpoints(lazyClient("ec2"))
+    return addClusters(report, settings, store, context=context)
+
+
+def runCounts(report):
+    # the run level numbers sent as metrics alongside the phase timings
+    results = report.get("results")
+    if results is None and "targets" in report:
+        results = [
+            r for target in report["targets"].values() for r in target["results"]
+        ]
+    results = results or []
+    return {
+        "ApiCalls": sum(stats["calls"] for stats in report["api"].values()),
+        "SqlCalls": report["timings"]["sql_calls"],
+        "InstancesChecked": len(results),
+        "InstancesStopped": sum(
+            1 for r in results if r["outcome"] in ("stopped", "stopped_unreachable")
+        ),
+        "StopsConfirmed": (
+            report["totals"].get("stops_confirmed", 0)
+            if "totals" in report
+            else (report.get("stops") or {}).get("confirmed", 0)
+        ),
+    }
+
+
+def coldStart():
+    # whether this is the container's first invocation, and what it cost to get here: the
+    # module imports, and everything from the start of the imports to the handler being called
+    with _lock:
+        _invocations["count"] += 1
+        cold = _invocations["count"] == 1
+    return {
+        "cold": cold,
+        "import_ms": round(IMPORT_SECONDS * 1000, 1),
+        "init_ms": (
+            round((time.perf_counter() - _importStarted) * 1000, 1) if cold else None
+        ),
+    }
+
+
+def execute(settings, event, context=None, clientFor=None):
+    # one run of the function, returning its report. shared by lambda_handler and the command
+    # line (cli.py), so a run from a workstation goes through exactly what runs in Lambda
+    # clientFor replaces the AWS clients of a single account and region sweep
+    started = coldStart()
+    configureClients(
+        poolSize=settings["client_pool_size"]
+        or max(DEFAULT_POOL_SIZE, settings["probe_concurrency"] + STOP_WORKERS)
+    )
+    configureThrottling(
+        rates=settings["api_rate_limits"], maxAttempts=settings["api_max_attempts"]
+    )
+    apiBefore = apiStats()
+    # sessions cached by earlier warm invocations that have gone unused too long
+    closeIdleConnections(settings["connection_max_idle"])
+    store = openStateStore(settings)
+    recorder, startedRun = startRun()
+
+    try:
+        if isinstance(event, dict) and event.get("mode") == "worker":
+            # a shard of instances sent by the coordinator
+            report = checkInstances(
+                settings,
+                store,
+                event["instances"],
+                context=context,
+                clientFor=clientFor,
+                cleanEndpoints=event.get("cleanup_endpoints", True),
+                deadline=event.get("deadline"),
+            )
+            if event.get("defer_endpoint_cleanup") and any(
+                r["outcome"] in STOPPED_OUTCOMES for r in report["results"]
+            ):
+                store.put(CLEANUP_DUE_KEY, {"requested_at": time.time()})
+        elif settings["shard_size"] > 0:
+            report = coordinatorSweep(settings, store, context=context)
+        elif settings["fleet_targets"]:
+            report = sweepTargets(settings, store, context=context)
+        else:
+            report = sweep(settings, store, context=context, clientFor=clientFor)
+
+        # calls, retries and throttles per AWS API operation, for this invocation only
+        report["api"] = apiStats(since=apiBefore)
+        # how long each phase took. a worker run in process reports into its coordinator's run
+        report["timings"] = recorder.summary() if startedRun else None
+        # only the invocation that set the module up pays for it
+        report["cold_start"] = dict(started, pymysql_loaded=pymysql is not None)
+        if startedRun and settings["emf_output"]:
+            emitEmf(
+                emfDocuments(
+                    recorder,
+                    runCounts(report),
+                    namespace=settings["metrics_namespace"],
+                    functionName=os.environ.get("AWS_LAMBDA_FUNCTION_NAME"),
+                )
+            )
+    finally:
+        finishRun(recorder, startedRun)
+    return report
+
+
+def lambda_handler(event, context):
+    report = execute(loadSettings(), event, context)
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"message": "Success", **report}),
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import app
+from activity import DETECTORS
+from clients import lazyClient
+from inventory import InventoryRDS, loadInventory
+from settings import loadSettings
+
+# runs the same sweep as the Lambda function from the command line, through app.execute, so a
+# local run (or a profile of one) goes through exactly the code that runs in production. e.g.
+#   python local.py --region us-west-2 --dry-run
+#   python lambda-rds-mysql-idle-shutdown/idle_shutdown --inventory fleet.json --format json
+# settings without a flag of their own come from the environment, same as in Lambda, or --set
+
+FORMATS = ("text", "json")
+# settings that are different when run by hand: EMF lines would be mixed in with the report
+CLI_ENVIRONMENT = {"EMF_OUTPUT": "false"}
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(
+        description="Find idle RDS MySQL instances and stop them, like the Lambda function does"
+    )
+    parser.add_argument(
+        "--region",
+        action="append",
+        default=[],
+        help="region to sweep, can be repeated. defaults to the AWS CLI's region",
+    )
+    parser.add_argument(
+        "--inventory",
+        metavar="FILE",
+        help="list instances from this JSON snapshot (aws rds describe-db-instances output) "
+        "instead of the RDS API",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, help="instances to check at the same time"
+    )
+    parser.add_argument("--detector", choices=DETECTORS, help="how to tell idle")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report the idle instances, but don't stop them or delete VPC endpoints",
+    )
+    parser.add_argument("--state-file", help="remember activity between runs here")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="any other setting from template.yaml, can be repeated",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="text")
+    parser.add_argument(
+        "--verbose", action="store_true", help="log every instance as it's checked"
+    )
+    args = parser.parse_args(argv)
+
+    if args.inventory and len(args.region) > 1:
+        parser.error("--inventory is a snapshot of one region, it can't be combined")
+    for entry in args.set:
+        if "=" not in entry:
+            parser.error(f"--set should look like NAME=VALUE, got {entry}")
+    return args
+
+
+def environmentFor(args, environ):
+    environment = dict(environ, **CLI_ENVIRONMENT)
+    environment.update(entry.split("=", 1) for entry in args.set)
+    if len(args.region) > 1:
+        environment["FLEET_TARGETS"] = ",".join(args.region)
+    if args.concurrency is not None:
+        environment["PROBE_CONCURRENCY"] = str(args.concurrency)
+    if args.detector:
+        environment["IDLE_DETECTOR"] = args.detector
+    if args.dry_run:
+        environment["DRY_RUN"] = "true"
+    if args.state_file:
+        environment["STATE_FILE"] = args.state_file
+    if args.inventory:
+        # the snapshot doesn't change, so it can't show the stops getting anywhere
+        environment["STOP_CONFIRM"] = "false"
+        # every instance in the snapshot gets checked, not shared out to workers
+        environment["SHARD_SIZE"] = "0"
+    return environment
+
+
+def resultsOf(report):
+    if "targets" in report:
+        return [
+            dict(result, target=label)
+            for label, target in report["targets"].items()
+            for result in target["results"]
+        ]
+    return report.get("results") or []
+
+
+def formatText(report):
+    lines = []
+    results = resultsOf(report)
+    for result in results:
+        label = f'{result["target"]}/' if "target" in result else ""
+        error = f' - {result["error"]}' if result.get("error") else ""
+        lines.append(f'{label}{result["instance"]}: {result["outcome"]}{error}')
+    for result in (report.get("clusters") or {}).get("results", []):
+        lines.append(f'{result["cluster"]} (cluster): {result["outcome"]}')
+
+    outcomes = {}
+    for result in results:
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+    summary = ", ".join(
+        f"{count} {outcome}" for outcome, count in sorted(outcomes.items())
+    )
+    lines.append(f"{len(results)} instances checked: {summary or 'none'}")
+    for saving in (report.get("stops") or {}).get("savings", []):
+        lines.append(
+            f'Confirmed stopped: {saving["instance"]} ({saving["instance_class"]})'
+        )
+    if report.get("timings"):
+        lines.append(f'Took {report["timings"]["wall_ms"]} ms')
+    return "\n".join(lines)
+
+
+def main(argv=None, environ=None):
+    args = parseArgs(argv)
+    environment = environmentFor(args, os.environ if environ is None else environ)
+    # app sets logging up to stderr at WARNING, where the sweep logs a line or two per instance
+    logging.getLogger().setLevel(logging.WARNING if args.verbose else logging.ERROR)
+    if len(args.region) == 1:
+        # boto3 picks the region up from the environment
+        os.environ["AWS_DEFAULT_REGION"] = args.region[0]
+
+    clientFor = None
+    if args.inventory:
+        snapshot = loadInventory(args.inventory)
+
+        def clientFor(service):
+            if service == "rds":
+                return InventoryRDS(snapshot, lazyClient("rds"))
+            return lazyClient(service)
+
+    report = app.execute(loadSettings(environment), {}, clientFor=clientFor)
+
+    if args.format == "json":
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print(formatText(report))
+    # non zero if any instance couldn't be checked, so scripts can tell
+    return 1 if any(r["outcome"] == "error" for r in resultsOf(report)) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
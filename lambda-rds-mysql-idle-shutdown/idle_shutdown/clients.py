@@ -0,0 +1,116 @@
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+from instrumentation import timed
+from throttling import CLIENT_CONFIG, throttleClient
+
+# boto3 clients are built once per container and reused by every warm invocation
+# clients are thread safe, so the same one is shared by all the probe threads
+# clients for another account are built from assumed role credentials, and are rebuilt a few
+# minutes before those credentials expire
+# every client is rate limited and retried by throttling.py, per service, account and region
+# lazyClient hands out a stand in that only builds the real client when it's first used, so a
+# run that never needs (say) SSM or EC2 never pays the few hundred ms it takes to build one
+_clients = {}
+_clientsLock = threading.Lock()
+_lazyClients = {}
+
+ROLE_SESSION_NAME = "rds-idle-shutdown"
+ROLE_REFRESH_SECONDS = 5 * 60
+# botocore keeps 10 HTTP connections per client by default, fewer than the probe and stop
+# threads that share one client, which then queue for a connection
+DEFAULT_POOL_SIZE = 10
+# a synchronous Invoke only answers once the worker has finished, which can be up to Lambda's
+# 15 minute limit, far past botocore's 60 second read timeout. the pool lets every shard's
+# invoke wait at the same time instead of queueing for a connection
+LAMBDA_READ_TIMEOUT_SECONDS = 15 * 60 + 30
+LAMBDA_POOL_SIZE = 64
+# settings for one service's clients, on top of the ones every client gets
+SERVICE_CONFIGS = {
+    "lambda": Config(
+        read_timeout=LAMBDA_READ_TIMEOUT_SECONDS, max_pool_connections=LAMBDA_POOL_SIZE
+    ),
+}
+_settings = {"config": CLIENT_CONFIG}
+
+
+class LazyClient:
+    def __init__(self, service, region=None, roleArn=None):
+        self.service = service
+        self.region = region
+        self.roleArn = roleArn
+
+    def __getattr__(self, name):
+        # looked up on every use, so assumed role clients are still refreshed when they expire
+        return getattr(getClient(self.service, self.region, self.roleArn), name)
+
+
+def lazyClient(service, region=None, roleArn=None):
+    key = (service, region, roleArn)
+    with _clientsLock:
+        if key not in _lazyClients:
+            _lazyClients[key] = LazyClient(service, region, roleArn)
+        return _lazyClients[key]
+
+
+def configureClients(poolSize=DEFAULT_POOL_SIZE):
+    # applies to clients built from now on, the ones already cached keep their pool
+    with _clientsLock:
+        _settings["config"] = CLIENT_CONFIG.merge(
+            Config(max_pool_connections=max(1, poolSize))
+        )
+
+
+def assumeRole(roleArn):
+    credentials = getClient("sts").assume_role(
+        RoleArn=roleArn, RoleSessionName=ROLE_SESSION_NAME
+    )["Credentials"]
+    session = boto3.Session(
+        aws_access_key_id=credentials["AccessKeyId"],
+        aws_secret_access_key=credentials["SecretAccessKey"],
+        aws_session_token=credentials["SessionToken"],
+    )
+    return session, credentials["Expiration"].timestamp() - ROLE_REFRESH_SECONDS
+
+
+def clientConfig(service):
+    config = _settings["config"]
+    if service in SERVICE_CONFIGS:
+        config = config.merge(SERVICE_CONFIGS[service])
+    return config
+
+
+def getClient(service, region=None, roleArn=None):
+    key = (service, region, roleArn)
+    if roleArn is None:
+        with _clientsLock:
+            if key not in _clients:
+                with timed("client_init"):
+                    client = boto3.client(
+                        service, region_name=region, config=clientConfig(service)
+                    )
+                _clients[key] = (throttleClient(client, key), None)
+            return _clients[key][0]
+
+    with _clientsLock:
+        client, expires = _clients.get(key, (None, 0))
+        if client is not None and time.time() < expires:
+            return client
+
+    session, expires = assumeRole(roleArn)
+    with timed("client_init"):
+        client = session.client(
+            service, region_name=region, config=clientConfig(service)
+        )
+    client = throttleClient(client, key)
+    with _clientsLock:
+        _clients[key] = (client, expires)
+    return client
+
+
+def resetClients():
+    with _clientsLock:
+        _clients.clear()
@@ -0,0 +1,127 @@
+import logging
+from datetime import timedelta
+
+from probing import instanceLabel
+
+METRICS_OFF = "off"
+METRICS_ONLY = "only"
+METRICS_PREFILTER = "prefilter"
+METRICS_MODES = (METRICS_OFF, METRICS_ONLY, METRICS_PREFILTER)
+
+IDLE = "idle"
+ACTIVE = "active"
+BORDERLINE = "borderline"
+
+METRICS = ("DatabaseConnections", "ReadIOPS", "WriteIOPS", "CPUUtilization")
+
+# GetMetricData takes at most 500 queries per call
+MAX_QUERIES_PER_CALL = 500
+
+# the idle check itself logs in, which shows up as a connection for a minute or so
+PROBE_CONNECTION_MINUTES = 2
+
+# a minute or two of missing datapoints at the edges of the window is normal
+MISSING_MINUTES_ALLOWED = 5
+
+
+def fetchFleetMetrics(cloudwatch, instances, end, windowSeconds):
+    # pulls one datapoint per minute for every metric of every instance over the window,
+    # packing as many queries into each GetMetricData call as it allows
+    # returns {DBInstanceIdentifier: {metric name: [values]}}
+    queries = []
+    lookup = {}
+    for index, instance in enumerate(instances):
+        for metricIndex, metric in enumerate(METRICS):
+            queryId = f"m{index}_{metricIndex}"
+            lookup[queryId] = (instance["DBInstanceIdentifier"], metric)
+            queries.append(
+                {
+                    "Id": queryId,
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": "AWS/RDS",
+                            "MetricName": metric,
+                            "Dimensions": [
+                                {
+                                    "Name": "DBInstanceIdentifier",
+                                    "Value": instance["DBInstanceIdentifier"],
+                                }
+                            ],
+                        },
+                        "Period": 60,
+                        "Stat": "Maximum",
+                    },
+                    "ReturnData": True,
+                }
+            )
+
+    series = {
+        instance["DBInstanceIdentifier"]: {metric: [] for metric in METRICS}
+        for instance in instances
+    }
+    calls = 0
+    for start in range(0, len(queries), MAX_QUERIES_PER_CALL):
+        request = {
+            "MetricDataQueries": queries[start : start + MAX_QUERIES_PER_CALL],
+            "StartTime": end - timedelta(seconds=windowSeconds),
+            "EndTime": end,
+        }
+        while True:
+            response = cloudwatch.get_metric_data(**request)
+            calls += 1
+            for result in response["MetricDataResults"]:
+                instanceId, metric = lookup[result["Id"]]
+                series[instanceId][metric].extend(result["Values"])
+            if not response.get("NextToken"):
+                break
+            request["NextToken"] = response["NextToken"]
+
+    return series, calls
+
+
+def classifyMetrics(metrics, windowSeconds, cpuThreshold, iopsThreshold):
+    # idle: nobody connected, and CPU and IO stayed at background levels for the whole window
+    # active: somebody other than the idle check was connected
+    # borderline: anything in between, or not enough data to say (e.g. it only just started)
+    # with a short IDLE_MINUTES the allowance would leave nothing expected, so at least one
+    # datapoint of every metric is always needed
+    expected = max(1, windowSeconds // 60 - MISSING_MINUTES_ALLOWED)
+    if any(len(metrics[metric]) < expected for metric in METRICS):
+        return BORDERLINE
+
+    connectedMinutes = len([v for v in metrics["DatabaseConnections"] if v > 0])
+    if connectedMinutes > PROBE_CONNECTION_MINUTES:
+        return ACTIVE
+
+    quiet = (
+        max(metrics["CPUUtilization"]) <= cpuThreshold
+        and max(metrics["ReadIOPS"]) + max(metrics["WriteIOPS"]) <= iopsThreshold
+    )
+    if connectedMinutes == 0 and quiet:
+        return IDLE
+    return BORDERLINE
+
+
+def classifyFleet(
+    cloudwatch, instances, end, windowSeconds, cpuThreshold, iopsThreshold
+):
+    series, calls = fetchFleetMetrics(cloudwatch, instances, end, windowSeconds)
+    verdicts = {}
+    for instance in instances:
+        verdicts[instance["DBInstanceIdentifier"]] = classifyMetrics(
+            series[instance["DBInstanceIdentifier"]],
+            windowSeconds,
+            cpuThreshold,
+            iopsThreshold,
+        )
+        logging.warning(
+            f'{instanceLabel(instance)}: CloudWatch metrics say {verdicts[instance["DBInstanceIdentifier"]]}'
+        )
+
+    summary = {
+        "get_metric_data_calls": calls,
+        IDLE: list(verdicts.values()).count(IDLE),
+        ACTIVE: list(verdicts.values()).count(ACTIVE),
+        BORDERLINE: list(verdicts.values()).count(BORDERLINE),
+    }
+    return verdicts, summary
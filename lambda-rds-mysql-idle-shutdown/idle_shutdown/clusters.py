@@ -0,0 +1,95 @@
+import logging
+
+from exemptions import isExemptByTags
+from instrumentation import timed
+
+# MySQL compatible Aurora. their instances can't be stopped on their own, only the whole cluster
+AURORA_MYSQL_ENGINES = ("aurora", "aurora-mysql")
+
+
+def isClusterMember(instance):
+    return (
+        instance.get("DBClusterIdentifier") is not None
+        and instance.get("Engine") in AURORA_MYSQL_ENGINES
+    )
+
+
+def listClusters(rds):
+    # yields (cluster, members) for every Aurora MySQL cluster, writer first then readers
+    # members are fetched with one describe_db_instances per page of clusters, not one per cluster
+    clusterPages = rds.get_paginator("describe_db_clusters").paginate(
+        Filters=[{"Name": "engine", "Values": list(AURORA_MYSQL_ENGINES)}]
+    )
+    for page in clusterPages:
+        clusters = page["DBClusters"]
+        if not clusters:
+            continue
+        members = {}
+        instancePages = rds.get_paginator("describe_db_instances").paginate(
+            Filters=[
+                {
+                    "Name": "db-cluster-id",
+                    "Values": [c["DBClusterIdentifier"] for c in clusters],
+                }
+            ]
+        )
+        for instancePage in instancePages:
+            for instance in instancePage["DBInstances"]:
+                members[instance["DBInstanceIdentifier"]] = instance
+
+        for cluster in clusters:
+            ordered = sorted(
+                cluster.get("DBClusterMembers", []),
+                key=lambda m: not m.get("IsClusterWriter"),
+            )
+            yield cluster, [
+                members[m["DBInstanceIdentifier"]]
+                for m in ordered
+                if m["DBInstanceIdentifier"] in members
+            ]
+
+
+def isClusterExempt(cluster, members):
+    # exempt if the cluster, or any one of its instances, is tagged exempt
+    if isExemptByTags(
+        {"DBInstanceIdentifier": cluster["DBClusterIdentifier"]},
+        cluster.get("TagList", []),
+    ):
+        return True
+    return any(isExemptByTags(m, m.get("TagList", [])) for m in members)
+
+
+def clusterDecision(memberResults, idleOutcomes):
+    # the cluster is only idle if every instance in it is. otherwise the outcome says why not
+    outcomes = [r["outcome"] for r in memberResults]
+    if outcomes and all(o in idleOutcomes for o in outcomes):
+        return "idle"
+    for outcome in ("error", "out_of_time", "unreachable", "not_available"):
+        if outcome in outcomes:
+            return outcome
+    return "not_idle"
+
+
+def clusterResult(cluster, outcome, members=None, error=None):
+    return {
+        "cluster": cluster["DBClusterIdentifier"],
+        "address": cluster.get("Endpoint"),
+        "outcome": outcome,
+        "error": error,
+        "members": members or [],
+    }
+
+
+def stopCluster(rds, cluster):
+    try:
+        with timed("stop"):
+            rds.stop_db_cluster(DBClusterIdentifier=cluster["DBClusterIdentifier"])
+        logging.warning(
+            f'{cluster["DBClusterIdentifier"]}: Successfully issued cluster shutdown command.'
+        )
+    except Exception as e:
+        logging.error(
+            f'{cluster["DBClusterIdentifier"]}: Failed to stop Aurora cluster. Traceback follows.'
+        )
+        logging.error(str(e))
+        raise
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import timed
+
+# logging in to MySQL without SSM, and without a fresh connection for every check
+# with DB_AUTH=iam the password is an IAM auth token from generate_db_auth_token. tokens are
+# signed locally and are good for 15 minutes, so one is kept per endpoint and user and handed
+# out again until shortly before it runs out
+# with CONNECTION_REUSE on, a connection is put back in the cache after a clean check instead of
+# being closed, so the next check of that endpoint (in this invocation, or a later warm one on a
+# short schedule) skips the TCP and TLS handshakes and the login. a cached connection is pinged
+# before it's used, and a new one is opened if it has died. a connection is only ever used by
+# one thread at a time: it's taken out of the cache while it's in use
+# a cached connection is a session on the instance, so it counts in DatabaseConnections. that
+# would keep the CloudWatch metrics modes calling the instance active for as long as it stays
+# cached, which is why CONNECTION_REUSE can't be combined with METRICS_MODE. connections left
+# unused for longer than CONNECTION_MAX_IDLE are closed at the start of each run rather than
+# held until MySQL's wait_timeout closes them
+
+SSM_AUTH = "ssm"
+IAM_AUTH = "iam"
+DB_AUTH_MODES = (SSM_AUTH, IAM_AUTH)
+
+TOKEN_TTL_SECONDS = 15 * 60
+# a token this close to running out is replaced rather than handed out again
+TOKEN_REFRESH_SECONDS = 60
+
+_tokens = {}
+_tokensLock = threading.Lock()
+_connections = {}
+_connectionsLock = threading.Lock()
+
+
+def authToken(rds, host, port, user, now=None):
+    if now is None:
+        now = time.time()
+    region = rds.meta.region_name
+    key = (host, port, user, region)
+    with _tokensLock:
+        cached = _tokens.get(key)
+        if cached is not None and now < cached["expires"]:
+            return cached["token"]
+
+    with timed("auth_token"):
+        token = rds.generate_db_auth_token(
+            DBHostname=host, Port=port, DBUsername=user, Region=region
+        )
+    with _tokensLock:
+        _tokens[key] = {
+            "token": token,
+            "expires": now + TOKEN_TTL_SECONDS - TOKEN_REFRESH_SECONDS,
+        }
+    return token
+
+
+def invalidateToken(host=None, port=None, user=None):
+    # call this when a token is refused, so the next login signs a new one
+    with _tokensLock:
+        if host is None:
+            _tokens.clear()
+            return
+        for key in [k for k in _tokens if k[:3] == (host, port, user)]:
+            del _tokens[key]
+
+
+def sslOptions(iam, caBundle=None):
+    # pymysql's ssl argument. IAM logins are only accepted over TLS. with a CA bundle (the RDS
+    # one) the server's certificate is checked, otherwise the connection is encrypted but not
+    # verified. password logins only use TLS if there is a CA bundle to check against
+    if caBundle:
+        return {"ca": caBundle}
+    if iam:
+        return {"check_hostname": False}
+    return None
+
+
+def closeQuietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def checkout(key, maxIdleSeconds, now=None):
+    # a cached connection for key that still answers, or None
+    if now is None:
+        now = time.time()
+    with _connectionsLock:
+        cached = _connections.pop(key, None)
+    if cached is None:
+        return None
+
+    connection, lastUsed = cached
+    if now - lastUsed > maxIdleSeconds:
+        closeQuietly(connection)
+        return None
+    try:
+        with timed("ping"):
+            connection.ping(reconnect=False)
+    except Exception as e:
+        logging.warning(f"{key[0]}: Cached connection has gone away - {str(e)}")
+        closeQuietly(connection)
+        return None
+    return connection
+
+
+def checkin(key, connection, now=None):
+    if now is None:
+        now = time.time()
+    with _connectionsLock:
+        previous = _connections.get(key)
+        _connections[key] = (connection, now)
+    if previous is not None and previous[0] is not connection:
+        # another thread checked the same endpoint at the same time, only one is kept
+        closeQuietly(previous[0])
+
+
+@contextmanager
+def reusableConnection(key, connect, reuse=False, maxIdleSeconds=600):
+    # key is (host, port, user). connect() opens a new connection when there isn't a live one
+    # cached. the connection is only cached again if the block finishes without an exception
+    connection = checkout(key, maxIdleSeconds) if reuse else None
+    if connection is None:
+        connection = connect()
+    try:
+        yield connection
+    except BaseException:
+        closeQuietly(connection)
+        raise
+    if reuse:
+        checkin(key, connection)
+    else:
+        connection.close()
+
+
+def closeIdleConnections(maxIdleSeconds, now=None):
+    if now is None:
+        now = time.time()
+    with _connectionsLock:
+        stale = [
+            key
+            for key, (_, lastUsed) in _connections.items()
+            if now - lastUsed > maxIdleSeconds
+        ]
+        cached = [_connections.pop(key) for key in stale]
+    for connection, _ in cached:
+        closeQuietly(connection)
+    return len(cached)
+
+
+def closeConnections():
+    with _connectionsLock:
+        cached = list(_connections.values())
+        _connections.clear()
+    for connection, _ in cached:
+        closeQuietly(connection)
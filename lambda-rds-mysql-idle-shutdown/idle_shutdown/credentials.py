@@ -0,0 +1,50 @@
+import threading
+import time
+
+from instrumentation import timed
+
+USERNAME_PATH = "/platform/rds-idle-shutdown-username"
+PASSWORD_PATH = "/platform/rds-idle-shutdown-password"
+
+# username and password for the idle check user, kept for the life of the container so warm
+# invocations don't go back to SSM (and KMS) for every instance
+# keyed by SSM client, because each account and region has its own parameters
+_cache = {}
+_cacheLock = threading.Lock()
+
+
+def fetchCredentials(ssmClient):
+    # both parameters in one call. the username isn't encrypted but WithDecryption is harmless
+    response = ssmClient.get_parameters(
+        Names=[USERNAME_PATH, PASSWORD_PATH], WithDecryption=True
+    )
+    if response.get("InvalidParameters"):
+        raise ValueError(
+            f'SSM parameters not found: {", ".join(response["InvalidParameters"])}'
+        )
+    values = {p["Name"]: p["Value"] for p in response["Parameters"]}
+    return values[USERNAME_PATH], values[PASSWORD_PATH]
+
+
+def getCredentials(ssmClient, ttl=300, now=None):
+    # returns (user, password). the lock is held while fetching so that a sweep full of probe
+    # threads only makes one SSM call between them
+    if now is None:
+        now = time.time()
+    with _cacheLock:
+        cached = _cache.get(ssmClient)
+        if cached is None or now >= cached["expires"]:
+            with timed("ssm_fetch"):
+                credentials = fetchCredentials(ssmClient)
+            cached = {"credentials": credentials, "expires": now + ttl}
+            _cache[ssmClient] = cached
+        return cached["credentials"]
+
+
+def invalidateCredentials(ssmClient=None):
+    # call this when a login is refused, so the next lookup goes back to SSM
+    with _cacheLock:
+        if ssmClient is None:
+            _cache.clear()
+        else:
+            _cache.pop(ssmClient, None)
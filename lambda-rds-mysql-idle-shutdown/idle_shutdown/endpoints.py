@@ -0,0 +1,70 @@
+import logging
+
+EXEMPT_TAG = "VPCENDPOINTS_IDLE_EXEMPT"
+
+# endpoints deleted per delete_vpc_endpoints call
+DELETE_BATCH_SIZE = 25
+# state store key a fire and forget shard worker sets when it stopped something, so the
+# coordinator's next run does the cleanup once. can't clash with a DBInstanceIdentifier
+CLEANUP_DUE_KEY = "#endpoint-cleanup-due"
+
+
+def getTag(tags, searchTag):
+    for tag in tags:
+        if tag["Key"].upper() == str(searchTag).upper():
+            if str(tag["Value"]).upper() == "TRUE":
+                return True
+    return False
+
+
+def cleanupEndpoints(client):
+    # runs once after the sweep rather than once per stopped instance:
+    # one paged listing, the exemption tag checked from that listing, then deletes in batches
+    stats = {
+        "total": 0,
+        "deleted": 0,
+        "retained": 0,
+        "failed": 0,
+        "describe_calls": 0,
+        "delete_calls": 0,
+    }
+
+    toDelete = []
+    # could use Filter but its case sensitive sadface
+    for page in client.get_paginator("describe_vpc_endpoints").paginate():
+        stats["describe_calls"] += 1
+        for endpoint in page["VpcEndpoints"]:
+            stats["total"] += 1
+            # if vpcendpoints_idle_exempt tag is present and set to true, then this won't run
+            # but if its not present, or present and set to false, then it will run
+            if getTag(endpoint.get("Tags", []), EXEMPT_TAG):
+                stats["retained"] += 1
+            else:
+                toDelete.append(endpoint["VpcEndpointId"])
+
+    for start in range(0, len(toDelete), DELETE_BATCH_SIZE):
+        batch = toDelete[start : start + DELETE_BATCH_SIZE]
+        stats["delete_calls"] += 1
+        try:
+            response = client.delete_vpc_endpoints(VpcEndpointIds=batch)
+        except Exception as e:
+            logging.error(
+                f'Failed to delete VPC endpoints {", ".join(batch)} - {str(e)}'
+            )
+            stats["failed"] += len(batch)
+            continue
+
+        # the call succeeds as a whole even if some endpoints couldn't be deleted
+        unsuccessful = response.get("Unsuccessful", [])
+        for item in unsuccessful:
+            logging.error(
+                f'{item["ResourceId"]}: Failed to delete - {item["Error"]["Message"]}'
+            )
+        stats["failed"] += len(unsuccessful)
+        stats["deleted"] += len(batch) - len(unsuccessful)
+
+    stats["retained"] += stats["failed"]
+    logging.warning(
+        f'Finished endpoint check. {stats["deleted"]} deleted, {stats["retained"]} retained, {stats["total"]} endpoints total.'
+    )
+    return stats
@@ -0,0 +1,93 @@
+import logging
+
+from probing import instanceLabel
+
+EXEMPT_TAG = "RDS_IDLE_EXEMPT"
+
+
+def isExemptByTags(instance, tags):
+    for tag in tags:
+        if str(tag["Key"]).upper() == EXEMPT_TAG:
+            if str(tag["Value"]).upper() == "TRUE":
+                return True
+            elif str(tag["Value"]).upper() == "FALSE":
+                return False
+            else:
+                logging.warning(
+                    f'{instanceLabel(instance)}: Found tag {EXEMPT_TAG} but value was not TRUE or FALSE, so defaulting to NOT idle exempt.  Found value was {tag["Value"]}'
+                )
+                return False
+    # nothing found so assume not exempt
+    logging.warning(
+        f"{instanceLabel(instance)}: Unable to find tag {EXEMPT_TAG}, so defaulting to NOT idle exempt"
+    )
+    return False
+
+
+def bulkTags(tagging, arns, stats):
+    # one paged walk of the Resource Groups Tagging API covers every rds:db in the region
+    # resources that have never been tagged may not be returned at all, so anything missing
+    # here still gets looked up individually. the walk stops once there are no more pages left
+    # to read than instances left to find, since looking those up one by one is no dearer
+    found = {}
+    paginator = tagging.get_paginator("get_resources").paginate(
+        ResourceTypeFilters=["rds:db"]
+    )
+    for page in paginator:
+        stats["bulk_calls"] += 1
+        for resource in page["ResourceTagMappingList"]:
+            if resource["ResourceARN"] in arns:
+                found[resource["ResourceARN"]] = resource.get("Tags", [])
+        if stats["bulk_calls"] >= len(arns) - len(found):
+            break
+    return found
+
+
+def resolveExemptions(rds, instances, tagging=None):
+    # works out which instances are exempt from idle shutdown, using the cheapest source available:
+    # 1. the TagList that describe_db_instances already returned (free)
+    # 2. a bulk Resource Groups Tagging API lookup for the whole fleet (a few paged calls)
+    # 3. list_tags_for_resource for whatever is left (one call per instance)
+    # the resolved tags are written back to instance["TagList"] so later stages can use them
+    stats = {
+        "instances": len(instances),
+        "tag_list_hits": 0,
+        "bulk_hits": 0,
+        "bulk_calls": 0,
+        "per_resource_calls": 0,
+    }
+
+    missing = {}
+    for instance in instances:
+        if instance.get("TagList") is not None:
+            stats["tag_list_hits"] += 1
+        else:
+            missing[instance["DBInstanceArn"]] = instance
+
+    # a single instance is never cheaper to find in bulk
+    if len(missing) > 1 and tagging is not None:
+        try:
+            for arn, tags in bulkTags(tagging, missing, stats).items():
+                missing.pop(arn)["TagList"] = tags
+                stats["bulk_hits"] += 1
+        except Exception as e:
+            logging.warning(
+                f"Bulk tag lookup failed, falling back to per instance lookups - {str(e)}"
+            )
+
+    for arn, instance in missing.items():
+        stats["per_resource_calls"] += 1
+        instance["TagList"] = rds.list_tags_for_resource(ResourceName=arn)["TagList"]
+
+    # the old behaviour was one list_tags_for_resource call per instance. a bulk walk that
+    # turned up few of the missing instances can still cost more than that, which shows in
+    # bulk_calls rather than as a negative saving
+    stats["api_calls_saved"] = max(
+        0, stats["instances"] - (stats["bulk_calls"] + stats["per_resource_calls"])
+    )
+
+    exempt = {
+        instance["DBInstanceArn"]: isExemptByTags(instance, instance["TagList"])
+        for instance in instances
+    }
+    return exempt, stats
@@ -0,0 +1,67 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parseTargets(value):
+    # FLEET_TARGETS is either a comma separated list of regions (this account), or a JSON list
+    # like [{"region": "us-west-2", "role_arn": "arn:aws:iam::123456789012:role/idle-shutdown"}]
+    if value is None or str(value).strip() == "":
+        return []
+    value = str(value).strip()
+    if not value.startswith("["):
+        return [
+            {"region": region.strip()} for region in value.split(",") if region.strip()
+        ]
+
+    targets = json.loads(value)
+    for target in targets:
+        if not target.get("region"):
+            raise ValueError(f"Fleet target is missing a region: {target}")
+    return targets
+
+
+def targetLabel(target):
+    # account id from the role ARN, or "local" for the account the function runs in
+    roleArn = target.get("role_arn")
+    account = roleArn.split(":")[4] if roleArn else "local"
+    return f'{account}/{target["region"]}'
+
+
+def sweepFleet(targets, sweepTarget):
+    # runs sweepTarget(target) for every region/account at the same time, so the run takes
+    # about as long as the slowest one. a target that fails doesn't affect the others
+    def run(target):
+        try:
+            return sweepTarget(target)
+        except Exception as e:
+            logging.error(
+                f"{targetLabel(target)}: Failed to sweep target. Traceback follows."
+            )
+            logging.error(str(e))
+            return {"error": str(e), "results": []}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as pool:
+        reports = list(pool.map(run, targets))
+
+    totals = {"targets": len(targets), "failed_targets": 0, "instances": 0}
+    # Aurora clusters are counted separately, as clusters_<outcome>
+    for report in reports:
+        if report.get("error"):
+            totals["failed_targets"] += 1
+        for result in report["results"]:
+            totals["instances"] += 1
+            totals[result["outcome"]] = totals.get(result["outcome"], 0) + 1
+        for result in (report.get("clusters") or {}).get("results", []):
+            key = f'clusters_{result["outcome"]}'
+            totals[key] = totals.get(key, 0) + 1
+        confirmed = (report.get("stops") or {}).get("confirmed", 0)
+        if confirmed:
+            totals["stops_confirmed"] = totals.get("stops_confirmed", 0) + confirmed
+
+    return {
+        "totals": totals,
+        "targets": {
+            targetLabel(target): report for target, report in zip(targets, reports)
+        },
+    }
@@ -0,0 +1,158 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# times every phase of a run (per instance where there is one) so slow sweeps can be charted
+# instead of worked out from the log lines. lambda_handler starts a run, the code being timed
+# wraps itself in timed(), and at the end the run is summarised into the function's output and
+# printed as CloudWatch Embedded Metric Format, which CloudWatch turns into metrics by itself
+# timed() does nothing when no run has been started, e.g. in unit tests
+
+NAMESPACE = "RDSIdleShutdown"
+# phases that are SQL statements, so they can be counted together
+QUERY_PREFIX = "query_"
+# EMF allows at most 100 values per metric in one document
+EMF_MAX_VALUES = 100
+SLOWEST_PROBES = 5
+
+_current = {"run": None}
+_currentLock = threading.Lock()
+
+
+class Recorder:
+    def __init__(self):
+        self.started = time.time()
+        self.samples = {}
+        self.probes = []
+        self.lock = threading.Lock()
+
+    def record(self, phase, seconds, instance=None):
+        with self.lock:
+            self.samples.setdefault(phase, []).append(seconds)
+            if phase == "probe" and instance is not None:
+                self.probes.append((seconds, instance.get("DBInstanceIdentifier")))
+
+    def summary(self):
+        with self.lock:
+            samples = {phase: sorted(values) for phase, values in self.samples.items()}
+            probes = sorted(self.probes, reverse=True)[:SLOWEST_PROBES]
+
+        phases = {}
+        for phase, values in sorted(samples.items()):
+            phases[phase] = {
+                "count": len(values),
+                "total_ms": milliseconds(sum(values)),
+                "p50_ms": milliseconds(percentile(values, 50)),
+                "p99_ms": milliseconds(percentile(values, 99)),
+                "max_ms": milliseconds(values[-1]),
+            }
+        return {
+            "wall_ms": milliseconds(time.time() - self.started),
+            "sql_calls": sum(
+                len(v) for p, v in samples.items() if p.startswith(QUERY_PREFIX)
+            ),
+            "phases": phases,
+            "slowest_probes": [
+                {"instance": instance, "ms": milliseconds(seconds)}
+                for seconds, instance in probes
+            ],
+        }
+
+    def values(self):
+        with self.lock:
+            return {phase: list(values) for phase, values in self.samples.items()}
+
+
+def percentile(values, p):
+    # nearest rank, values must already be sorted
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def startRun():
+    # a run that's already going (e.g. a worker run in process by the local dispatcher) keeps
+    # recording into the outer run's recorder
+    with _currentLock:
+        if _current["run"] is not None:
+            return _current["run"], False
+        _current["run"] = Recorder()
+        return _current["run"], True
+
+
+def finishRun(recorder, started):
+    if not started:
+        return
+    with _currentLock:
+        if _current["run"] is recorder:
+            _current["run"] = None
+
+
+@contextmanager
+def timed(phase, instance=None):
+    recorder = _current["run"]
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if recorder is not None:
+            recorder.record(phase, time.perf_counter() - started, instance)
+
+
+def emfDocuments(recorder, counts, namespace=NAMESPACE, functionName=None):
+    # one document per phase with every duration in it (CloudWatch works out p50/p99 from the
+    # raw values), split into chunks of 100, plus one document with the run's counts
+    timestamp = int(time.time() * 1000)
+    dimensions = ["FunctionName", "Phase"] if functionName else ["Phase"]
+    documents = []
+    for phase, values in sorted(recorder.values().items()):
+        for start in range(0, len(values), EMF_MAX_VALUES):
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": namespace,
+                            "Dimensions": [dimensions],
+                            "Metrics": [{"Name": "Duration", "Unit": "Milliseconds"}],
+                        }
+                    ],
+                },
+                "Phase": phase,
+                "Duration": [
+                    milliseconds(v) for v in values[start : start + EMF_MAX_VALUES]
+                ],
+            }
+            if functionName:
+                document["FunctionName"] = functionName
+            documents.append(document)
+
+    document = {
+        "_aws": {
+            "Timestamp": timestamp,
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [["FunctionName"]] if functionName else [[]],
+                    "Metrics": [{"Name": name, "Unit": "Count"} for name in counts],
+                }
+            ],
+        },
+        **counts,
+    }
+    if functionName:
+        document["FunctionName"] = functionName
+    documents.append(document)
+    return documents
+
+
+def emitEmf(documents):
+    # EMF is picked up from the function's stdout, one JSON document per line
+    for document in documents:
+        print(json.dumps(document), flush=True)
@@ -0,0 +1,69 @@
+import json
+
+# sweeping from a JSON snapshot of the fleet instead of listing it from the RDS API, e.g. to
+# rerun yesterday's fleet, or one from another account, from a workstation
+# a snapshot is the output of `aws rds describe-db-instances`, optionally with the DBClusters
+# from `aws rds describe-db-clusters` added alongside the DBInstances. or just a list of
+# instances. TagList comes with both, so exemptions work without the tagging API
+
+# the describe filters the sweep uses, and the field each one matches on
+FILTER_FIELDS = {
+    "db-instance-id": "DBInstanceIdentifier",
+    "db-cluster-id": "DBClusterIdentifier",
+    "engine": "Engine",
+}
+PAGE_SIZE = 100
+
+
+def loadInventory(path):
+    with open(path) as f:
+        snapshot = json.load(f)
+    if isinstance(snapshot, list):
+        snapshot = {"DBInstances": snapshot}
+    if not isinstance(snapshot.get("DBInstances"), list):
+        raise ValueError(f"{path} has no DBInstances list")
+    return {
+        "DBInstances": snapshot["DBInstances"],
+        "DBClusters": snapshot.get("DBClusters") or [],
+    }
+
+
+def matches(item, filters):
+    for entry in filters or []:
+        field = FILTER_FIELDS.get(entry["Name"])
+        if field is None:
+            raise ValueError(
+                f'Inventory snapshots can\'t be filtered by {entry["Name"]}'
+            )
+        if item.get(field) not in entry["Values"]:
+            return False
+    return True
+
+
+class SnapshotPaginator:
+    def __init__(self, items, key):
+        self.items = items
+        self.key = key
+
+    def paginate(self, Filters=None, **kwargs):
+        items = [item for item in self.items if matches(item, Filters)]
+        for start in range(0, max(1, len(items)), PAGE_SIZE):
+            yield {self.key: [dict(item) for item in items[start : start + PAGE_SIZE]]}
+
+
+class InventoryRDS:
+    # stands in for the RDS client. instances and clusters are listed from the snapshot, and
+    # everything else (stops, auth tokens, tag lookups) goes to the real client
+    def __init__(self, snapshot, rds):
+        self.snapshot = snapshot
+        self.rds = rds
+
+    def get_paginator(self, name):
+        if name == "describe_db_instances":
+            return SnapshotPaginator(self.snapshot["DBInstances"], "DBInstances")
+        if name == "describe_db_clusters":
+            return SnapshotPaginator(self.snapshot["DBClusters"], "DBClusters")
+        return self.rds.get_paginator(name)
+
+    def __getattr__(self, name):
+        return getattr(self.rds, name)
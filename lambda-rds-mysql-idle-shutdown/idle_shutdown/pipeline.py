@@ -0,0 +1,133 @@
+import logging
+import queue
+import threading
+import time
+
+# put on a stage's queue once everything upstream of it has finished
+DONE = object()
+
+
+def stage(name, work, workers=1, queueSize=100):
+    # work(item) returns an iterable of the items to hand to the next stage (empty to drop it)
+    # the queue in front of the stage holds at most queueSize items, so a fast stage blocks
+    # instead of buffering everything while a slow stage downstream catches up
+    return {"name": name, "work": work, "workers": workers, "queueSize": queueSize}
+
+
+def runPipeline(source, stages, sourceName="source"):
+    # feeds every item from source through the stages in order, each stage in its own threads,
+    # so a later stage starts on the first item while earlier stages are still producing more
+    # returns (the items out of the last stage, throughput stats per stage)
+    # if any stage raises, the pipeline stops taking new items and the first error is re-raised
+    started = time.monotonic()
+    queues = [queue.Queue(maxsize=max(1, s["queueSize"])) for s in stages]
+    outputs = []
+    failures = []
+    lock = threading.Lock()
+
+    stats = [
+        {
+            "stage": sourceName,
+            "workers": 1,
+            "items_in": 0,
+            "items_out": 0,
+            "busy_seconds": 0.0,
+        }
+    ] + [
+        {
+            "stage": s["name"],
+            "workers": max(1, s["workers"]),
+            "items_in": 0,
+            "items_out": 0,
+            "busy_seconds": 0.0,
+        }
+        for s in stages
+    ]
+    firstOutput = [None] * len(stats)
+    finished = [None] * len(stats)
+
+    def emit(index, item):
+        # hands an item from stats[index] to the next stage, or to the outputs after the last
+        with lock:
+            stats[index]["items_out"] += 1
+            if firstOutput[index] is None:
+                firstOutput[index] = time.monotonic() - started
+        if index < len(queues):
+            queues[index].put(item)
+        else:
+            with lock:
+                outputs.append(item)
+
+    def produce():
+        try:
+            for item in source:
+                if failures:
+                    break
+                emit(0, item)
+        except Exception as e:
+            logging.error(f"Pipeline {sourceName} failed - {str(e)}")
+            failures.append(e)
+        finished[0] = time.monotonic() - started
+        queues[0].put(DONE)
+
+    remaining = [max(1, s["workers"]) for s in stages]
+
+    def consume(index):
+        inbox = queues[index]
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                # let the other workers on this stage see it too
+                inbox.put(DONE)
+                break
+            if failures:
+                # keep draining so nothing upstream is left blocked on a full queue
+                continue
+            busyFrom = time.monotonic()
+            try:
+                with lock:
+                    stats[index + 1]["items_in"] += 1
+                for result in stages[index]["work"](item):
+                    emit(index + 1, result)
+            except Exception as e:
+                logging.error(
+                    f'Pipeline stage {stages[index]["name"]} failed - {str(e)}'
+                )
+                failures.append(e)
+            finally:
+                with lock:
+                    stats[index + 1]["busy_seconds"] += time.monotonic() - busyFrom
+
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            finished[index + 1] = time.monotonic() - started
+            if index + 1 < len(queues):
+                queues[index + 1].put(DONE)
+
+    threads = [threading.Thread(target=produce)]
+    for index, s in enumerate(stages):
+        threads.extend(
+            threading.Thread(target=consume, args=(index,))
+            for _ in range(max(1, s["workers"]))
+        )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if failures:
+        raise failures[0]
+
+    for index, stageStats in enumerate(stats):
+        elapsed = finished[index] or 0.0
+        stageStats["busy_seconds"] = round(stageStats["busy_seconds"], 3)
+        stageStats["first_output_seconds"] = (
+            None if firstOutput[index] is None else round(firstOutput[index], 3)
+        )
+        stageStats["elapsed_seconds"] = round(elapsed, 3)
+        stageStats["items_per_second"] = (
+            round(stageStats["items_out"] / elapsed, 1) if elapsed > 0 else None
+        )
+    return outputs, stats
@@ -0,0 +1,52 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+def instanceLabel(instance):
+    endpoint = instance.get("Endpoint") or {}
+    return endpoint.get("Address", instance.get("DBInstanceIdentifier", "unknown"))
+
+
+def probeResult(instance, outcome, error=None):
+    return {
+        "instance": instance.get("DBInstanceIdentifier"),
+        "address": instanceLabel(instance),
+        "outcome": outcome,
+        "error": error,
+    }
+
+
+def probeInstances(instances, probe, maxWorkers=1, shouldStart=None, slots=None):
+    # runs probe(instance) against every instance, with at most maxWorkers running at once
+    # results come back in the same order as instances, no matter which finished first
+    # a probe that blows up only fails its own instance - the rest of the sweep carries on
+    # if shouldStart is passed and returns False, probes that haven't started yet are skipped
+    # if slots (a semaphore) is passed, each probe holds one while it runs - this is how several
+    # sweeps running side by side share one concurrency limit
+    def attempt(instance):
+        if shouldStart is not None and not shouldStart():
+            logging.warning(
+                f"{instanceLabel(instance)}: Running out of time, not checking instance"
+            )
+            return probeResult(instance, "out_of_time")
+        try:
+            return probe(instance)
+        except Exception as e:
+            logging.error(
+                f"{instanceLabel(instance)}: Failed to check instance. Traceback follows."
+            )
+            logging.error(str(e))
+            return probeResult(instance, "error", error=str(e))
+
+    def run(instance):
+        if slots is None:
+            return attempt(instance)
+        with slots:
+            return attempt(instance)
+
+    instances = list(instances)
+    if maxWorkers <= 1 or len(instances) <= 1:
+        return [run(instance) for instance in instances]
+
+    with ThreadPoolExecutor(max_workers=min(maxWorkers, len(instances))) as pool:
+        return list(pool.map(run, instances))
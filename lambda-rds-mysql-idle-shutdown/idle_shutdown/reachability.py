@@ -0,0 +1,61 @@
+import logging
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from probing import instanceLabel
+
+SKIP = "skip"
+STOP = "stop"
+UNREACHABLE_POLICIES = (SKIP, STOP)
+
+# opening a TCP connection is cheap, so check plenty of endpoints at once
+REACHABILITY_WORKERS = 32
+
+# MySQL client errors that mean we never got a working session with the server, when they're
+# raised while connecting: 2003 can't connect, 2013 lost the connection during the handshake
+# a 2013 from a query that ran past QUERY_TIMEOUT means the server is there but slow, which
+# is an error for that check rather than a reason to call the instance unreachable
+UNREACHABLE_ERRORS = (2003, 2013)
+
+
+class Unreachable(Exception):
+    # raised in place of the MySQL error when a connection couldn't be opened at all
+    pass
+
+
+def isReachable(instance, timeout):
+    endpoint = instance["Endpoint"]
+    try:
+        with socket.create_connection(
+            (endpoint["Address"], endpoint.get("Port", 3306)), timeout=timeout
+        ):
+            return True
+    except OSError as e:
+        logging.warning(
+            f"{instanceLabel(instance)}: Unable to open a connection to the MySQL port - {str(e)}"
+        )
+        return False
+
+
+def checkReachable(instances, timeout):
+    # TCP connect to every endpoint at the same time, before anything tries to log in
+    # returns {DBInstanceIdentifier: True/False}
+    instances = list(instances)
+    if not instances:
+        return {}
+    with ThreadPoolExecutor(
+        max_workers=min(REACHABILITY_WORKERS, len(instances))
+    ) as pool:
+        reachable = pool.map(lambda i: isReachable(i, timeout), instances)
+        return {
+            instance["DBInstanceIdentifier"]: result
+            for instance, result in zip(instances, reachable)
+        }
+
+
+def remainingMillis(context):
+    # the Lambda context knows how long is left. anything else (local runs) has no limit
+    getRemaining = getattr(context, "get_remaining_time_in_millis", None)
+    if getRemaining is None:
+        return None
+    return getRemaining()
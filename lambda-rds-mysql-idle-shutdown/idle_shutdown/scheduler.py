@@ -0,0 +1,52 @@
+import logging
+
+from probing import instanceLabel
+
+
+def idleDeadline(state, idleSeconds):
+    # earliest time the instance could possibly be called idle, given what we knew at the last
+    # check: it needs idleSeconds without activity AND idleSeconds of uptime
+    # None means we know nothing about it, so it should be checked now
+    if not state or "last_active" not in state:
+        return None
+
+    deadline = state["last_active"] + idleSeconds
+    if "uptime" in state and "observed_at" in state:
+        bootedAt = state["observed_at"] - state["uptime"]
+        deadline = max(deadline, bootedAt + idleSeconds)
+    return deadline
+
+
+def planProbes(instances, store, idleSeconds, now):
+    # splits the available instances into ones that are due a check and ones that can't be idle
+    # yet. instances that aren't available are always passed through, they don't need a login
+    due = []
+    report = {"probes_executed": 0, "probes_skipped": 0, "next_deadline": None}
+    states = store.getMany(
+        [
+            instance["DBInstanceIdentifier"]
+            for instance in instances
+            if instance["DBInstanceStatus"] == "available"
+        ]
+    )
+
+    for instance in instances:
+        if instance["DBInstanceStatus"] != "available":
+            due.append(instance)
+            continue
+
+        deadline = idleDeadline(
+            states.get(instance["DBInstanceIdentifier"]), idleSeconds
+        )
+        if deadline is not None and deadline > now:
+            logging.warning(
+                f"{instanceLabel(instance)}: Can't be idle for another {int(deadline - now) // 60} minutes.  Skipping."
+            )
+            report["probes_skipped"] += 1
+            if report["next_deadline"] is None or deadline < report["next_deadline"]:
+                report["next_deadline"] = deadline
+        else:
+            report["probes_executed"] += 1
+            due.append(instance)
+
+    return due, report
@@ -0,0 +1,170 @@
+import os
+
+from activity import DETECTORS, GENERAL_LOG
+from cloudwatch import METRICS_MODES, METRICS_OFF
+from connections import DB_AUTH_MODES, SSM_AUTH
+from fleet import parseTargets
+from instrumentation import NAMESPACE
+from reachability import SKIP, UNREACHABLE_POLICIES
+from shards import DISPATCHERS, LAMBDA_DISPATCHER
+from throttling import MAX_ATTEMPTS, parseRates
+
+# statements the slowest idle check runs, each allowed up to QUERY_TIMEOUT
+QUERIES_PER_CHECK = 3
+# time kept back after the last check for stopping, confirming the stops and endpoint cleanup
+WRAP_UP_MS = 10000
+
+
+# runtime settings are passed in as environment variables on the Lambda function
+# see the Environment section of template.yaml
+def getEnvInt(environ, name, default):
+    value = environ.get(name)
+    if value is None or str(value).strip() == "":
+        return default
+    return int(value)
+
+
+def getEnvFloat(environ, name, default):
+    value = environ.get(name)
+    if value is None or str(value).strip() == "":
+        return default
+    return float(value)
+
+
+def getEnvBool(environ, name, default):
+    value = environ.get(name)
+    if value is None or str(value).strip() == "":
+        return default
+    return str(value).strip().upper() in ("TRUE", "YES", "1")
+
+
+def getEnvChoice(environ, name, choices, default):
+    value = str(environ.get(name) or default).strip().lower()
+    if value not in choices:
+        raise ValueError(f'{name} must be one of {", ".join(choices)}, got {value}')
+    return value
+
+
+def defaultMinRemainingMs(connectTimeout, queryTimeout, stopConfirmSeconds):
+    # a check started with this much time left can run into every timeout and still leave
+    # time for the stops after it
+    worstCheckSeconds = connectTimeout + QUERIES_PER_CHECK * queryTimeout
+    return (worstCheckSeconds + stopConfirmSeconds) * 1000 + WRAP_UP_MS
+
+
+def loadSettings(environ=None):
+    if environ is None:
+        environ = os.environ
+
+    connectTimeout = max(1, getEnvInt(environ, "CONNECT_TIMEOUT", 5))
+    queryTimeout = max(1, getEnvInt(environ, "QUERY_TIMEOUT", 10))
+    stopConfirmSeconds = max(0, getEnvInt(environ, "STOP_CONFIRM_SECONDS", 0))
+    shardSize = max(0, getEnvInt(environ, "SHARD_SIZE", 0))
+    fleetTargets = parseTargets(environ.get("FLEET_TARGETS"))
+    if shardSize and fleetTargets:
+        # the coordinator only lists the function's own account and region
+        raise ValueError(
+            "SHARD_SIZE can't be used with FLEET_TARGETS, set one or the other"
+        )
+    metricsMode = getEnvChoice(environ, "METRICS_MODE", METRICS_MODES, METRICS_OFF)
+    connectionReuse = getEnvBool(environ, "CONNECTION_REUSE", False)
+    if connectionReuse and metricsMode != METRICS_OFF:
+        # a cached session counts in DatabaseConnections, so the instance never looks idle
+        raise ValueError(
+            "CONNECTION_REUSE can't be used with METRICS_MODE, set one or the other"
+        )
+
+    return {
+        # how many instances to check at the same time. 1 means one after the other
+        "probe_concurrency": max(1, getEnvInt(environ, "PROBE_CONCURRENCY", 1)),
+        # how to tell if an instance is idle, unless its RDS_IDLE_DETECTOR tag says otherwise
+        "idle_detector": getEnvChoice(environ, "IDLE_DETECTOR", DETECTORS, GENERAL_LOG),
+        # where to remember each instance's activity between runs. a DynamoDB table if
+        # STATE_TABLE is set, otherwise a local JSON file if STATE_FILE is set, otherwise memory
+        "state_table": environ.get("STATE_TABLE") or None,
+        "state_file": environ.get("STATE_FILE") or None,
+        # off: don't use CloudWatch. only: decide from CloudWatch metrics alone, never log in.
+        # prefilter: decide from CloudWatch where it's clear cut, log in for the borderline ones
+        "metrics_mode": metricsMode,
+        # the most CPU (percent) and read + write IOPS an instance can show and still be idle
+        "metrics_cpu_threshold": getEnvFloat(environ, "METRICS_CPU_THRESHOLD", 5.0),
+        "metrics_iops_threshold": getEnvFloat(environ, "METRICS_IOPS_THRESHOLD", 5.0),
+        # how long (seconds) the idle check user's credentials are cached before going back to SSM
+        "credentials_ttl": getEnvInt(environ, "CREDENTIALS_TTL", 300),
+        # how long (minutes) an instance needs to go without activity, and to have been up, to be idle
+        "idle_minutes": max(1, getEnvInt(environ, "IDLE_MINUTES", 60)),
+        # fetch last command, server time and uptime in one statement instead of three
+        "single_query_probe": getEnvBool(environ, "SINGLE_QUERY_PROBE", False),
+        # seconds allowed to open a MySQL connection, and for each query to answer
+        "connect_timeout": connectTimeout,
+        "query_timeout": queryTimeout,
+        # TCP connect to every endpoint at once before any logins, to find the dead ones cheaply
+        "tcp_precheck": getEnvBool(environ, "TCP_PRECHECK", False),
+        # don't start checking another instance with less than this many milliseconds left
+        # defaults to the longest a check can take plus time to stop what was found
+        "min_remaining_ms": getEnvInt(
+            environ,
+            "MIN_REMAINING_MS",
+            defaultMinRemainingMs(connectTimeout, queryTimeout, stopConfirmSeconds),
+        ),
+        # skip: leave unreachable instances alone. stop: shut them down
+        "unreachable_policy": getEnvChoice(
+            environ, "UNREACHABLE_POLICY", UNREACHABLE_POLICIES, SKIP
+        ),
+        # regions (and optionally roles to assume in other accounts) to sweep in one run
+        # if empty, just the account and region the function runs in
+        "fleet_targets": fleetTargets,
+        # if more than 0, this run only enumerates, and sends the instances to be checked to
+        # worker invocations in shards of this many
+        "shard_size": shardSize,
+        # lambda: invoke WORKER_FUNCTION for each shard. local: run the workers in this process
+        "dispatcher": getEnvChoice(
+            environ, "DISPATCHER", DISPATCHERS, LAMBDA_DISPATCHER
+        ),
+        # the function the shards are sent to. defaults to this function
+        "worker_function": environ.get("WORKER_FUNCTION")
+        or environ.get("AWS_LAMBDA_FUNCTION_NAME"),
+        # fire and forget the worker invocations instead of waiting for their results
+        "dispatch_async": getEnvBool(environ, "DISPATCH_ASYNC", False),
+        # check instances while they're still being listed, rather than listing them all first
+        "stream_pipeline": getEnvBool(environ, "STREAM_PIPELINE", True),
+        # how many instances can wait between the streaming stages before the earlier stage
+        # has to wait for the later one to catch up
+        "pipeline_queue_size": max(1, getEnvInt(environ, "PIPELINE_QUEUE_SIZE", 100)),
+        # calls per second allowed to each AWS API (per account and region), like rds=20,ssm=40
+        # services not listed use the defaults in throttling.py
+        "api_rate_limits": parseRates(environ.get("API_RATE_LIMITS")),
+        # how many times an AWS API call is tried before giving up on throttling or server errors
+        "api_max_attempts": max(
+            1, getEnvInt(environ, "API_MAX_ATTEMPTS", MAX_ATTEMPTS)
+        ),
+        # check Aurora MySQL clusters as a whole and stop them with one stop_db_cluster, rather
+        # than checking (and failing to stop) each of their instances
+        "cluster_mode": getEnvBool(environ, "CLUSTER_MODE", True),
+        # print the run's phase timings and counts as CloudWatch Embedded Metric Format
+        "emf_output": getEnvBool(environ, "EMF_OUTPUT", True),
+        "metrics_namespace": environ.get("METRICS_NAMESPACE") or NAMESPACE,
+        # HTTP connections each boto3 client keeps open. 0 means enough for every probe and
+        # stop thread to have one of its own
+        "client_pool_size": max(0, getEnvInt(environ, "CLIENT_POOL_SIZE", 0)),
+        # ssm: log in with the username and password in SSM. iam: log in as IAM_DB_USER with
+        # an IAM auth token, which needs rds-db:connect and a user created with
+        # AWSAuthenticationPlugin on each instance
+        "db_auth": getEnvChoice(environ, "DB_AUTH", DB_AUTH_MODES, SSM_AUTH),
+        "iam_db_user": environ.get("IAM_DB_USER") or "rds_idle_shutdown",
+        # the RDS CA bundle, to check the certificate of each instance logged in to over TLS
+        "db_ssl_ca": environ.get("DB_SSL_CA") or None,
+        # keep MySQL connections open between checks (and warm invocations) and reuse them
+        # once a ping shows they're still alive. worth it on a short schedule
+        "connection_reuse": connectionReuse,
+        # seconds a cached connection can go unused before it's closed instead of reused
+        "connection_max_idle": max(1, getEnvInt(environ, "CONNECTION_MAX_IDLE", 600)),
+        # look up the instances stopped this run (and earlier ones still stopping) in batches
+        # to confirm they got to stopped, and list them as the run's savings
+        "stop_confirm": getEnvBool(environ, "STOP_CONFIRM", True),
+        # how long (seconds) to keep looking before leaving the rest for the next run
+        "stop_confirm_seconds": stopConfirmSeconds,
+        # find the idle instances and report them, but don't stop anything or delete any VPC
+        # endpoints. idle instances are reported as "idle" rather than "stopped"
+        "dry_run": getEnvBool(environ, "DRY_RUN", False),
+    }
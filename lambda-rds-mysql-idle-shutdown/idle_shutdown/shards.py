@@ -0,0 +1,156 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import LAMBDA_POOL_SIZE, getClient
+from probing import probeResult
+
+LAMBDA_DISPATCHER = "lambda"
+LOCAL_DISPATCHER = "local"
+DISPATCHERS = (LAMBDA_DISPATCHER, LOCAL_DISPATCHER)
+
+# the parts of a describe_db_instances entry that the checks use. the rest (datetimes etc)
+# isn't JSON serialisable, and isn't needed by the workers
+INSTANCE_FIELDS = (
+    "DBInstanceIdentifier",
+    "DBInstanceArn",
+    "DBInstanceStatus",
+    "DBClusterIdentifier",
+    "Engine",
+    "Endpoint",
+    "TagList",
+)
+
+
+def instanceSummary(instance):
+    summary = {key: instance[key] for key in INSTANCE_FIELDS if key in instance}
+    if "Endpoint" in summary:
+        summary["Endpoint"] = {
+            key: summary["Endpoint"][key]
+            for key in ("Address", "Port")
+            if key in summary["Endpoint"]
+        }
+    return summary
+
+
+def shardInstances(instances, shardSize):
+    instances = list(instances)
+    return [
+        instances[start : start + shardSize]
+        for start in range(0, len(instances), shardSize)
+    ]
+
+
+def workerEvent(shard, deferCleanup=False, deadline=None):
+    # workers never clean up VPC endpoints themselves, or a run with N shards would list and
+    # delete them N times. a coordinator that waits for the results cleans up once at the end.
+    # with deferCleanup (fire and forget), a worker that stopped something leaves a note in the
+    # state store for the coordinator's next run to clean up
+    # deadline (epoch seconds) is when the coordinator needs the worker to have finished by
+    return {
+        "mode": "worker",
+        "instances": [instanceSummary(instance) for instance in shard],
+        "cleanup_endpoints": False,
+        "defer_endpoint_cleanup": deferCleanup,
+        "deadline": deadline,
+    }
+
+
+def dispatchAll(send, events, maxWorkers):
+    # a shard that can't be dispatched comes back as an error, it doesn't stop the others
+    def run(event):
+        try:
+            return send(event)
+        except Exception as e:
+            logging.error(f"Failed to dispatch shard - {str(e)}")
+            return {"error": str(e)}
+
+    if not events:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(events)))) as pool:
+        return list(pool.map(run, events))
+
+
+class LocalDispatcher:
+    # runs the worker in this process, in place of invoking the Lambda. for tests and local runs
+    # worker(event) is called exactly like lambda_handler(event, context) would be
+    waitsForResults = True
+
+    def __init__(self, worker, maxWorkers=4):
+        self.worker = worker
+        self.maxWorkers = maxWorkers
+
+    def dispatch(self, events):
+        return dispatchAll(self.worker, events, self.maxWorkers)
+
+
+class LambdaDispatcher:
+    # invokes the worker function once per shard, all at the same time
+    # with waitForResults the invokes are synchronous and each worker's report comes back,
+    # otherwise they're fire and forget (InvocationType Event) and results only go to the logs
+    # an invoke is never retried once it may have reached Lambda (see throttling.py), so a
+    # shard is never checked twice
+    def __init__(
+        self,
+        functionName,
+        waitForResults=True,
+        client=None,
+        maxWorkers=LAMBDA_POOL_SIZE,
+    ):
+        self.functionName = functionName
+        self.waitsForResults = waitForResults
+        self.client = client if client is not None else getClient("lambda")
+        self.maxWorkers = maxWorkers
+
+    def invoke(self, event):
+        response = self.client.invoke(
+            FunctionName=self.functionName,
+            InvocationType="RequestResponse" if self.waitsForResults else "Event",
+            Payload=json.dumps(event).encode(),
+        )
+        if not self.waitsForResults:
+            return None
+        payload = json.loads(response["Payload"].read())
+        if response.get("FunctionError"):
+            raise RuntimeError(f'Worker failed: {payload.get("errorMessage", payload)}')
+        return payload
+
+    def dispatch(self, events):
+        return dispatchAll(self.invoke, events, self.maxWorkers)
+
+
+def coordinate(instances, shardSize, dispatcher, deadline=None):
+    # splits the instances into shards and hands each one to a worker
+    # returns the combined results from the workers (if the dispatcher waits for them)
+    # workers stop starting checks in time to be done by deadline, including ones that had to
+    # wait for a free slot to be dispatched
+    shards = shardInstances(instances, shardSize)
+    logging.warning(
+        f"Dispatching {len(instances)} instances to {len(shards)} workers, {shardSize} per worker"
+    )
+    events = [
+        workerEvent(shard, not dispatcher.waitsForResults, deadline) for shard in shards
+    ]
+
+    results = []
+    failedShards = 0
+    for shard, response in zip(shards, dispatcher.dispatch(events)):
+        if response is None:
+            continue
+        try:
+            report = json.loads(response["body"])
+        except Exception:
+            report = None
+        if report is None or "results" not in report:
+            error = response.get("error", "worker returned no results")
+            logging.error(f"Worker for {len(shard)} instances failed - {error}")
+            failedShards += 1
+            results.extend(probeResult(i, "error", error=error) for i in shard)
+            continue
+        results.extend(report["results"])
+
+    return {
+        "shards": len(shards),
+        "failed_shards": failedShards,
+        "results": results if dispatcher.waitsForResults else None,
+    }
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+
+from clients import getClient
+from throttling import MAX_ATTEMPTS, backoff
+
+# what gets remembered about each instance between runs, keyed by DBInstanceIdentifier:
+# - statements: statement counter at the last check (status_counters detector only)
+# - uptime: server uptime in seconds at the last check
+# - observed_at: epoch seconds of the last check
+# - last_active: epoch seconds the instance was last seen doing something
+# every store has get, getMany and put. getMany returns {instanceId: state} for the ids that
+# have any state, so a page of instances can be planned with one read rather than one each
+
+# keys allowed in one batch_get_item call
+BATCH_GET_KEYS = 100
+
+
+class MemoryStateStore:
+    # only lives as long as the container. fine for tests and a warm Lambda, not much else
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, instanceId):
+        with self._lock:
+            state = self._states.get(instanceId)
+            return dict(state) if state is not None else None
+
+    def getMany(self, instanceIds):
+        with self._lock:
+            return {
+                instanceId: dict(self._states[instanceId])
+                for instanceId in instanceIds
+                if instanceId in self._states
+            }
+
+    def put(self, instanceId, state):
+        with self._lock:
+            self._states[instanceId] = dict(state)
+
+
+class JsonFileStateStore(MemoryStateStore):
+    # keeps state in a local JSON file, for local.py and tests
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                self._states = json.load(f)
+
+    def put(self, instanceId, state):
+        with self._lock:
+            self._states[instanceId] = dict(state)
+            with open(self.path, "w") as f:
+                json.dump(self._states, f, indent=2, sort_keys=True)
+
+
+class DynamoDBStateStore:
+    # one item per instance, with DBInstanceIdentifier as the partition key
+    def __init__(self, tableName, client=None):
+        self.tableName = tableName
+        self.client = client if client is not None else getClient("dynamodb")
+
+    def get(self, instanceId):
+        item = self.client.get_item(
+            TableName=self.tableName,
+            Key={"DBInstanceIdentifier": {"S": instanceId}},
+            ConsistentRead=True,
+        ).get("Item")
+        if item is None:
+            return None
+        return parseItem(item)
+
+    def getMany(self, instanceIds):
+        instanceIds = list(dict.fromkeys(instanceIds))
+        states = {}
+        for start in range(0, len(instanceIds), BATCH_GET_KEYS):
+            keys = [
+                {"DBInstanceIdentifier": {"S": instanceId}}
+                for instanceId in instanceIds[start : start + BATCH_GET_KEYS]
+            ]
+            attempts = 0
+            while keys:
+                response = self.client.batch_get_item(
+                    RequestItems={
+                        self.tableName: {"Keys": keys, "ConsistentRead": True}
+                    }
+                )
+                for item in response["Responses"].get(self.tableName, []):
+                    states[item["DBInstanceIdentifier"]["S"]] = parseItem(item)
+                # keys DynamoDB didn't get to (throttled, or over 16MB) are asked for again
+                keys = (
+                    response.get("UnprocessedKeys", {})
+                    .get(self.tableName, {})
+                    .get("Keys", [])
+                )
+                attempts += 1
+                if keys and attempts >= MAX_ATTEMPTS:
+                    raise RuntimeError(
+                        f"DynamoDB left {len(keys)} state reads unprocessed after {attempts} attempts"
+                    )
+                if keys:
+                    time.sleep(backoff(attempts))
+        return states
+
+    def put(self, instanceId, state):
+        item = {key: {"N": str(value)} for key, value in state.items()}
+        item["DBInstanceIdentifier"] = {"S": instanceId}
+        self.client.put_item(TableName=self.tableName, Item=item)
+
+
+class PrefixedStateStore:
+    # in a multi account/region sweep, instance identifiers are only unique within their own
+    # account and region, so the keys get prefixed with both
+    def __init__(self, store, prefix):
+        self.store = store
+        self.prefix = prefix
+
+    def get(self, instanceId):
+        return self.store.get(f"{self.prefix}/{instanceId}")
+
+    def getMany(self, instanceIds):
+        states = self.store.getMany([f"{self.prefix}/{i}" for i in instanceIds])
+        start = len(self.prefix) + 1
+        return {key[start:]: state for key, state in states.items()}
+
+    def put(self, instanceId, state):
+        self.store.put(f"{self.prefix}/{instanceId}", state)
+
+
+def parseItem(item):
+    return {
+        key: parseNumber(value["N"])
+        for key, value in item.items()
+        if key != "DBInstanceIdentifier"
+    }
+
+
+def parseNumber(value):
+    number = float(value)
+    return int(number) if number.is_integer() and "." not in value else number
+
+
+# with no table or file, state is kept here for as long as the container lives, so warm
+# invocations see what earlier ones learnt, like the credentials cache
+_memoryStore = MemoryStateStore()
+
+
+def openStateStore(settings):
+    if settings.get("state_table"):
+        return DynamoDBStateStore(settings["state_table"])
+    if settings.get("state_file"):
+        return JsonFileStateStore(settings["state_file"])
+    return _memoryStore
+
+
+def resetMemoryStore():
+    with _memoryStore._lock:
+        _memoryStore._states.clear()
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import timed
+
+# stopping happens in two halves. the idle instances a sweep finds are all stopped at once, a
+# few stop_db_instance calls at a time, and then the whole batch is looked up with filtered
+# describe_db_instances calls (up to 100 instances each) to see which ones actually got to
+# stopped, rather than polling or running a waiter for each one
+# RDS takes a few minutes to stop an instance, so most are still stopping when the run ends.
+# those are remembered in the state store and looked up again with the next run's batch, until
+# they've stopped or turn out not to be stopping after all
+# every instance confirmed stopped is listed in the run's savings
+
+# stop_db_instance calls in flight at once
+STOP_WORKERS = 4
+# values allowed in one describe_db_instances filter
+DESCRIBE_BATCH = 100
+# seconds between looks at the batch, when STOP_CONFIRM_SECONDS allows more than one
+CONFIRM_INTERVAL_SECONDS = 10
+# an instance still stopping after this long is given up on and dropped from the pending list
+PENDING_MAX_SECONDS = 24 * 60 * 60
+# state store key for the stops still waiting to be confirmed. DBInstanceIdentifiers can't
+# contain #, so it can't clash with an instance's own state
+PENDING_STOPS_KEY = "#pending-stops"
+
+STOPPED = "stopped"
+STOPPING = "stopping"
+
+# shard workers run in process share a state store, so they take turns with the pending list
+# workers in separate invocations can still overwrite each other's, which only means a stop
+# goes unconfirmed, never that an instance is stopped twice
+_pendingLock = threading.Lock()
+
+
+def dispatchStops(items, stop, workers=STOP_WORKERS):
+    # runs stop(item) for every item, workers at a time, and returns what each returned in order
+    # stop is expected to deal with its own errors
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [stop(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(stop, items))
+
+
+def describeInstances(rds, instanceIds):
+    # {DBInstanceIdentifier: instance} for the ones that still exist
+    found = {}
+    for start in range(0, len(instanceIds), DESCRIBE_BATCH):
+        batch = instanceIds[start : start + DESCRIBE_BATCH]
+        with timed("stop_confirm"):
+            pages = rds.get_paginator("describe_db_instances").paginate(
+                Filters=[{"Name": "db-instance-id", "Values": batch}]
+            )
+            for page in pages:
+                for instance in page["DBInstances"]:
+                    found[instance["DBInstanceIdentifier"]] = instance
+    return found
+
+
+def saving(instance, issuedAt, confirmedAt):
+    return {
+        "instance": instance["DBInstanceIdentifier"],
+        "instance_class": instance.get("DBInstanceClass"),
+        "engine": instance.get("Engine"),
+        "multi_az": instance.get("MultiAZ"),
+        "allocated_storage_gb": instance.get("AllocatedStorage"),
+        "stop_issued_at": issuedAt,
+        "confirmed_at": confirmedAt,
+    }
+
+
+def confirmStops(
+    rds, store, stoppedIds, waitSeconds=0, hasTimeLeft=None, now=None, sleep=time.sleep
+):
+    # looks up stoppedIds, plus every stop from earlier runs that wasn't confirmed yet, until
+    # they've all settled or waitSeconds is up. whatever is still stopping is left pending
+    if now is None:
+        now = time.time()
+    with _pendingLock:
+        pending = store.get(PENDING_STOPS_KEY) or {}
+        issued = dict(pending)
+        issued.update({instanceId: now for instanceId in stoppedIds})
+        if not issued:
+            return None
+
+        deadline = time.monotonic() + waitSeconds
+        confirmed = []
+        notStopped = []
+        waiting = sorted(issued)
+        while True:
+            found = describeInstances(rds, waiting)
+            checkedAt = time.time()
+            stillStopping = []
+            for instanceId in waiting:
+                instance = found.get(instanceId)
+                status = instance["DBInstanceStatus"] if instance else None
+                if status == STOPPED:
+                    confirmed.append(saving(instance, issued[instanceId], checkedAt))
+                elif status == STOPPING:
+                    stillStopping.append(instanceId)
+                else:
+                    # deleted, started again, or the stop failed
+                    notStopped.append({"instance": instanceId, "status": status})
+            waiting = stillStopping
+            left = deadline - time.monotonic()
+            if not waiting or left <= 0 or (hasTimeLeft and not hasTimeLeft()):
+                break
+            sleep(min(CONFIRM_INTERVAL_SECONDS, left))
+
+        requeued = {}
+        for instanceId in waiting:
+            if now - issued[instanceId] > PENDING_MAX_SECONDS:
+                logging.warning(
+                    f"{instanceId}: Still stopping a day after it was stopped, giving up on it"
+                )
+                notStopped.append({"instance": instanceId, "status": STOPPING})
+            else:
+                requeued[instanceId] = issued[instanceId]
+        store.put(PENDING_STOPS_KEY, requeued)
+
+    if requeued:
+        logging.warning(
+            f"{len(requeued)} instances are still stopping, they'll be checked again next run"
+        )
+    return {
+        "issued": len(stoppedIds),
+        "from_earlier_runs": len(set(pending) - set(stoppedIds)),
+        "confirmed": len(confirmed),
+        "still_stopping": sorted(requeued),
+        "not_stopped": notStopped,
+        "savings": confirmed,
+    }
@@ -0,0 +1,264 @@
+import logging
+import random
+import threading
+import time
+
+from botocore.config import Config
+from botocore.exceptions import ConnectTimeoutError, EndpointConnectionError
+
+# every boto3 client from getClient goes through here: each HTTP attempt takes a token from the
+# bucket for its API family (the service, in one account and region), and throttled or transient
+# failures are retried with jittered exponential backoff instead of failing the instance
+# buckets are shared by every thread and every sweep, so parallel sweeps against the same
+# account and region slow down together instead of each hammering the API on their own
+# a throttle halves the bucket's rate, and each success wins a little of it back
+
+# sustained calls per second for each API family, before any throttling has been seen
+DEFAULT_RATES = {
+    "rds": 10.0,
+    "ssm": 20.0,
+    "ec2": 20.0,
+    "resourcegroupstaggingapi": 5.0,
+    "cloudwatch": 10.0,
+    "lambda": 20.0,
+    "sts": 10.0,
+}
+# API families with no bucket unless API_RATE_LIMITS gives them a rate. the state table's
+# capacity is the table's own, not a shared account limit, so its calls go straight out and
+# are only slowed down by backoff when DynamoDB actually throttles them
+UNLIMITED_SERVICES = ("dynamodb",)
+DEFAULT_RATE = 10.0
+MIN_RATE = 0.5
+# how much of the configured rate each successful call wins back after a throttle
+RECOVERY_FRACTION = 0.05
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_CAP_SECONDS = 20.0
+
+THROTTLE_ERRORS = (
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+    "PriorRequestNotComplete",
+)
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+# calls that mustn't be sent twice. once the request may have reached the service (a read
+# timeout or a dropped connection), a retry could run it again, so these are only retried when
+# they were throttled or the connection was never made. a retried Invoke would check, and stop,
+# a whole shard a second time
+NOT_IDEMPOTENT = {("lambda", "Invoke")}
+UNSENT_ERRORS = (ConnectTimeoutError, EndpointConnectionError)
+
+# botocore's own retries are turned off so they don't multiply with these
+CLIENT_CONFIG = Config(retries={"total_max_attempts": 1, "mode": "standard"})
+
+_settings = {"rates": dict(DEFAULT_RATES), "max_attempts": MAX_ATTEMPTS}
+_buckets = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.maxRate = rate
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # blocks until a token is free, returns how long that took
+        started = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - started
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.maxRate:
+                self._refill(time.monotonic())
+                self.rate = min(
+                    self.maxRate, self.rate + self.maxRate * RECOVERY_FRACTION
+                )
+
+
+def parseRates(value):
+    # API_RATE_LIMITS is a comma separated list of service=calls per second, like rds=20,ssm=40
+    rates = {}
+    if value is None or str(value).strip() == "":
+        return rates
+    for entry in str(value).split(","):
+        if not entry.strip():
+            continue
+        service, _, rate = entry.partition("=")
+        if not rate.strip():
+            raise ValueError(
+                f"API rate limit should look like service=rate, got {entry}"
+            )
+        rates[service.strip().lower()] = max(MIN_RATE, float(rate))
+    return rates
+
+
+def configureThrottling(rates=None, maxAttempts=None):
+    # rates override DEFAULT_RATES per service. buckets that already exist keep their rate
+    with _lock:
+        _settings["rates"] = dict(DEFAULT_RATES, **(rates or {}))
+        if maxAttempts is not None:
+            _settings["max_attempts"] = max(1, maxAttempts)
+
+
+def bucketFor(key):
+    # key is (service, region, roleArn), same as the client cache. None for an unlimited service
+    with _lock:
+        if key not in _buckets:
+            rate = _settings["rates"].get(key[0])
+            if rate is None and key[0] in UNLIMITED_SERVICES:
+                _buckets[key] = None
+            else:
+                _buckets[key] = TokenBucket(rate if rate is not None else DEFAULT_RATE)
+        return _buckets[key]
+
+
+def _count(service, operation, field, amount=1):
+    with _lock:
+        stats = _stats.setdefault(
+            f"{service}.{operation}",
+            {
+                "calls": 0,
+                "retries": 0,
+                "throttles": 0,
+                "failures": 0,
+                "wait_seconds": 0.0,
+            },
+        )
+        stats[field] += amount
+
+
+def errorCode(response):
+    # response is (http response, parsed response) as botocore passes it to needs-retry
+    if response is None:
+        return None
+    return response[1].get("Error", {}).get("Code")
+
+
+def retryAfter(response):
+    # the service's own hint for how long to wait, if it gave one
+    if response is None:
+        return None
+    try:
+        return float(response[0].headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempts, hint=None):
+    # full jitter, so threads that were throttled together don't all come back together
+    delay = random.uniform(
+        0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    )
+    if hint is not None:
+        delay = max(delay, min(hint, BACKOFF_CAP_SECONDS))
+    return delay
+
+
+def throttleClient(client, key):
+    # hooks the client's events so every call is rate limited, retried and counted
+    service = key[0]
+    bucket = bucketFor(key)
+
+    def beforeCall(event_name, **kwargs):
+        _count(service, event_name.split(".")[-1], "calls")
+
+    def beforeSend(event_name, **kwargs):
+        if bucket is None:
+            return
+        waited = bucket.acquire()
+        if waited:
+            _count(service, event_name.split(".")[-1], "wait_seconds", waited)
+
+    def needsRetry(event_name, response, attempts, caught_exception, **kwargs):
+        operation = event_name.split(".")[-1]
+        code = errorCode(response)
+        if code in THROTTLE_ERRORS:
+            if bucket is not None:
+                bucket.throttled()
+            _count(service, operation, "throttles")
+        elif caught_exception is None and response[0].status_code < 400:
+            if bucket is not None:
+                bucket.succeeded()
+            return None
+        elif caught_exception is None and (
+            response[0].status_code not in TRANSIENT_STATUS_CODES
+        ):
+            # a real error, retrying won't help
+            return None
+        elif (service, operation) in NOT_IDEMPOTENT and not isinstance(
+            caught_exception, UNSENT_ERRORS
+        ):
+            logging.warning(
+                f"{service}.{operation}: Not retrying, the call may already have run - {code or caught_exception}"
+            )
+            _count(service, operation, "failures")
+            return None
+
+        if attempts >= _settings["max_attempts"]:
+            logging.warning(
+                f"{service}.{operation}: Giving up after {attempts} attempts - {code or caught_exception}"
+            )
+            _count(service, operation, "failures")
+            return None
+        _count(service, operation, "retries")
+        return backoff(attempts, retryAfter(response))
+
+    client.meta.events.register("before-call", beforeCall)
+    client.meta.events.register("before-send", beforeSend)
+    client.meta.events.register("needs-retry", needsRetry)
+    return client
+
+
+def apiStats(since=None):
+    # calls, retries, throttles, failures and time spent waiting for tokens per API operation
+    # with since (an earlier apiStats()), only what happened after it
+    with _lock:
+        current = {name: dict(stats) for name, stats in _stats.items()}
+    if since is None:
+        return current
+    delta = {}
+    for name, stats in current.items():
+        before = since.get(name, {})
+        changes = {
+            field: value - before.get(field, 0) for field, value in stats.items()
+        }
+        if changes["calls"]:
+            changes["wait_seconds"] = round(changes["wait_seconds"], 3)
+            delta[name] = changes
+    return delta
+
+
+def resetThrottling():
+    with _lock:
+        _buckets.clear()
+        _stats.clear()
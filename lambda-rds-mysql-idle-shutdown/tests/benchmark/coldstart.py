@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# measures what a cold container spends before the sweep starts: importing app and building
+# the clients the first invocation needs. every sample is a fresh Python process, like a cold
+# start. e.g. from lambda-rds-mysql-idle-shutdown/:
+#   python -m tests.benchmark.coldstart --repeat 10
+
+PROJECT_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+FUNCTION_DIR = os.path.join(PROJECT_DIR, "idle_shutdown")
+
+# the original handler, before any of the sweep's modules existed. its app.py is checked out
+# of git into a temporary directory and timed as it was
+BASELINE_REVISION = "244f60e"
+
+# the scenario that runs the original app.py rather than the current one
+BASELINE_SCENARIO = "baseline"
+
+# each scenario is the code a cold start runs, timed from the first import
+SCENARIOS = {
+    # the original handler imports pymysql and boto3 with app, and builds its SSM and RDS
+    # clients as soon as it's invoked
+    BASELINE_SCENARIO: """
+import app
+app.boto3.client("ssm")
+app.boto3.client("rds")
+""",
+    # nothing due a SQL probe (all stopped, exempt, not due, or decided by CloudWatch)
+    "lazy_no_probes": """
+import app
+app.lazyClient("rds").meta
+""",
+    # at least one instance needs a login, so pymysql and SSM are loaded after all
+    "lazy_with_probes": """
+import app
+app.lazyClient("rds").meta
+app.loadPyMySQL()
+app.lazyClient("ssm").meta
+""",
+}
+
+HARNESS = """
+import json, sys, time
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "init_ms": round(elapsed * 1000, 1),
+    "pymysql_loaded": "pymysql" in sys.modules,
+    "modules": len(sys.modules),
+}}))
+"""
+
+
+def extractBaseline(revision, directory):
+    # writes the app.py from revision into directory. fails if this isn't a git checkout or
+    # the revision isn't in it
+    source = subprocess.run(
+        ["git", "show", f"{revision}:./idle_shutdown/app.py"],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        check=True,
+    ).stdout
+    with open(os.path.join(directory, "app.py"), "wb") as f:
+        f.write(source)
+    return directory
+
+
+def sample(code, directory=FUNCTION_DIR):
+    environ = dict(os.environ, AWS_DEFAULT_REGION="us-west-2", PYTHONPATH=directory)
+    output = subprocess.run(
+        [sys.executable, "-c", HARNESS.format(code=code)],
+        env=environ,
+        cwd=directory,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(repeat, baseline=BASELINE_REVISION):
+    runs = []
+    with tempfile.TemporaryDirectory() as baselineDir:
+        extractBaseline(baseline, baselineDir)
+        for name, code in SCENARIOS.items():
+            directory = baselineDir if name == BASELINE_SCENARIO else FUNCTION_DIR
+            samples = [sample(code, directory) for _ in range(repeat)]
+            times = sorted(s["init_ms"] for s in samples)
+            runs.append(
+                {
+                    "scenario": name,
+                    "init_ms_median": round(statistics.median(times), 1),
+                    "init_ms_min": times[0],
+                    "init_ms_max": times[-1],
+                    "pymysql_loaded": samples[0]["pymysql_loaded"],
+                    "modules": samples[0]["modules"],
+                }
+            )
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the function's cold start against the original handler's"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="processes per scenario")
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_REVISION,
+        help="git revision of the original app.py to compare against",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON, not a table")
+    args = parser.parse_args(argv)
+
+    runs = measure(max(1, args.repeat), baseline=args.baseline)
+    if args.json:
+        print(json.dumps(runs, indent=2))
+        return
+
+    columns = (
+        "scenario",
+        "init_ms_median",
+        "init_ms_min",
+        "init_ms_max",
+        "pymysql_loaded",
+        "modules",
+    )
+    print("  ".join(f"{c:>16}" for c in columns))
+    for run in runs:
+        print("  ".join(f"{str(run[c]):>16}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
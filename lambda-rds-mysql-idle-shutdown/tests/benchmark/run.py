@@ -0,0 +1,183 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from unittest import mock
+
+import pymysql
+
+# same as tests/conftest.py - the function's modules import each other as top level modules
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "idle_shutdown"
+    ),
+)
+
+import app  # noqa: E402
+import clients  # noqa: E402
+import reachability  # noqa: E402
+import shards  # noqa: E402
+from credentials import invalidateCredentials  # noqa: E402
+from state import resetMemoryStore  # noqa: E402
+
+from .simulator import SimulatedFleet
+
+# runs lambda_handler end to end against a SimulatedFleet and measures it. e.g. from
+# lambda-rds-mysql-idle-shutdown/:
+#   python -m tests.benchmark.run --sizes 10,100,1000,10000 --db-latency-ms 20
+#   python -m tests.benchmark.run --sizes 1000 --set PROBE_CONCURRENCY=50 --json
+
+# the settings from template.yaml, minus the DynamoDB table
+DEFAULT_ENVIRONMENT = {
+    "PROBE_CONCURRENCY": "10",
+    "IDLE_DETECTOR": "general_log",
+    "IDLE_MINUTES": "60",
+    "TCP_PRECHECK": "true",
+    "UNREACHABLE_POLICY": "skip",
+    # the EMF lines would be mixed in with the results. --set EMF_OUTPUT=true to include them
+    "EMF_OUTPUT": "false",
+}
+TIMEOUT_MILLIS = 15 * 60 * 1000
+
+
+class FakeContext:
+    def __init__(self, timeoutMillis=TIMEOUT_MILLIS):
+        self.deadline = time.monotonic() + timeoutMillis / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def runSweep(fleet, environment=None, event=None, measureMemory=True):
+    # one lambda_handler invocation against the fleet. returns the handler's report plus
+    # wall time, peak memory (bytes allocated by Python while it ran) and the fleet's counts
+    environ = dict(DEFAULT_ENVIRONMENT, AWS_DEFAULT_REGION="us-west-2")
+    environ.update(environment or {})
+    invalidateCredentials()
+
+    # app's clients are lazy ones that go through clients.getClient when used
+    with mock.patch.dict(os.environ, environ, clear=True), mock.patch.object(
+        clients, "getClient", fleet.client
+    ), mock.patch.object(shards, "getClient", fleet.client), mock.patch.object(
+        pymysql, "connect", fleet.connect
+    ), mock.patch.object(
+        reachability, "isReachable", fleet.isReachable
+    ):
+        if measureMemory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        response = app.lambda_handler(event if event is not None else {}, FakeContext())
+        wallSeconds = time.perf_counter() - started
+        peak = None
+        if measureMemory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    report = json.loads(response["body"])
+    outcomes = Counter(r["outcome"] for r in report.get("results") or [])
+    # Aurora clusters are counted separately, as clusters_<outcome>, like the fleet totals
+    outcomes.update(
+        f'clusters_{r["outcome"]}'
+        for r in (report.get("clusters") or {}).get("results", [])
+    )
+    probes = report["timings"]["phases"].get("probe", {})
+    return {
+        "instances": len(fleet.instances),
+        "wall_seconds": round(wallSeconds, 3),
+        "probe_p50_ms": probes.get("p50_ms"),
+        "probe_p99_ms": probes.get("p99_ms"),
+        "peak_memory_mb": None if peak is None else round(peak / 1024 / 1024, 2),
+        "outcomes": dict(sorted(outcomes.items())),
+        **fleet.summary(),
+        "report": report,
+    }
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(
+        description="Run the idle shutdown sweep against simulated fleets and measure it"
+    )
+    parser.add_argument("--sizes", default="10,100,1000", help="fleet sizes to run")
+    parser.add_argument("--active", type=float, default=0.3)
+    parser.add_argument("--stopped", type=float, default=0.1)
+    parser.add_argument("--exempt", type=float, default=0.05)
+    parser.add_argument("--unreachable", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0)
+    parser.add_argument("--no-tags-in-describe", action="store_true")
+    parser.add_argument(
+        "--clusters", type=int, default=0, help="Aurora clusters on top of --sizes"
+    )
+    parser.add_argument("--cluster-size", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="environment variable for the function, can be repeated",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="don't trace memory, it slows the run down",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON, not a table")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    environment = dict(entry.split("=", 1) for entry in args.set)
+    runs = []
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        # each fleet is a new container, with nothing remembered from the last one
+        resetMemoryStore()
+        fleet = SimulatedFleet(
+            size,
+            activeFraction=args.active,
+            stoppedFraction=args.stopped,
+            exemptFraction=args.exempt,
+            unreachableFraction=args.unreachable,
+            failureRate=args.failure_rate,
+            dbLatency=args.db_latency_ms / 1000,
+            apiLatency=args.api_latency_ms / 1000,
+            tagsInDescribe=not args.no_tags_in_describe,
+            clusters=args.clusters,
+            clusterSize=args.cluster_size,
+            seed=args.seed,
+        )
+        run = runSweep(fleet, environment, measureMemory=not args.no_memory)
+        run.pop("report")
+        runs.append(run)
+
+    if args.json:
+        print(json.dumps(runs, indent=2))
+        return
+
+    columns = (
+        "instances",
+        "wall_seconds",
+        "api_calls",
+        "db_round_trips",
+        "db_connects",
+        "stop_calls",
+        "probe_p50_ms",
+        "probe_p99_ms",
+        "peak_memory_mb",
+    )
+    print("  ".join(f"{c:>14}" for c in columns))
+    for run in runs:
+        print("  ".join(f"{str(run[c]):>14}" for c in columns))
+
+
+if __name__ == "__main__":
+    # the sweep logs a line or two per instance at WARNING, which swamps the results
+    logging.disable(logging.CRITICAL)
+    main()
@@ -0,0 +1,422 @@
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pymysql
+
+# a made up fleet of RDS instances for running lambda_handler end to end without AWS or MySQL
+# the AWS clients and pymysql.connect are replaced by the fakes here, which count every API
+# call and every DB round trip, and can be made slow or flaky
+
+UPTIME_SECONDS = 10 * 60 * 60
+ACTIVE_LAST_COMMAND = timedelta(minutes=5)
+IDLE_LAST_COMMAND = timedelta(hours=3)
+PAGE_SIZE = 100
+ACTIVE_METRICS = {
+    "DatabaseConnections": 4.0,
+    "ReadIOPS": 40.0,
+    "WriteIOPS": 25.0,
+    "CPUUtilization": 30.0,
+}
+IDLE_METRICS = {
+    "DatabaseConnections": 0.0,
+    "ReadIOPS": 0.2,
+    "WriteIOPS": 0.5,
+    "CPUUtilization": 1.5,
+}
+
+
+class SimulatedFleet:
+    def __init__(
+        self,
+        size,
+        activeFraction=0.3,
+        stoppedFraction=0.1,
+        exemptFraction=0.05,
+        unreachableFraction=0.0,
+        failureRate=0.0,
+        dbLatency=0.0,
+        apiLatency=0.0,
+        tagsInDescribe=True,
+        stopSeconds=0.0,
+        clusters=0,
+        clusterSize=2,
+        seed=1,
+    ):
+        # activeFraction etc are the share of instances that are in use, already stopped,
+        # tagged exempt, or can't be connected to at all. failureRate is the chance any one
+        # login drops its connection. dbLatency and apiLatency (seconds) are added to every
+        # DB round trip and AWS API call. a stopped instance goes from stopping to stopped
+        # stopSeconds after stop_db_instance. on top of the size standalone instances there
+        # are clusters Aurora MySQL clusters of clusterSize instances each
+        self.dbLatency = dbLatency
+        self.stopSeconds = stopSeconds
+        self.stopIssued = {}
+        self.apiLatency = apiLatency
+        self.failureRate = failureRate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.apiCalls = Counter()
+        self.db = Counter()
+        self.stopped = []
+        self.stoppedClusters = []
+        self.clusterStopIssued = {}
+        self.clients = {}
+        self.instances = []
+        self.clusters = []
+        self.tags = {}
+
+        def addInstance(name, status, **extra):
+            instance = {
+                "DBInstanceIdentifier": name,
+                "DBInstanceArn": f"arn:aws:rds:us-west-2:123456789012:db:{name}",
+                "DBInstanceStatus": status,
+                "Engine": "mysql",
+                "DBInstanceClass": "db.t3.medium",
+                "Endpoint": {
+                    "Address": f"{name}.simulated.rds.amazonaws.com",
+                    "Port": 3306,
+                },
+                **extra,
+            }
+            tags = [
+                {
+                    "Key": "RDS_IDLE_EXEMPT",
+                    "Value": (
+                        "TRUE" if self.random.random() < exemptFraction else "FALSE"
+                    ),
+                }
+            ]
+            if tagsInDescribe:
+                instance["TagList"] = tags
+            self.instances.append(instance)
+            self.tags[instance["DBInstanceArn"]] = tags
+            return instance
+
+        for index in range(size):
+            addInstance(
+                f"sim-{index:05d}",
+                "stopped" if self.random.random() < stoppedFraction else "available",
+            )
+        for index in range(clusters):
+            name = f"sim-cluster-{index:04d}"
+            status = (
+                "stopped" if self.random.random() < stoppedFraction else "available"
+            )
+            members = [
+                addInstance(
+                    f"{name}-{n}",
+                    status,
+                    Engine="aurora-mysql",
+                    DBClusterIdentifier=name,
+                )
+                for n in range(clusterSize)
+            ]
+            self.clusters.append(
+                {
+                    "DBClusterIdentifier": name,
+                    "DBClusterArn": f"arn:aws:rds:us-west-2:123456789012:cluster:{name}",
+                    "Status": status,
+                    "Engine": "aurora-mysql",
+                    "Endpoint": f"{name}.cluster-simulated.rds.amazonaws.com",
+                    "TagList": [],
+                    "DBClusterMembers": [
+                        {
+                            "DBInstanceIdentifier": m["DBInstanceIdentifier"],
+                            "IsClusterWriter": n == 0,
+                        }
+                        for n, m in enumerate(members)
+                    ],
+                }
+            )
+        self.active = {
+            i["Endpoint"]["Address"]
+            for i in self.instances
+            if self.random.random() < activeFraction
+        }
+        self.byId = {i["DBInstanceIdentifier"]: i for i in self.instances}
+        self.clustersById = {c["DBClusterIdentifier"]: c for c in self.clusters}
+        self.unreachable = {
+            i["Endpoint"]["Address"]
+            for i in self.instances
+            if self.random.random() < unreachableFraction
+        }
+
+    def call(self, name):
+        with self.lock:
+            self.apiCalls[name] += 1
+        if self.apiLatency:
+            time.sleep(self.apiLatency)
+
+    def roundTrip(self, kind):
+        with self.lock:
+            self.db[kind] += 1
+        if self.dbLatency:
+            time.sleep(self.dbLatency)
+
+    def client(self, service, region=None, roleArn=None):
+        # stands in for clients.getClient. one client per service, like the real cache
+        if service not in FAKES:
+            raise NotImplementedError(
+                f"The simulated fleet has no fake {service} client"
+            )
+        with self.lock:
+            if service not in self.clients:
+                self.clients[service] = FAKES[service](self)
+            return self.clients[service]
+
+    def connect(self, host, **kwargs):
+        # stands in for pymysql.connect
+        self.roundTrip("connects")
+        if host in self.unreachable:
+            raise pymysql.err.OperationalError(
+                2003, f"Can't connect to MySQL server on '{host}' (timed out)"
+            )
+        with self.lock:
+            failed = self.random.random() < self.failureRate
+        if failed:
+            raise pymysql.err.OperationalError(
+                2013, "Lost connection to MySQL server during query"
+            )
+        return FakeConnection(self, host)
+
+    def settleStops(self):
+        # instances stopped long enough ago have finished stopping
+        with self.lock:
+            now = time.monotonic()
+            for instanceId, issued in list(self.stopIssued.items()):
+                if now - issued >= self.stopSeconds:
+                    self.byId[instanceId]["DBInstanceStatus"] = "stopped"
+                    del self.stopIssued[instanceId]
+            for clusterId, issued in list(self.clusterStopIssued.items()):
+                if now - issued >= self.stopSeconds:
+                    cluster = self.clustersById[clusterId]
+                    cluster["Status"] = "stopped"
+                    for m in cluster["DBClusterMembers"]:
+                        self.byId[m["DBInstanceIdentifier"]][
+                            "DBInstanceStatus"
+                        ] = "stopped"
+                    del self.clusterStopIssued[clusterId]
+
+    def isReachable(self, instance, timeout):
+        # stands in for reachability.isReachable
+        return instance["Endpoint"]["Address"] not in self.unreachable
+
+    def summary(self):
+        return {
+            "api_calls": sum(self.apiCalls.values()),
+            "api_calls_by_operation": dict(sorted(self.apiCalls.items())),
+            "db_connects": self.db["connects"],
+            "db_round_trips": self.db["connects"] + self.db["queries"],
+            "stop_calls": len(self.stopped) + len(self.stoppedClusters),
+        }
+
+
+class FakeConnection:
+    def __init__(self, fleet, host):
+        self.fleet = fleet
+        self.host = host
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def cursor(self):
+        return FakeCursor(self.fleet, self.host)
+
+    def ping(self, reconnect=False):
+        self.fleet.roundTrip("queries")
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    # answers the statements app.py and activity.py send, from the instance's activity pattern
+    def __init__(self, fleet, host):
+        self.fleet = fleet
+        self.active = host in fleet.active
+        self.sql = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, args=None):
+        self.fleet.roundTrip("queries")
+        self.sql = sql
+
+    def fetchone(self):
+        now = datetime.now().replace(microsecond=0)
+        lastCommand = now - (ACTIVE_LAST_COMMAND if self.active else IDLE_LAST_COMMAND)
+        if "events_statements_summary" in self.sql:
+            return {
+                "statements": int(time.time()) if self.active else 1000,
+                "sessions": 1 if self.active else 0,
+                "uptime": UPTIME_SECONDS,
+            }
+        if "general_log" in self.sql and "Uptime" in self.sql:
+            return {
+                "db_last_command_time": lastCommand,
+                "db_now": now,
+                "uptime_seconds": UPTIME_SECONDS,
+            }
+        if "general_log" in self.sql:
+            return {"db_last_command_time": lastCommand, "user_host": "app[app] @ host"}
+        if "now()" in self.sql:
+            return {"now()": now}
+        if "Uptime" in self.sql:
+            return {
+                "hours": "%02d" % (UPTIME_SECONDS // 3600),
+                "minutes": "%02d" % (UPTIME_SECONDS % 3600 // 60),
+            }
+        return {}
+
+
+class Paginator:
+    def __init__(self, fleet, name, pages):
+        self.fleet = fleet
+        self.name = name
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        for page in self.pages(**kwargs):
+            self.fleet.call(self.name)
+            yield page
+
+
+def pages(items, key, size=PAGE_SIZE):
+    for start in range(0, max(1, len(items)), size):
+        yield {key: items[start : start + size]}
+
+
+class FakeRDS:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def get_paginator(self, name):
+        return Paginator(self.fleet, f"rds.{name}", getattr(self, f"{name}_pages"))
+
+    def describe_db_instances_pages(self, Filters=None, **kwargs):
+        instances = self.fleet.instances
+        for entry in Filters or []:
+            if entry["Name"] == "db-instance-id":
+                instances = [self.fleet.byId[i] for i in entry["Values"]]
+            elif entry["Name"] == "db-cluster-id":
+                instances = [
+                    i
+                    for i in instances
+                    if i.get("DBClusterIdentifier") in entry["Values"]
+                ]
+        self.fleet.settleStops()
+        # a fresh copy of each page, like a real API response
+        for page in pages(instances, "DBInstances"):
+            yield {
+                "DBInstances": [
+                    dict(i, Endpoint=dict(i["Endpoint"])) for i in page["DBInstances"]
+                ]
+            }
+
+    def describe_db_clusters_pages(self, **kwargs):
+        self.fleet.settleStops()
+        for page in pages(self.fleet.clusters, "DBClusters"):
+            yield {
+                "DBClusters": [
+                    dict(c, DBClusterMembers=[dict(m) for m in c["DBClusterMembers"]])
+                    for c in page["DBClusters"]
+                ]
+            }
+
+    def list_tags_for_resource(self, ResourceName):
+        self.fleet.call("rds.list_tags_for_resource")
+        return {"TagList": self.fleet.tags[ResourceName]}
+
+    def stop_db_instance(self, DBInstanceIdentifier):
+        self.fleet.call("rds.stop_db_instance")
+        with self.fleet.lock:
+            self.fleet.stopped.append(DBInstanceIdentifier)
+            self.fleet.byId[DBInstanceIdentifier]["DBInstanceStatus"] = "stopping"
+            self.fleet.stopIssued[DBInstanceIdentifier] = time.monotonic()
+        return {}
+
+    def stop_db_cluster(self, DBClusterIdentifier):
+        self.fleet.call("rds.stop_db_cluster")
+        with self.fleet.lock:
+            self.fleet.stoppedClusters.append(DBClusterIdentifier)
+            cluster = self.fleet.clustersById[DBClusterIdentifier]
+            cluster["Status"] = "stopping"
+            for m in cluster["DBClusterMembers"]:
+                self.fleet.byId[m["DBInstanceIdentifier"]][
+                    "DBInstanceStatus"
+                ] = "stopping"
+            self.fleet.clusterStopIssued[DBClusterIdentifier] = time.monotonic()
+        return {}
+
+
+class FakeCloudWatch:
+    # a minute by minute history for every instance: the active ones always have a connection
+    # and some load, the idle ones have neither
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, NextToken=None):
+        self.fleet.call("cloudwatch.get_metric_data")
+        minutes = int((EndTime - StartTime).total_seconds() // 60)
+        results = []
+        for query in MetricDataQueries:
+            metric = query["MetricStat"]["Metric"]
+            [dimension] = metric["Dimensions"]
+            instance = self.fleet.byId[dimension["Value"]]
+            active = instance["Endpoint"]["Address"] in self.fleet.active
+            value = (ACTIVE_METRICS if active else IDLE_METRICS)[metric["MetricName"]]
+            results.append({"Id": query["Id"], "Values": [value] * minutes})
+        return {"MetricDataResults": results}
+
+
+class FakeSSM:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self.fleet.call("ssm.get_parameters")
+        return {"Parameters": [{"Name": name, "Value": "simulated"} for name in Names]}
+
+
+class FakeEC2:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def get_paginator(self, name):
+        return Paginator(
+            self.fleet, f"ec2.{name}", lambda **kwargs: pages([], "VpcEndpoints")
+        )
+
+
+class FakeTagging:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def get_paginator(self, name):
+        mappings = [
+            {"ResourceARN": arn, "Tags": tags} for arn, tags in self.fleet.tags.items()
+        ]
+        return Paginator(
+            self.fleet,
+            f"resourcegroupstaggingapi.{name}",
+            lambda **kwargs: pages(mappings, "ResourceTagMappingList"),
+        )
+
+
+FAKES = {
+    "rds": FakeRDS,
+    "cloudwatch": FakeCloudWatch,
+    "ssm": FakeSSM,
+    "ec2": FakeEC2,
+    "resourcegroupstaggingapi": FakeTagging,
+}
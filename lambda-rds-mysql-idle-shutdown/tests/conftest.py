@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# the Lambda runtime puts the function's CodeUri on the path, so the modules in
+# idle_shutdown/ import each other as top level modules. do the same for the tests
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "idle_shutdown")
+)
+
+
+def make_instance(
+    name, status="available", address=None, port=3306, tags=None, **fields
+):
+    # a describe_db_instances entry with just the fields the function reads. tags=None leaves
+    # TagList out, like a describe that didn't return tags
+    instance = {
+        "DBInstanceIdentifier": name,
+        "DBInstanceArn": f"arn:aws:rds:us-west-2:123456789012:db:{name}",
+        "DBInstanceStatus": status,
+        "Endpoint": {
+            "Address": address or f"{name}.example",
+            "Port": port,
+            "HostedZoneId": "Z1",
+        },
+    }
+    if tags is not None:
+        instance["TagList"] = tags
+    instance.update(fields)
+    return instance
+
+
+@pytest.fixture(autouse=True)
+def freshContainer():
+    # state kept in memory lasts as long as the container, so each test starts with a new one
+    from state import resetMemoryStore
+
+    resetMemoryStore()
+    yield
+    resetMemoryStore()
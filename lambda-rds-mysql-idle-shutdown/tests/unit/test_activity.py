@@ -0,0 +1,134 @@
+import sqlite3
+
+from activity import (
+    GENERAL_LOG,
+    STATUS_COUNTERS,
+    detectorFor,
+    evaluateCounters,
+    isIdleByCounters,
+    sqlActiveSessions,
+)
+from state import MemoryStateStore
+
+HOUR = 60 * 60
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.executed = []
+
+    def execute(self, sql, args=None):
+        self.executed.append((sql, args))
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+
+def counters(statements, sessions=0, uptime=10 * HOUR):
+    return {"statements": statements, "sessions": sessions, "uptime": uptime}
+
+
+def test_detector_tag_overrides_default():
+    tagged = {"TagList": [{"Key": "rds_idle_detector", "Value": "Status_Counters"}]}
+    untagged = {"TagList": []}
+    bogus = {
+        "DBInstanceIdentifier": "db",
+        "TagList": [{"Key": "RDS_IDLE_DETECTOR", "Value": "tea leaves"}],
+    }
+
+    assert detectorFor(tagged) == STATUS_COUNTERS
+    assert detectorFor(untagged) == GENERAL_LOG
+    assert detectorFor(untagged, default=STATUS_COUNTERS) == STATUS_COUNTERS
+    assert detectorFor(bogus) == GENERAL_LOG
+
+
+def test_no_statements_since_boot_is_idle_without_baseline():
+    idle, snapshot = evaluateCounters(counters(0), None, HOUR, now=100 * HOUR)
+
+    assert idle
+    assert snapshot["last_active"] == 90 * HOUR
+
+
+def test_statements_without_baseline_are_treated_as_recent():
+    idle, snapshot = evaluateCounters(counters(50), None, HOUR, now=100 * HOUR)
+
+    assert not idle
+    assert snapshot["last_active"] == 100 * HOUR
+
+
+def test_unchanged_counters_become_idle_after_threshold():
+    _, first = evaluateCounters(counters(50), None, HOUR, now=100 * HOUR)
+
+    idle, _ = evaluateCounters(counters(50), first, HOUR, now=100 * HOUR + 1800)
+    assert not idle
+
+    idle, _ = evaluateCounters(counters(50), first, HOUR, now=101 * HOUR)
+    assert idle
+
+
+def test_new_statements_or_sessions_reset_the_clock():
+    previous = {"statements": 50, "uptime": 9 * HOUR, "last_active": 0}
+
+    idle, snapshot = evaluateCounters(counters(51), previous, HOUR, now=100 * HOUR)
+    assert not idle and snapshot["last_active"] == 100 * HOUR
+
+    idle, snapshot = evaluateCounters(
+        counters(50, sessions=1), previous, HOUR, now=100 * HOUR
+    )
+    assert not idle and snapshot["last_active"] == 100 * HOUR
+
+
+def test_recent_restart_is_not_idle():
+    previous = {"statements": 500, "uptime": 50 * HOUR, "last_active": 0}
+
+    idle, _ = evaluateCounters(counters(0, uptime=600), previous, HOUR, now=100 * HOUR)
+
+    assert not idle
+
+
+def test_counter_probe_excludes_rdsadmin_and_own_user():
+    cursor = FakeCursor([{"statements": "0", "sessions": "0", "uptime": "7200"}])
+    instance = {"DBInstanceIdentifier": "db", "Endpoint": {"Address": "db.example"}}
+
+    assert isIdleByCounters(
+        instance, cursor, "idlecheck", store=MemoryStateStore(), now=10 * HOUR
+    )
+    assert len(cursor.executed) == 1
+    assert cursor.executed[0][1] == (
+        "%rdsadmin%",
+        "%idlecheck%",
+        "%rdsadmin%",
+        "%idlecheck%",
+    )
+    assert "general_log" not in cursor.executed[0][0]
+
+
+def test_daemon_threads_are_not_sessions():
+    # the sessions subquery run against a stand in performance_schema.threads
+    db = sqlite3.connect(":memory:")
+    db.execute("attach database ':memory:' as performance_schema")
+    db.execute(
+        "create table performance_schema.threads "
+        "(TYPE text, PROCESSLIST_USER text, PROCESSLIST_COMMAND text)"
+    )
+    db.executemany(
+        "insert into performance_schema.threads values (?, ?, ?)",
+        [
+            ("BACKGROUND", None, None),
+            ("FOREGROUND", "event_scheduler", "Daemon"),
+            ("FOREGROUND", "system user", None),
+            ("FOREGROUND", "rdsadmin", "Sleep"),
+            ("FOREGROUND", "idlecheck", "Query"),
+        ],
+    )
+
+    def sessions():
+        sql = sqlActiveSessions.replace("%s", "?")
+        return db.execute(sql, ("%rdsadmin%", "%idlecheck%")).fetchone()[0]
+
+    assert sessions() == 0
+    db.execute(
+        "insert into performance_schema.threads values ('FOREGROUND', 'app', 'Sleep')"
+    )
+    assert sessions() == 1
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+from unittest import mock
+
+import cli
+import clients
+import pymysql
+import reachability
+from credentials import invalidateCredentials
+from inventory import InventoryRDS, loadInventory
+
+from ..benchmark.simulator import SimulatedFleet
+
+ENVIRONMENT = {"AWS_DEFAULT_REGION": "us-west-2", "CLUSTER_MODE": "false"}
+
+
+def runCli(fleet, argv, capsys):
+    invalidateCredentials()
+    root = logging.getLogger()
+    level = root.level
+    with mock.patch.dict(os.environ, ENVIRONMENT), mock.patch.object(
+        clients, "getClient", fleet.client
+    ), mock.patch.object(pymysql, "connect", fleet.connect), mock.patch.object(
+        reachability, "isReachable", fleet.isReachable
+    ):
+        try:
+            status = cli.main(argv, environ=ENVIRONMENT)
+        finally:
+            root.setLevel(level)
+    return status, capsys.readouterr().out
+
+
+def writeInventory(fleet, path):
+    path.write_text(json.dumps({"DBInstances": fleet.instances}))
+    return str(path)
+
+
+def test_inventory_is_filtered_like_the_api(tmp_path):
+    fleet = SimulatedFleet(5, seed=9)
+    snapshot = loadInventory(writeInventory(fleet, tmp_path / "fleet.json"))
+    rds = InventoryRDS(snapshot, rds=fleet.client("rds"))
+
+    pages = rds.get_paginator("describe_db_instances").paginate(
+        Filters=[{"Name": "db-instance-id", "Values": ["sim-00001", "sim-00003"]}]
+    )
+
+    assert [i["DBInstanceIdentifier"] for p in pages for i in p["DBInstances"]] == [
+        "sim-00001",
+        "sim-00003",
+    ]
+    assert "rds.describe_db_instances" not in fleet.apiCalls
+    # anything else goes to the real client
+    rds.stop_db_instance(DBInstanceIdentifier="sim-00001")
+    assert fleet.stopped == ["sim-00001"]
+
+
+def test_dry_run_from_an_inventory_stops_nothing(tmp_path, capsys):
+    fleet = SimulatedFleet(20, activeFraction=0.2, stoppedFraction=0.0, seed=10)
+    inventory = writeInventory(fleet, tmp_path / "fleet.json")
+
+    status, output = runCli(
+        fleet,
+        ["--inventory", inventory, "--dry-run", "--format", "json"],
+        capsys,
+    )
+
+    report = json.loads(output)
+    assert status == 0
+    assert fleet.stopped == []
+    assert "rds.describe_db_instances" not in fleet.apiCalls
+    assert "ec2.describe_vpc_endpoints" not in fleet.apiCalls
+    outcomes = {r["outcome"] for r in report["results"]}
+    assert "idle" in outcomes
+    assert "stopped" not in outcomes
+
+
+def test_live_sweep_with_flags(capsys):
+    fleet = SimulatedFleet(10, seed=11)
+
+    status, output = runCli(
+        fleet, ["--concurrency", "4", "--detector", "general_log"], capsys
+    )
+
+    assert status == 0
+    assert fleet.stopped
+    assert "instances checked" in output
+    for instanceId in fleet.stopped:
+        assert f"{instanceId}: stopped" in output
+        assert f"Confirmed stopped: {instanceId} (db.t3.medium)" in output
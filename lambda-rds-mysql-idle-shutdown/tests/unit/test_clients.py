@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+import clients
+from clients import LazyClient, configureClients, lazyClient
+
+FUNCTION_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "idle_shutdown"
+)
+
+
+def test_lazy_client_is_only_built_when_used(mocker):
+    built = []
+
+    def getClient(service, region=None, roleArn=None):
+        built.append((service, region, roleArn))
+        return mocker.MagicMock()
+
+    mocker.patch.object(clients, "getClient", side_effect=getClient)
+    ssm = lazyClient("ssm", region="eu-west-1")
+
+    assert isinstance(ssm, LazyClient)
+    assert lazyClient("ssm", region="eu-west-1") is ssm
+    assert built == []
+    ssm.get_parameters(Names=["a"])
+    assert built == [("ssm", "eu-west-1", None)]
+
+
+def test_pool_size_applies_to_new_clients():
+    clients.resetClients()
+    configureClients(poolSize=42)
+    try:
+        rds = clients.getClient("rds", region="us-west-2")
+        assert rds.meta.config.max_pool_connections == 42
+        # botocore's own retries stay off
+        assert rds.meta.config.retries["total_max_attempts"] == 1
+    finally:
+        configureClients()
+        clients.resetClients()
+
+
+def test_importing_app_leaves_pymysql_unloaded():
+    # a fresh interpreter, since this one has imported pymysql for other tests already
+    code = (
+        "import json, sys; import app; "
+        "print(json.dumps(['pymysql' in sys.modules, app.coldStart()]))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=FUNCTION_DIR,
+        env=dict(os.environ, PYTHONPATH=FUNCTION_DIR, AWS_DEFAULT_REGION="us-west-2"),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    loaded, coldStart = json.loads(output)
+
+    assert not loaded
+    assert coldStart["cold"]
+    assert coldStart["import_ms"] > 0
+    assert coldStart["init_ms"] >= coldStart["import_ms"]
@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+import app
+from cloudwatch import ACTIVE, BORDERLINE, IDLE, classifyFleet, classifyMetrics
+from settings import loadSettings
+
+from ..conftest import make_instance
+
+HOUR = 60 * 60
+END = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def quiet_hour(**overrides):
+    metrics = {
+        "DatabaseConnections": [0.0] * 60,
+        "ReadIOPS": [0.2] * 60,
+        "WriteIOPS": [1.0] * 60,
+        "CPUUtilization": [2.5] * 60,
+    }
+    metrics.update(overrides)
+    return metrics
+
+
+def classify(metrics):
+    return classifyMetrics(metrics, HOUR, cpuThreshold=5.0, iopsThreshold=5.0)
+
+
+def test_classify():
+    assert classify(quiet_hour()) == IDLE
+    assert classify(quiet_hour(DatabaseConnections=[1.0] * 10 + [0.0] * 50)) == ACTIVE
+    # our own login shows up as a connection for a minute
+    assert classify(quiet_hour(DatabaseConnections=[1.0] + [0.0] * 59)) == BORDERLINE
+    assert classify(quiet_hour(CPUUtilization=[2.5] * 59 + [40.0])) == BORDERLINE
+    # only started 20 minutes ago
+    assert classify(quiet_hour(CPUUtilization=[2.5] * 20)) == BORDERLINE
+
+
+def test_short_window_with_no_data_is_borderline():
+    # IDLE_MINUTES=5 is within the missing data allowance
+    empty = {metric: [] for metric in quiet_hour()}
+    assert classifyMetrics(empty, 5 * 60, cpuThreshold=5.0, iopsThreshold=5.0) == (
+        BORDERLINE
+    )
+    assert (
+        classifyMetrics(
+            quiet_hour(CPUUtilization=[]), 60, cpuThreshold=5.0, iopsThreshold=5.0
+        )
+        == BORDERLINE
+    )
+
+
+def test_fleet_is_fetched_in_batches_of_500_queries():
+    cloudwatch = boto3.client("cloudwatch", region_name="us-west-2")
+    instances = [{"DBInstanceIdentifier": f"db{i}"} for i in range(130)]
+
+    def response(first, count):
+        results = []
+        for index in range(first, first + count):
+            for metricIndex, values in enumerate(quiet_hour().values()):
+                results.append(
+                    {
+                        "Id": f"m{index}_{metricIndex}",
+                        "Values": values,
+                        "StatusCode": "Complete",
+                    }
+                )
+        return {"MetricDataResults": results}
+
+    with Stubber(cloudwatch) as stub:
+        # 130 instances x 4 metrics = 520 queries, so two calls
+        stub.add_response(
+            "get_metric_data",
+            response(0, 125),
+            {"MetricDataQueries": ANY, "StartTime": ANY, "EndTime": END},
+        )
+        stub.add_response(
+            "get_metric_data",
+            response(125, 5),
+            {"MetricDataQueries": ANY, "StartTime": ANY, "EndTime": END},
+        )
+
+        verdicts, summary = classifyFleet(
+            cloudwatch, instances, END, HOUR, cpuThreshold=5.0, iopsThreshold=5.0
+        )
+
+    assert summary["get_metric_data_calls"] == 2
+    assert summary[IDLE] == 130
+    assert set(verdicts.values()) == {IDLE}
+
+
+@pytest.mark.parametrize("mode, verdict", [("prefilter", None), ("only", BORDERLINE)])
+def test_metrics_failure_falls_back(mocker, mode, verdict):
+    cloudwatch = mocker.MagicMock()
+    cloudwatch.get_metric_data.side_effect = RuntimeError("AccessDenied")
+    instances = [make_instance("db1"), make_instance("db2", status="stopped")]
+
+    verdicts, summary = app.metricsVerdictsFor(
+        loadSettings({"METRICS_MODE": mode}), lambda service: cloudwatch, instances
+    )
+
+    # prefilter logs in to everything, only leaves everything alone
+    assert verdicts.get("db1") == verdict
+    assert "db2" not in verdicts
+    assert summary["get_metric_data_failures"] == 1
@@ -0,0 +1,204 @@
+import threading
+
+import pytest
+
+import app
+from clusters import listClusters
+from settings import loadSettings
+from state import MemoryStateStore
+
+from ..benchmark.run import runSweep
+from ..benchmark.simulator import SimulatedFleet
+from ..conftest import make_instance
+
+
+def member(name, cluster=None, exempt="FALSE"):
+    return make_instance(
+        name,
+        tags=[{"Key": "RDS_IDLE_EXEMPT", "Value": exempt}],
+        DBClusterIdentifier=cluster,
+        Engine="aurora-mysql" if cluster else "mysql",
+    )
+
+
+def make_cluster(name, members, status="available"):
+    return {
+        "DBClusterIdentifier": name,
+        "Status": status,
+        "Endpoint": f"{name}.cluster.example",
+        "TagList": [],
+        "DBClusterMembers": [
+            {
+                "DBInstanceIdentifier": m["DBInstanceIdentifier"],
+                "IsClusterWriter": i == 1,
+            }
+            for i, m in enumerate(members)
+        ],
+    }
+
+
+class FakeRDS:
+    def __init__(self, clusters, instances):
+        self.clusters = clusters
+        self.instances = instances
+        self.calls = []
+
+    def get_paginator(self, name):
+        self.calls.append(name)
+        return Pages(self, name)
+
+    def stop_db_instance(self, DBInstanceIdentifier):
+        self.calls.append(("stop_db_instance", DBInstanceIdentifier))
+
+    def stop_db_cluster(self, DBClusterIdentifier):
+        self.calls.append(("stop_db_cluster", DBClusterIdentifier))
+
+
+class Pages:
+    def __init__(self, rds, name):
+        self.rds = rds
+        self.name = name
+
+    def paginate(self, Filters=None):
+        if self.name == "describe_db_clusters":
+            return iter([{"DBClusters": self.rds.clusters}])
+        if Filters:
+            ids = Filters[0]["Values"]
+            return iter(
+                [
+                    {
+                        "DBInstances": [
+                            i
+                            for i in self.rds.instances
+                            if i["DBClusterIdentifier"] in ids
+                        ]
+                    }
+                ]
+            )
+        return iter([{"DBInstances": self.rds.instances}])
+
+
+class NoEndpoints:
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self):
+        return iter([{"VpcEndpoints": []}])
+
+
+def test_members_come_back_writer_first():
+    members = [member("reader", "dev"), member("writer", "dev")]
+    rds = FakeRDS([make_cluster("dev", members)], members)
+
+    [(cluster, found)] = list(listClusters(rds))
+
+    assert [m["DBInstanceIdentifier"] for m in found] == ["writer", "reader"]
+
+
+@pytest.mark.parametrize("streaming", ["true", "false"])
+@pytest.mark.parametrize(
+    "busy, exempt, stops",
+    [
+        ((), "FALSE", [("stop_db_cluster", "dev")]),
+        (("dev-2",), "FALSE", []),
+        ((), "TRUE", []),
+    ],
+)
+def test_cluster_is_stopped_once_when_every_member_is_idle(
+    mocker, streaming, busy, exempt, stops
+):
+    members = [
+        member("dev-1", "dev"),
+        member("dev-2", "dev"),
+        member("dev-3", "dev", exempt=exempt),
+    ]
+    rds = FakeRDS([make_cluster("dev", members)], members + [member("solo")])
+    probed = []
+
+    def isIdleBySQL(instance, *args, **kwargs):
+        probed.append(instance["DBInstanceIdentifier"])
+        return instance["DBInstanceIdentifier"] not in busy + ("solo",)
+
+    mocker.patch.object(app, "isIdleBySQL", side_effect=isIdleBySQL)
+    settings = loadSettings({"PROBE_CONCURRENCY": "3", "STREAM_PIPELINE": streaming})
+
+    report = app.sweep(
+        settings,
+        MemoryStateStore(),
+        clientFor={"rds": rds, "ssm": None, "ec2": NoEndpoints()}.get,
+    )
+
+    # the Aurora instances are only checked as part of their cluster
+    assert [r["instance"] for r in report["results"]] == ["solo"]
+    assert [c for c in rds.calls if isinstance(c, tuple)] == stops
+    if exempt == "TRUE":
+        assert report["clusters"]["exempt"] == 1
+        assert sorted(probed) == ["solo"]
+    else:
+        assert sorted(probed) == ["dev-1", "dev-2", "dev-3", "solo"]
+        [result] = report["clusters"]["results"]
+        assert result["outcome"] == ("not_idle" if busy else "stopped")
+
+
+def test_clusters_are_checked_side_by_side_with_one_metrics_call(mocker):
+    clusters = [member("dev-1", "dev"), member("test-1", "test")]
+    rds = FakeRDS(
+        [make_cluster("dev", clusters[:1]), make_cluster("test", clusters[1:])],
+        clusters,
+    )
+    cloudwatch = mocker.MagicMock()
+    cloudwatch.get_metric_data.return_value = {"MetricDataResults": []}
+    # only gets through if both clusters are being probed at the same time
+    together = threading.Barrier(2, timeout=5)
+
+    def isIdleBySQL(instance, *args, **kwargs):
+        together.wait()
+        return True
+
+    mocker.patch.object(app, "isIdleBySQL", side_effect=isIdleBySQL)
+    settings = loadSettings({"PROBE_CONCURRENCY": "2", "METRICS_MODE": "prefilter"})
+
+    report = app.checkClusters(
+        settings,
+        MemoryStateStore(),
+        clientFor={"rds": rds, "ssm": None, "cloudwatch": cloudwatch}.get,
+    )
+
+    assert cloudwatch.get_metric_data.call_count == 1
+    assert [r["cluster"] for r in report["results"]] == ["dev", "test"]
+    assert [r["outcome"] for r in report["results"]] == ["stopped", "stopped"]
+
+
+def test_simulated_clusters_are_ruled_in_by_their_metrics():
+    fleet = SimulatedFleet(
+        10,
+        activeFraction=0.3,
+        stoppedFraction=0.0,
+        exemptFraction=0.0,
+        clusters=4,
+        clusterSize=3,
+        seed=5,
+    )
+    busy = {
+        c["DBClusterIdentifier"]
+        for c in fleet.clusters
+        for m in c["DBClusterMembers"]
+        if fleet.byId[m["DBInstanceIdentifier"]]["Endpoint"]["Address"] in fleet.active
+    }
+
+    run = runSweep(fleet, {"METRICS_MODE": "prefilter"}, measureMemory=False)
+
+    # CloudWatch answers for every instance, so nobody is logged in to
+    assert run["api_calls_by_operation"]["cloudwatch.get_metric_data"] == 2
+    assert run["db_connects"] == 0
+    assert sorted(fleet.stoppedClusters) == sorted(
+        c["DBClusterIdentifier"]
+        for c in fleet.clusters
+        if c["DBClusterIdentifier"] not in busy
+    )
+    assert busy and len(busy) < len(fleet.clusters)
+
+
+def test_simulator_refuses_a_client_it_does_not_fake():
+    with pytest.raises(NotImplementedError, match="sts"):
+        SimulatedFleet(1).client("sts")
@@ -0,0 +1,158 @@
+import pymysql
+import pytest
+
+import app
+import connections
+from connections import (
+    TOKEN_TTL_SECONDS,
+    authToken,
+    checkin,
+    closeConnections,
+    closeIdleConnections,
+    reusableConnection,
+)
+from settings import loadSettings
+from state import MemoryStateStore, resetMemoryStore
+
+from ..benchmark.run import runSweep
+from ..benchmark.simulator import SimulatedFleet
+
+INSTANCE = {
+    "DBInstanceIdentifier": "db1",
+    "Endpoint": {"Address": "db1.example", "Port": 3306},
+}
+KEY = ("db1.example", 3306, "rds_idle_shutdown")
+
+
+@pytest.fixture(autouse=True)
+def emptyCaches():
+    connections.invalidateToken()
+    closeConnections()
+    yield
+    connections.invalidateToken()
+    closeConnections()
+
+
+@pytest.fixture
+def rds(mocker):
+    client = mocker.MagicMock()
+    client.meta.region_name = "us-west-2"
+    client.generate_db_auth_token.side_effect = lambda **kwargs: (
+        f"token{client.generate_db_auth_token.call_count}"
+    )
+    return client
+
+
+def test_auth_token_is_reused_until_it_nearly_expires(rds):
+    assert authToken(rds, "db1.example", 3306, "u", now=0) == "token1"
+    assert authToken(rds, "db1.example", 3306, "u", now=60) == "token1"
+    assert authToken(rds, "db2.example", 3306, "u", now=60) == "token2"
+    assert authToken(rds, "db1.example", 3306, "u", now=TOKEN_TTL_SECONDS) == "token3"
+    rds.generate_db_auth_token.assert_any_call(
+        DBHostname="db1.example", Port=3306, DBUsername="u", Region="us-west-2"
+    )
+
+
+def test_live_connection_is_reused_and_dead_one_replaced(mocker):
+    opened = []
+
+    def connect():
+        opened.append(mocker.MagicMock())
+        return opened[-1]
+
+    with reusableConnection(KEY, connect, reuse=True) as first:
+        pass
+    with reusableConnection(KEY, connect, reuse=True) as second:
+        pass
+    assert second is first
+    first.ping.assert_called_once_with(reconnect=False)
+    first.close.assert_not_called()
+
+    first.ping.side_effect = pymysql.err.OperationalError(2006, "gone away")
+    with reusableConnection(KEY, connect, reuse=True) as third:
+        pass
+    assert third is not first
+    first.close.assert_called_once()
+    assert len(opened) == 2
+
+
+def test_connection_is_not_cached_after_a_failure_or_when_stale(mocker):
+    connect = mocker.MagicMock(side_effect=lambda: mocker.MagicMock())
+
+    with pytest.raises(ValueError):
+        with reusableConnection(KEY, connect, reuse=True) as failed:
+            raise ValueError("query failed")
+    failed.close.assert_called_once()
+
+    stale = mocker.MagicMock()
+    checkin(KEY, stale, now=0)
+    with reusableConnection(KEY, connect, reuse=True, maxIdleSeconds=60) as fresh:
+        pass
+    assert fresh is not stale
+    stale.close.assert_called_once()
+    stale.ping.assert_not_called()
+
+
+def test_iam_login_uses_a_token_over_tls_and_never_touches_ssm(rds, mocker):
+    logins = []
+
+    def connect(instance, user, password, **options):
+        logins.append((user, password, options["ssl"]))
+        if password == "token1":
+            raise pymysql.err.OperationalError(1045, "Access denied")
+        return mocker.MagicMock()
+
+    mocker.patch.object(app, "connectToInstance", side_effect=connect)
+    mocker.patch.object(app, "isIdle", return_value=True)
+    ssm = mocker.MagicMock()
+
+    idle = app.isIdleBySQL(
+        INSTANCE,
+        ssm,
+        settings=loadSettings({"DB_AUTH": "iam"}),
+        store=MemoryStateStore(),
+        now=0,
+        rds=rds,
+    )
+
+    assert idle
+    assert logins == [
+        ("rds_idle_shutdown", "token1", {"check_hostname": False}),
+        ("rds_idle_shutdown", "token2", {"check_hostname": False}),
+    ]
+    assert ssm.mock_calls == []
+
+
+def test_warm_invocation_reuses_connections():
+    fleet = SimulatedFleet(
+        50, activeFraction=1.0, stoppedFraction=0.0, exemptFraction=0.0, seed=4
+    )
+    environment = {"CONNECTION_REUSE": "true", "TCP_PRECHECK": "false"}
+
+    cold = runSweep(fleet, environment, measureMemory=False)
+    # forget that they were all active just now, so every instance is due a check again
+    resetMemoryStore()
+    warm = runSweep(fleet, environment, measureMemory=False)
+
+    assert cold["db_connects"] == 50
+    # the second run pinged the cached connections instead of opening new ones
+    assert warm["db_connects"] == cold["db_connects"]
+    assert warm["report"]["timings"]["phases"]["ping"]["count"] == 50
+
+
+def test_connections_idle_too_long_are_closed_at_the_start_of_a_run(mocker):
+    stale = mocker.MagicMock()
+    recent = mocker.MagicMock()
+    checkin(KEY, stale, now=0)
+    checkin(("db2.example", 3306, "rds_idle_shutdown"), recent, now=500)
+
+    assert closeIdleConnections(600, now=700) == 1
+
+    stale.close.assert_called_once()
+    recent.close.assert_not_called()
+
+
+def test_reuse_is_refused_with_cloudwatch_metrics():
+    # a cached session counts in DatabaseConnections and would keep the instance active
+    with pytest.raises(ValueError):
+        loadSettings({"CONNECTION_REUSE": "true", "METRICS_MODE": "prefilter"})
@@ -0,0 +1,70 @@
+import boto3
+import pymysql
+import pytest
+from botocore.stub import Stubber
+
+import app
+from credentials import (
+    PASSWORD_PATH,
+    USERNAME_PATH,
+    getCredentials,
+    invalidateCredentials,
+)
+from settings import loadSettings
+from state import MemoryStateStore
+
+
+def parameters_response(password):
+    return {
+        "Parameters": [
+            {"Name": USERNAME_PATH, "Value": "idlecheck", "Type": "String"},
+            {"Name": PASSWORD_PATH, "Value": password, "Type": "SecureString"},
+        ]
+    }
+
+
+EXPECTED_PARAMS = {"Names": [USERNAME_PATH, PASSWORD_PATH], "WithDecryption": True}
+
+
+@pytest.fixture()
+def ssm():
+    invalidateCredentials()
+    client = boto3.client("ssm", region_name="us-west-2")
+    with Stubber(client) as stub:
+        yield client, stub
+    invalidateCredentials()
+
+
+def test_one_ssm_call_until_ttl_expires(ssm):
+    client, stub = ssm
+    stub.add_response("get_parameters", parameters_response("one"), EXPECTED_PARAMS)
+    stub.add_response("get_parameters", parameters_response("two"), EXPECTED_PARAMS)
+
+    assert getCredentials(client, ttl=300, now=0) == ("idlecheck", "one")
+    assert getCredentials(client, ttl=300, now=299) == ("idlecheck", "one")
+    assert getCredentials(client, ttl=300, now=300) == ("idlecheck", "two")
+    stub.assert_no_pending_responses()
+
+
+def test_refused_login_refetches_credentials_once(ssm, mocker):
+    client, stub = ssm
+    stub.add_response("get_parameters", parameters_response("stale"), EXPECTED_PARAMS)
+    stub.add_response("get_parameters", parameters_response("fresh"), EXPECTED_PARAMS)
+    passwords = []
+
+    def connect(instance, user, password, **timeouts):
+        passwords.append(password)
+        if password == "stale":
+            raise pymysql.err.OperationalError(1045, "Access denied")
+        return mocker.MagicMock()
+
+    mocker.patch.object(app, "connectToInstance", side_effect=connect)
+    mocker.patch.object(app, "isIdle", return_value=False)
+    instance = {"DBInstanceIdentifier": "db1", "Endpoint": {"Address": "db1.example"}}
+
+    idle = app.isIdleBySQL(
+        instance, client, settings=loadSettings({}), store=MemoryStateStore(), now=0
+    )
+
+    assert not idle
+    assert passwords == ["stale", "fresh"]
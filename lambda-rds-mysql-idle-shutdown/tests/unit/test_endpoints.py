@@ -0,0 +1,56 @@
+import boto3
+from botocore.stub import Stubber
+
+from endpoints import cleanupEndpoints
+
+
+def endpoint(number, exempt=None):
+    item = {"VpcEndpointId": f"vpce-{number:04d}", "VpcId": "vpc-1"}
+    if exempt is not None:
+        item["Tags"] = [{"Key": "vpcendpoints_idle_exempt", "Value": exempt}]
+    return item
+
+
+def test_one_listing_and_batched_deletes_with_partial_failure():
+    ec2 = boto3.client("ec2", region_name="us-west-2")
+    firstPage = [endpoint(i) for i in range(20)] + [endpoint(20, exempt="True")]
+    secondPage = [endpoint(i) for i in range(21, 31)] + [endpoint(31, exempt="false")]
+
+    with Stubber(ec2) as stub:
+        stub.add_response(
+            "describe_vpc_endpoints", {"VpcEndpoints": firstPage, "NextToken": "more"}
+        )
+        stub.add_response(
+            "describe_vpc_endpoints",
+            {"VpcEndpoints": secondPage},
+            {"NextToken": "more"},
+        )
+        toDelete = [f"vpce-{i:04d}" for i in range(32) if i != 20]
+        stub.add_response(
+            "delete_vpc_endpoints",
+            {
+                "Unsuccessful": [
+                    {
+                        "ResourceId": "vpce-0003",
+                        "Error": {"Code": "InvalidState", "Message": "busy"},
+                    }
+                ]
+            },
+            {"VpcEndpointIds": toDelete[:25]},
+        )
+        stub.add_response(
+            "delete_vpc_endpoints",
+            {"Unsuccessful": []},
+            {"VpcEndpointIds": toDelete[25:]},
+        )
+
+        stats = cleanupEndpoints(ec2)
+
+    assert stats == {
+        "total": 32,
+        "deleted": 30,
+        "retained": 2,
+        "failed": 1,
+        "describe_calls": 2,
+        "delete_calls": 2,
+    }
@@ -0,0 +1,103 @@
+import boto3
+from botocore.stub import Stubber
+
+from exemptions import isExemptByTags, resolveExemptions
+
+from ..conftest import make_instance
+
+
+def test_tag_values_are_case_insensitive():
+    instance = make_instance("db")
+    assert isExemptByTags(instance, [{"Key": "rds_idle_exempt", "Value": "True"}])
+    assert not isExemptByTags(instance, [{"Key": "RDS_IDLE_EXEMPT", "Value": "false"}])
+    assert not isExemptByTags(instance, [{"Key": "RDS_IDLE_EXEMPT", "Value": "maybe"}])
+    assert not isExemptByTags(instance, [])
+
+
+def test_describe_tag_list_needs_no_api_calls():
+    rds = boto3.client("rds", region_name="us-west-2")
+    instances = [
+        make_instance("exempt", tags=[{"Key": "RDS_IDLE_EXEMPT", "Value": "TRUE"}]),
+        make_instance("plain", tags=[]),
+    ]
+
+    with Stubber(rds):
+        exempt, stats = resolveExemptions(rds, instances)
+
+    assert exempt == {
+        instances[0]["DBInstanceArn"]: True,
+        instances[1]["DBInstanceArn"]: False,
+    }
+    assert stats["per_resource_calls"] == 0
+    assert stats["api_calls_saved"] == 2
+
+
+def test_bulk_lookup_with_per_resource_fallback():
+    rds = boto3.client("rds", region_name="us-west-2")
+    tagging = boto3.client("resourcegroupstaggingapi", region_name="us-west-2")
+    instances = [make_instance(f"db{i}") for i in range(4)]
+
+    with Stubber(tagging) as taggingStub, Stubber(rds) as rdsStub:
+        taggingStub.add_response(
+            "get_resources",
+            {
+                "ResourceTagMappingList": [
+                    {
+                        "ResourceARN": instances[i]["DBInstanceArn"],
+                        "Tags": [{"Key": "RDS_IDLE_EXEMPT", "Value": "true"}],
+                    }
+                    for i in range(3)
+                ]
+            },
+            {"ResourceTypeFilters": ["rds:db"]},
+        )
+        # db3 has never been tagged so the tagging API doesn't know about it
+        rdsStub.add_response(
+            "list_tags_for_resource",
+            {"TagList": []},
+            {"ResourceName": instances[3]["DBInstanceArn"]},
+        )
+
+        exempt, stats = resolveExemptions(rds, instances, tagging=tagging)
+
+    assert [exempt[i["DBInstanceArn"]] for i in instances] == [True, True, True, False]
+    assert stats["bulk_calls"] == 1
+    assert stats["per_resource_calls"] == 1
+    assert stats["api_calls_saved"] == 2
+    assert instances[3]["TagList"] == []
+
+
+def test_bulk_walk_stops_when_lookups_are_cheaper():
+    rds = boto3.client("rds", region_name="us-west-2")
+    tagging = boto3.client("resourcegroupstaggingapi", region_name="us-west-2")
+    instances = [make_instance(f"db{i}") for i in range(2)]
+    other = {
+        "ResourceARN": "arn:aws:rds:us-west-2:123456789012:db:other",
+        "Tags": [],
+    }
+
+    with Stubber(tagging) as taggingStub, Stubber(rds) as rdsStub:
+        # the region has many more pages, none with these instances on
+        taggingStub.add_response(
+            "get_resources",
+            {"ResourceTagMappingList": [other], "PaginationToken": "page2"},
+            {"ResourceTypeFilters": ["rds:db"]},
+        )
+        taggingStub.add_response(
+            "get_resources",
+            {"ResourceTagMappingList": [other], "PaginationToken": "page3"},
+            {"ResourceTypeFilters": ["rds:db"], "PaginationToken": "page2"},
+        )
+        for instance in instances:
+            rdsStub.add_response(
+                "list_tags_for_resource",
+                {"TagList": []},
+                {"ResourceName": instance["DBInstanceArn"]},
+            )
+
+        exempt, stats = resolveExemptions(rds, instances, tagging=tagging)
+
+    assert not any(exempt.values())
+    assert stats["bulk_calls"] == 2
+    assert stats["per_resource_calls"] == 2
+    assert stats["api_calls_saved"] == 0
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from fleet import parseTargets, sweepFleet, targetLabel
+from state import MemoryStateStore, PrefixedStateStore
+
+ROLE = "arn:aws:iam::123456789012:role/idle-shutdown"
+
+
+def test_parse_targets():
+    assert parseTargets(None) == []
+    assert parseTargets("us-west-2, us-east-1") == [
+        {"region": "us-west-2"},
+        {"region": "us-east-1"},
+    ]
+    assert parseTargets(f'[{{"region": "eu-west-1", "role_arn": "{ROLE}"}}]') == [
+        {"region": "eu-west-1", "role_arn": ROLE}
+    ]
+    with pytest.raises(ValueError):
+        parseTargets(f'[{{"role_arn": "{ROLE}"}}]')
+
+
+def test_target_label():
+    assert targetLabel({"region": "eu-west-1", "role_arn": ROLE}) == (
+        "123456789012/eu-west-1"
+    )
+    assert targetLabel({"region": "us-west-2"}) == "local/us-west-2"
+
+
+def test_targets_run_in_parallel_and_fail_independently():
+    targets = [{"region": f"region-{i}"} for i in range(4)]
+
+    def sweepTarget(target):
+        time.sleep(0.2)
+        if target["region"] == "region-2":
+            raise RuntimeError("AccessDenied")
+        return {
+            "results": [
+                {"instance": "db1", "outcome": "stopped"},
+                {"instance": "db2", "outcome": "not_idle"},
+            ]
+        }
+
+    started = time.monotonic()
+    report = sweepFleet(targets, sweepTarget)
+
+    assert time.monotonic() - started < 0.6
+    assert report["totals"] == {
+        "targets": 4,
+        "failed_targets": 1,
+        "instances": 6,
+        "stopped": 3,
+        "not_idle": 3,
+    }
+    assert report["targets"]["local/region-2"]["error"] == "AccessDenied"
+
+
+def test_prefixed_state_keeps_targets_apart():
+    store = MemoryStateStore()
+    PrefixedStateStore(store, "111/us-west-2").put("db1", {"last_active": 1})
+    PrefixedStateStore(store, "222/us-west-2").put("db1", {"last_active": 2})
+
+    assert PrefixedStateStore(store, "111/us-west-2").get("db1") == {"last_active": 1}
+    assert store.get("222/us-west-2/db1") == {"last_active": 2}
@@ -1,73 +1,53 @@
-import json
+import math
 
 import pytest
 
-from hello_world import app
+from ..benchmark.run import runSweep
+from ..benchmark.simulator import SimulatedFleet
 
 
-@pytest.fixture()
-def apigw_event():
-    """ Generates API GW Event"""
+@pytest.mark.parametrize("streaming", ["true", "false"])
+def test_lambda_handler_stops_only_idle_instances(streaming):
+    fleet = SimulatedFleet(40, activeFraction=0.4, exemptFraction=0.2, seed=7)
+    idle = sorted(
+        i["DBInstanceIdentifier"]
+        for i in fleet.instances
+        if i["DBInstanceStatus"] == "available"
+        and i["TagList"][0]["Value"] == "FALSE"
+        and i["Endpoint"]["Address"] not in fleet.active
+    )
 
-    return {
-        "body": '{ "test": "body"}',
-        "resource": "/{proxy+}",
-        "requestContext": {
-            "resourceId": "123456",
-            "apiId": "1234567890",
-            "resourcePath": "/{proxy+}",
-            "httpMethod": "POST",
-            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
-            "accountId": "123456789012",
-            "identity": {
-                "apiKey": "",
-                "userArn": "",
-                "cognitoAuthenticationType": "",
-                "caller": "",
-                "userAgent": "Custom User Agent String",
-                "user": "",
-                "cognitoIdentityPoolId": "",
-                "cognitoIdentityId": "",
-                "cognitoAuthenticationProvider": "",
-                "sourceIp": "127.0.0.1",
-                "accountId": "",
-            },
-            "stage": "prod",
-        },
-        "queryStringParameters": {"foo": "bar"},
-        "headers": {
-            "Via": "1.1 08f323deadbeefa7af34d5feb414ce27.cloudfront.net (CloudFront)",
-            "Accept-Language": "en-US,en;q=0.8",
-            "CloudFront-Is-Desktop-Viewer": "true",
-            "CloudFront-Is-SmartTV-Viewer": "false",
-            "CloudFront-Is-Mobile-Viewer": "false",
-            "X-Forwarded-For": "127.0.0.1, 127.0.0.2",
-            "CloudFront-Viewer-Country": "US",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Upgrade-Insecure-Requests": "1",
-            "X-Forwarded-Port": "443",
-            "Host": "1234567890.execute-api.us-east-1.amazonaws.com",
-            "X-Forwarded-Proto": "https",
-            "X-Amz-Cf-Id": "aaaaaaaaaae3VYQb9jd-nvCd-de396Uhbp027Y2JvkCPNLmGJHqlaA==",
-            "CloudFront-Is-Tablet-Viewer": "false",
-            "Cache-Control": "max-age=0",
-            "User-Agent": "Custom User Agent String",
-            "CloudFront-Forwarded-Proto": "https",
-            "Accept-Encoding": "gzip, deflate, sdch",
-        },
-        "pathParameters": {"proxy": "/examplepath"},
-        "httpMethod": "POST",
-        "stageVariables": {"baz": "qux"},
-        "path": "/examplepath",
+    run = runSweep(fleet, {"STREAM_PIPELINE": streaming}, measureMemory=False)
+
+    assert run["report"]["message"] == "Success"
+    assert sorted(fleet.stopped) == idle
+    assert run["outcomes"]["stopped"] == len(idle)
+    assert run["outcomes"]["not_idle"] > 0
+
+
+def test_flaky_and_unreachable_instances_are_left_alone():
+    fleet = SimulatedFleet(60, unreachableFraction=0.2, failureRate=0.2, seed=3)
+
+    run = runSweep(fleet, measureMemory=False)
+
+    assert run["outcomes"]["unreachable"] > 0
+    assert not set(fleet.stopped) & {
+        i["DBInstanceIdentifier"]
+        for i in fleet.instances
+        if i["Endpoint"]["Address"] in fleet.unreachable
     }
+    # the TCP pre-check means unreachable instances are never logged in to
+    assert run["db_connects"] < run["instances"] - len(fleet.unreachable)
 
 
-def test_lambda_handler(apigw_event, mocker):
+def test_describe_is_paged_and_tags_are_not_fetched_per_instance():
+    fleet = SimulatedFleet(250, seed=5)
 
-    ret = app.lambda_handler(apigw_event, "")
-    data = json.loads(ret["body"])
+    run = runSweep(fleet, measureMemory=False)
 
-    assert ret["statusCode"] == 200
-    assert "message" in ret["body"]
-    assert data["message"] == "hello world"
-    # assert "location" in data.dict_keys()
+    # three pages of instances, then the stopped ones confirmed 100 at a time
+    assert run["api_calls_by_operation"]["rds.describe_db_instances"] == 3 + math.ceil(
+        run["stop_calls"] / 100
+    )
+    assert "rds.list_tags_for_resource" not in run["api_calls_by_operation"]
+    assert run["api_calls_by_operation"]["ssm.get_parameters"] == 1
@@ -0,0 +1,86 @@
+import instrumentation
+from instrumentation import Recorder, emfDocuments, finishRun, startRun, timed
+
+from ..benchmark.run import runSweep
+from ..benchmark.simulator import SimulatedFleet
+
+
+def test_summary_percentiles_and_slowest_probes():
+    recorder = Recorder()
+    for index in range(100):
+        recorder.record(
+            "probe", (index + 1) / 1000, {"DBInstanceIdentifier": f"db{index}"}
+        )
+    recorder.record("query_now", 0.002)
+    recorder.record("query_uptime", 0.003)
+
+    summary = recorder.summary()
+
+    assert summary["phases"]["probe"]["p50_ms"] == 50.0
+    assert summary["phases"]["probe"]["p99_ms"] == 99.0
+    assert summary["phases"]["probe"]["max_ms"] == 100.0
+    assert summary["sql_calls"] == 2
+    assert [p["instance"] for p in summary["slowest_probes"]] == [
+        "db99",
+        "db98",
+        "db97",
+        "db96",
+        "db95",
+    ]
+
+
+def test_timed_only_records_inside_a_run():
+    with timed("connect"):
+        pass
+    recorder, started = startRun()
+    nested, nestedStarted = startRun()
+    with timed("connect"):
+        pass
+    finishRun(nested, nestedStarted)
+    finishRun(recorder, started)
+
+    assert nested is recorder and not nestedStarted
+    assert recorder.summary()["phases"]["connect"]["count"] == 1
+    assert instrumentation._current["run"] is None
+
+
+def test_emf_splits_values_into_documents_of_100():
+    recorder = Recorder()
+    for _ in range(250):
+        recorder.record("connect", 0.01)
+
+    documents = emfDocuments(recorder, {"ApiCalls": 3}, functionName="idle-shutdown")
+
+    connects = [d for d in documents if d.get("Phase") == "connect"]
+    assert [len(d["Duration"]) for d in connects] == [100, 100, 50]
+    metrics = documents[-1]["_aws"]["CloudWatchMetrics"][0]
+    assert metrics["Dimensions"] == [["FunctionName"]]
+    assert documents[-1]["ApiCalls"] == 3
+
+
+def test_handler_reports_phase_timings():
+    fleet = SimulatedFleet(120, seed=2)
+
+    run = runSweep(fleet, measureMemory=False)
+
+    timings = run["report"]["timings"]
+    for phase in (
+        "enumerate",
+        "tag_lookup",
+        "connect",
+        "query_last_command",
+        "probe",
+        "stop",
+    ):
+        assert timings["phases"][phase]["count"] > 0
+    assert timings["phases"]["connect"]["count"] == run["db_connects"]
+    assert timings["sql_calls"] == run["db_round_trips"] - run["db_connects"]
+    assert timings["phases"]["stop"]["count"] == run["stop_calls"]
+
+
+def test_handler_reports_cold_start():
+    run = runSweep(SimulatedFleet(10, seed=3), measureMemory=False)
+
+    coldStart = run["report"]["cold_start"]
+    assert set(coldStart) == {"cold", "import_ms", "init_ms", "pymysql_loaded"}
+    assert coldStart["pymysql_loaded"]
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app
+
+NOW = datetime(2026, 1, 1, 12, 0)
+INSTANCE = {"DBInstanceIdentifier": "db1", "Endpoint": {"Address": "db1.example"}}
+
+
+class FakeCursor:
+    # answers the original three statements, or the single statement probe
+    def __init__(self, lastCommand, uptimeSeconds):
+        self.lastCommand = lastCommand
+        self.uptimeSeconds = uptimeSeconds
+        self.statements = []
+
+    def execute(self, sql, args=None):
+        self.statements.append(sql)
+
+    def fetchone(self):
+        sql = self.statements[-1]
+        if sql == app.sqlSingleProbe:
+            return {
+                "db_last_command_time": self.lastCommand,
+                "db_now": NOW,
+                "uptime_seconds": str(self.uptimeSeconds),
+            }
+        if "general_log" in sql:
+            return {"db_last_command_time": self.lastCommand, "user_host": "app"}
+        if sql == "select now()":
+            return {"now()": NOW}
+        return {
+            "hours": "%02d" % (self.uptimeSeconds // 3600),
+            "minutes": "%02d" % (self.uptimeSeconds % 3600 // 60),
+        }
+
+
+@pytest.mark.parametrize("singleQuery", [False, True])
+@pytest.mark.parametrize(
+    "lastCommandMinutesAgo, uptimeMinutes, idleMinutes, expected",
+    [
+        (30, 600, 60, False),
+        (90, 600, 60, True),
+        (90, 45, 60, False),
+        (90, 600, 120, False),
+        (20, 600, 15, True),
+    ],
+)
+def test_single_query_matches_three_queries(
+    singleQuery, lastCommandMinutesAgo, uptimeMinutes, idleMinutes, expected
+):
+    cursor = FakeCursor(
+        NOW - timedelta(minutes=lastCommandMinutesAgo), uptimeMinutes * 60
+    )
+
+    idle = app.isIdle(
+        INSTANCE,
+        cursor,
+        "idlecheck",
+        idleMinutes=idleMinutes,
+        singleQuery=singleQuery,
+    )
+
+    assert idle == expected
+    if singleQuery:
+        assert cursor.statements == [app.sqlSingleProbe]
+
+
+def test_single_query_fills_in_observation():
+    cursor = FakeCursor(NOW - timedelta(minutes=90), 600 * 60)
+    observation = {}
+
+    app.isIdle(INSTANCE, cursor, "idlecheck", observation=observation, singleQuery=True)
+
+    assert observation["uptime"] == 600 * 60
+    assert "last_active" in observation
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import runPipeline, stage
+
+
+def test_later_stages_start_before_the_source_is_finished():
+    seen = []
+
+    def source():
+        for page in range(3):
+            time.sleep(0.05)
+            seen.append(("page", page))
+            yield page
+
+    def probe(page):
+        seen.append(("probe", page))
+        yield page * 10
+
+    outputs, stats = runPipeline(source(), [stage("probe", probe)])
+
+    assert sorted(outputs) == [0, 10, 20]
+    # the first page was probed before the second page was listed
+    assert seen.index(("probe", 0)) < seen.index(("page", 1))
+    assert [s["stage"] for s in stats] == ["source", "probe"]
+    assert stats[1]["items_in"] == 3
+
+
+def test_queues_stop_the_source_running_ahead():
+    listed = []
+    release = threading.Event()
+
+    def source():
+        for item in range(20):
+            listed.append(item)
+            yield item
+
+    def slow(item):
+        release.wait()
+        yield item
+
+    worker = threading.Thread(
+        target=runPipeline, args=(source(), [stage("slow", slow, queueSize=2)])
+    )
+    worker.start()
+    time.sleep(0.1)
+    # one item being worked on, two waiting in the queue, one blocked trying to get in
+    assert len(listed) <= 4
+    release.set()
+    worker.join()
+    assert len(listed) == 20
+
+
+def test_stage_failure_is_raised():
+    def explode(item):
+        raise RuntimeError("throttled")
+        yield item
+
+    with pytest.raises(RuntimeError, match="throttled"):
+        runPipeline(
+            iter(range(50)), [stage("explode", explode, workers=3, queueSize=1)]
+        )
+
+
+class FakeRDS:
+    def __init__(self, pages):
+        self.pages = pages
+        self.stopped = []
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Filters=None):
+        if Filters:
+            # confirming the stops
+            ids = Filters[0]["Values"]
+            return iter(
+                [
+                    {
+                        "DBInstances": [
+                            {"DBInstanceIdentifier": i, "DBInstanceStatus": "stopped"}
+                            for i in ids
+                        ]
+                    }
+                ]
+            )
+        return ({"DBInstances": page} for page in self.pages)
+
+    def stop_db_instance(self, DBInstanceIdentifier):
+        self.stopped.append(DBInstanceIdentifier)
+
+
+class NoEndpoints:
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self):
+        return iter([{"VpcEndpoints": []}])
+
+
+def test_stream_sweep_keeps_rds_order(mocker):
+    import app
+    from settings import loadSettings
+    from state import MemoryStateStore
+
+    def instance(name, exempt="FALSE"):
+        return {
+            "DBInstanceIdentifier": name,
+            "DBInstanceArn": f"arn:aws:rds:us-west-2:1:db:{name}",
+            "DBInstanceStatus": "available",
+            "Endpoint": {"Address": f"{name}.example"},
+            "TagList": [{"Key": "RDS_IDLE_EXEMPT", "Value": exempt}],
+        }
+
+    rds = FakeRDS(
+        [
+            [instance("db0"), instance("db1", exempt="TRUE"), instance("db2")],
+            [instance("db3"), instance("db4")],
+        ]
+    )
+    mocker.patch.object(
+        app,
+        "isIdleBySQL",
+        side_effect=lambda instance, *args, **kwargs: instance["DBInstanceIdentifier"]
+        in ("db2", "db3"),
+    )
+    settings = loadSettings(
+        {"PROBE_CONCURRENCY": "4", "TCP_PRECHECK": "false", "CLUSTER_MODE": "false"}
+    )
+
+    report = app.sweep(
+        settings,
+        MemoryStateStore(),
+        clientFor={"rds": rds, "ssm": None, "ec2": NoEndpoints()}.get,
+    )
+
+    assert [(r["instance"], r["outcome"]) for r in report["results"]] == [
+        ("db0", "not_idle"),
+        ("db2", "stopped"),
+        ("db3", "stopped"),
+        ("db4", "not_idle"),
+    ]
+    assert sorted(rds.stopped) == ["db2", "db3"]
+    assert report["exemptions"]["instances"] == 5
+    assert report["schedule"]["probes_executed"] == 4
+    assert [s["items_out"] for s in report["pipeline"]] == [2, 4, 4, 4]
+    assert [s["instance"] for s in report["stops"]["savings"]] == ["db2", "db3"]
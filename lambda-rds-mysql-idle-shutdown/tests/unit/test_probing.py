@@ -0,0 +1,92 @@
+import threading
+import time
+
+from probing import probeInstances, probeResult
+
+from ..conftest import make_instance
+
+
+def test_results_keep_input_order():
+    instances = [make_instance(f"db{i}") for i in range(6)]
+
+    def probe(instance):
+        # later instances finish first
+        time.sleep(0.01 * (6 - int(instance["DBInstanceIdentifier"][2:])))
+        return probeResult(instance, "not_idle")
+
+    results = probeInstances(instances, probe, maxWorkers=6)
+
+    assert [r["instance"] for r in results] == [f"db{i}" for i in range(6)]
+
+
+def test_failure_is_isolated_to_one_instance():
+    instances = [make_instance("good1"), make_instance("bad"), make_instance("good2")]
+
+    def probe(instance):
+        if instance["DBInstanceIdentifier"] == "bad":
+            raise RuntimeError("connection refused")
+        return probeResult(instance, "stopped")
+
+    results = probeInstances(instances, probe, maxWorkers=3)
+
+    assert [r["outcome"] for r in results] == ["stopped", "error", "stopped"]
+    assert results[1]["error"] == "connection refused"
+
+
+def test_parallelism_is_bounded():
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+
+    def probe(instance):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        return probeResult(instance, "not_idle")
+
+    probeInstances([make_instance(f"db{i}") for i in range(12)], probe, maxWorkers=3)
+
+    assert 1 < running["peak"] <= 3
+
+
+def test_wall_time_tracks_slowest_instance():
+    def probe(instance):
+        time.sleep(0.1)
+        return probeResult(instance, "not_idle")
+
+    started = time.monotonic()
+    probeInstances([make_instance(f"db{i}") for i in range(8)], probe, maxWorkers=8)
+
+    assert time.monotonic() - started < 0.5
+
+
+def test_shared_slots_limit_concurrent_sweeps():
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+    slots = threading.BoundedSemaphore(2)
+
+    def probe(instance):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        return probeResult(instance, "not_idle")
+
+    sweeps = [
+        threading.Thread(
+            target=probeInstances,
+            args=([make_instance(f"db{i}") for i in range(6)], probe),
+            kwargs={"maxWorkers": 4, "slots": slots},
+        )
+        for _ in range(3)
+    ]
+    for sweep in sweeps:
+        sweep.start()
+    for sweep in sweeps:
+        sweep.join()
+
+    assert running["peak"] == 2
@@ -0,0 +1,121 @@
+import socket
+
+import pytest
+
+import app
+from probing import probeInstances, probeResult
+from reachability import checkReachable, remainingMillis
+from settings import loadSettings
+
+from ..conftest import make_instance
+
+
+@pytest.fixture()
+def listening_port():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_check_reachable(listening_port):
+    instances = [
+        make_instance("up", address="127.0.0.1", port=listening_port),
+        make_instance("down", address="127.0.0.1", port=closed_port()),
+    ]
+
+    assert checkReachable(instances, timeout=1) == {"up": True, "down": False}
+
+
+def test_remaining_time():
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 1234
+
+    assert remainingMillis(Context()) == 1234
+    assert remainingMillis("") is None
+
+
+def test_no_new_probes_once_out_of_time():
+    started = []
+
+    def probe(instance):
+        started.append(instance["DBInstanceIdentifier"])
+        return probeResult(instance, "not_idle")
+
+    budget = iter([True, True, False, False])
+    results = probeInstances(
+        [make_instance(f"db{i}") for i in range(4)],
+        probe,
+        shouldStart=lambda: next(budget),
+    )
+
+    assert started == ["db0", "db1"]
+    assert [r["outcome"] for r in results] == [
+        "not_idle",
+        "not_idle",
+        "out_of_time",
+        "out_of_time",
+    ]
+
+
+@pytest.mark.parametrize(
+    "policy, outcome, stopped",
+    [("skip", "unreachable", []), ("stop", "stopped_unreachable", ["db1"])],
+)
+def test_unreachable_policy(mocker, policy, outcome, stopped):
+    rds = mocker.MagicMock()
+
+    result = app.checkInstance(
+        make_instance("db1"),
+        ssmClient=None,
+        rds=rds,
+        settings=loadSettings({"UNREACHABLE_POLICY": policy}),
+        reachable=False,
+    )
+
+    assert result["outcome"] == outcome
+    assert [
+        c.kwargs["DBInstanceIdentifier"] for c in rds.stop_db_instance.call_args_list
+    ] == stopped
+
+
+@pytest.mark.parametrize(
+    "failsAt, outcome, stopped",
+    [("connect", "stopped_unreachable", ["db1"]), ("query", "error", [])],
+)
+def test_only_failing_to_connect_is_unreachable(mocker, failsAt, outcome, stopped):
+    # lost connection (2013) from the handshake means unreachable, from a slow query it doesn't
+    pymysql = app.loadPyMySQL()
+    lost = pymysql.err.OperationalError(2013, "Lost connection to MySQL server")
+    connection = mocker.MagicMock()
+    if failsAt == "connect":
+        mocker.patch("pymysql.connect", side_effect=lost)
+    else:
+        mocker.patch("pymysql.connect", return_value=connection)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.execute.side_effect = lost
+    rds = mocker.MagicMock()
+    rds.generate_db_auth_token.return_value = "token"
+    settings = loadSettings({"UNREACHABLE_POLICY": "stop", "DB_AUTH": "iam"})
+
+    results = probeInstances(
+        [make_instance("db1")],
+        lambda instance: app.checkInstance(
+            instance, ssmClient=None, rds=rds, settings=settings
+        ),
+    )
+
+    assert results[0]["outcome"] == outcome
+    assert [
+        c.kwargs["DBInstanceIdentifier"] for c in rds.stop_db_instance.call_args_list
+    ] == stopped
@@ -0,0 +1,39 @@
+from scheduler import idleDeadline, planProbes
+from state import MemoryStateStore
+
+from ..conftest import make_instance
+
+HOUR = 60 * 60
+
+
+def test_deadline_is_later_of_activity_and_uptime():
+    # last active 3 hours before the check, but restarted 20 minutes before it
+    state = {
+        "last_active": 97 * HOUR,
+        "uptime": 1200,
+        "observed_at": 100 * HOUR,
+    }
+
+    assert idleDeadline(state, HOUR) == 100 * HOUR - 1200 + HOUR
+    assert idleDeadline({"last_active": 5 * HOUR}, HOUR) == 6 * HOUR
+    assert idleDeadline(None, HOUR) is None
+
+
+def test_only_due_instances_are_probed():
+    store = MemoryStateStore()
+    now = 100 * HOUR
+    store.put("recent", {"last_active": now - 300})
+    store.put("stale", {"last_active": now - 2 * HOUR})
+    instances = [
+        make_instance("recent"),
+        make_instance("stale"),
+        make_instance("unknown"),
+        make_instance("stopped", status="stopped"),
+    ]
+
+    due, report = planProbes(instances, store, HOUR, now)
+
+    assert [i["DBInstanceIdentifier"] for i in due] == ["stale", "unknown", "stopped"]
+    assert report["probes_executed"] == 2
+    assert report["probes_skipped"] == 1
+    assert report["next_deadline"] == now - 300 + HOUR
@@ -0,0 +1,49 @@
+import pytest
+
+from settings import loadSettings
+
+
+def test_defaults():
+    settings = loadSettings({})
+
+    assert settings["probe_concurrency"] == 1
+    assert settings["idle_detector"] == "general_log"
+    assert settings["state_table"] is None
+    assert settings["state_file"] is None
+    assert settings["metrics_mode"] == "off"
+    assert settings["metrics_cpu_threshold"] == 5.0
+
+
+def test_environment_overrides():
+    settings = loadSettings(
+        {
+            "PROBE_CONCURRENCY": "16",
+            "IDLE_DETECTOR": "Status_Counters",
+            "STATE_TABLE": "idle-state",
+            "METRICS_MODE": "prefilter",
+            "METRICS_IOPS_THRESHOLD": "2.5",
+        }
+    )
+
+    assert settings["probe_concurrency"] == 16
+    assert settings["idle_detector"] == "status_counters"
+    assert settings["state_table"] == "idle-state"
+    assert settings["metrics_mode"] == "prefilter"
+    assert settings["metrics_iops_threshold"] == 2.5
+
+
+def test_min_remaining_covers_the_slowest_check():
+    # a 5s connect and three 10s queries, plus the time kept back for stopping
+    assert loadSettings({})["min_remaining_ms"] == 45000
+    assert (
+        loadSettings({"QUERY_TIMEOUT": "20", "STOP_CONFIRM_SECONDS": "30"})[
+            "min_remaining_ms"
+        ]
+        == 105000
+    )
+    assert loadSettings({"MIN_REMAINING_MS": "5000"})["min_remaining_ms"] == 5000
+
+
+def test_shards_and_fleet_targets_are_not_combined():
+    with pytest.raises(ValueError):
+        loadSettings({"SHARD_SIZE": "50", "FLEET_TARGETS": "us-east-1,eu-west-1"})
@@ -0,0 +1,140 @@
+import io
+import json
+import time
+from datetime import datetime, timezone
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+import app
+import clients
+from settings import loadSettings
+from shards import (
+    LambdaDispatcher,
+    LocalDispatcher,
+    coordinate,
+    instanceSummary,
+    shardInstances,
+    workerEvent,
+)
+
+from ..benchmark.run import runSweep
+from ..benchmark.simulator import SimulatedFleet
+
+from ..conftest import make_instance
+
+CREATED = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def worker(event):
+    # answers like lambda_handler would, one stopped result per instance
+    results = [
+        {"instance": i["DBInstanceIdentifier"], "outcome": "stopped"}
+        for i in event["instances"]
+    ]
+    return {"statusCode": 200, "body": json.dumps({"results": results})}
+
+
+def test_shards_and_summaries():
+    instances = [make_instance(f"db{i}", InstanceCreateTime=CREATED) for i in range(5)]
+
+    assert [len(s) for s in shardInstances(instances, 2)] == [2, 2, 1]
+    summary = instanceSummary(instances[0])
+    json.dumps(summary)
+    assert summary["Endpoint"] == {"Address": "db0.example", "Port": 3306}
+
+
+def test_failed_shard_only_fails_its_own_instances():
+    instances = [make_instance(f"db{i}", InstanceCreateTime=CREATED) for i in range(4)]
+
+    def flaky(event):
+        if event["instances"][0]["DBInstanceIdentifier"] == "db2":
+            raise RuntimeError("throttled")
+        return worker(event)
+
+    report = coordinate(instances, 2, LocalDispatcher(flaky))
+
+    assert report["shards"] == 2
+    assert report["failed_shards"] == 1
+    assert [r["outcome"] for r in report["results"]] == [
+        "stopped",
+        "stopped",
+        "error",
+        "error",
+    ]
+    assert report["results"][2]["error"] == "throttled"
+
+
+def test_lambda_dispatcher_invokes_worker_per_shard():
+    client = boto3.client("lambda", region_name="us-west-2")
+    instances = [make_instance(f"db{i}", InstanceCreateTime=CREATED) for i in range(3)]
+
+    with Stubber(client) as stub:
+        for shard in shardInstances(instances, 2):
+            body = json.dumps(worker({"instances": shard}), default=str)
+            stub.add_response(
+                "invoke",
+                {"StatusCode": 200, "Payload": io.BytesIO(body.encode())},
+                {
+                    "FunctionName": "idle-shutdown",
+                    "InvocationType": "RequestResponse",
+                    "Payload": ANY,
+                },
+            )
+        # one worker at a time so the stubbed responses line up with the shards
+        dispatcher = LambdaDispatcher("idle-shutdown", client=client, maxWorkers=1)
+        report = coordinate(instances, 2, dispatcher)
+        stub.assert_no_pending_responses()
+
+    assert report["failed_shards"] == 0
+    assert [r["instance"] for r in report["results"]] == ["db0", "db1", "db2"]
+
+
+def test_workers_are_given_the_coordinators_deadline():
+    events = []
+
+    def recording(event):
+        events.append(event)
+        return worker(event)
+
+    instances = [make_instance(f"db{i}", InstanceCreateTime=CREATED) for i in range(3)]
+    coordinate(instances, 2, LocalDispatcher(recording), deadline=1234.5)
+
+    assert [e["deadline"] for e in events] == [1234.5, 1234.5]
+
+
+def test_worker_stops_checking_before_the_deadline():
+    settings = loadSettings({"MIN_REMAINING_MS": "10000"})
+
+    assert app.timeLeftCheck(settings, None, deadline=time.time() + 60)()
+    assert not app.timeLeftCheck(settings, None, deadline=time.time() + 5)()
+
+
+def test_lambda_client_waits_longer_than_a_worker_can_run():
+    clients.resetClients()
+    try:
+        config = clients.getClient("lambda", region="us-west-2").meta.config
+        assert config.read_timeout > 15 * 60
+        assert config.max_pool_connections == clients.LAMBDA_POOL_SIZE
+    finally:
+        clients.resetClients()
+
+
+def test_fire_and_forget_workers_leave_endpoint_cleanup_to_the_next_run():
+    fleet = SimulatedFleet(20, activeFraction=0.2, stoppedFraction=0.0, seed=12)
+    listings = "ec2.describe_vpc_endpoints"
+
+    # two shards' workers, neither lists the endpoints
+    for shard in shardInstances(fleet.instances, 10):
+        event = workerEvent(shard, deferCleanup=True)
+        worker = runSweep(fleet, {}, event=event, measureMemory=False)
+        assert worker["report"]["endpoints"] is None
+    assert fleet.stopped
+    assert fleet.apiCalls[listings] == 0
+
+    # the coordinator's next run cleans up once
+    coordinator = runSweep(
+        fleet, {"SHARD_SIZE": "10", "DISPATCHER": "local"}, measureMemory=False
+    )
+    assert coordinator["report"]["endpoints"] is not None
+    assert fleet.apiCalls[listings] == 1
@@ -0,0 +1,126 @@
+import boto3
+from botocore.stub import Stubber
+
+import state
+from settings import loadSettings
+from state import (
+    DynamoDBStateStore,
+    JsonFileStateStore,
+    PrefixedStateStore,
+    openStateStore,
+)
+
+
+def test_json_store_survives_reopening(tmp_path):
+    path = str(tmp_path / "state.json")
+    JsonFileStateStore(path).put("db1", {"last_active": 123.5, "uptime": 7200})
+
+    assert JsonFileStateStore(path).get("db1") == {
+        "last_active": 123.5,
+        "uptime": 7200,
+    }
+    assert JsonFileStateStore(path).get("db2") is None
+
+
+def test_dynamodb_store_round_trips_numbers():
+    client = boto3.client("dynamodb", region_name="us-west-2")
+    store = DynamoDBStateStore("state", client=client)
+
+    with Stubber(client) as stub:
+        stub.add_response(
+            "put_item",
+            {},
+            {
+                "TableName": "state",
+                "Item": {
+                    "DBInstanceIdentifier": {"S": "db1"},
+                    "statements": {"N": "42"},
+                    "last_active": {"N": "1700000000.5"},
+                },
+            },
+        )
+        stub.add_response(
+            "get_item",
+            {
+                "Item": {
+                    "DBInstanceIdentifier": {"S": "db1"},
+                    "statements": {"N": "42"},
+                    "last_active": {"N": "1700000000.5"},
+                }
+            },
+            {
+                "TableName": "state",
+                "Key": {"DBInstanceIdentifier": {"S": "db1"}},
+                "ConsistentRead": True,
+            },
+        )
+
+        store.put("db1", {"statements": 42, "last_active": 1700000000.5})
+        assert store.get("db1") == {"statements": 42, "last_active": 1700000000.5}
+
+
+def test_dynamodb_store_reads_many_states_in_batches(monkeypatch):
+    monkeypatch.setattr(state, "backoff", lambda attempts: 0)
+    client = boto3.client("dynamodb", region_name="us-west-2")
+    store = DynamoDBStateStore("state", client=client)
+    ids = [f"db{i:03d}" for i in range(150)]
+
+    def keys(batch):
+        return [{"DBInstanceIdentifier": {"S": i}} for i in batch]
+
+    def item(instanceId):
+        return {"DBInstanceIdentifier": {"S": instanceId}, "uptime": {"N": "60"}}
+
+    with Stubber(client) as stub:
+        # db005 was throttled and comes back on the second try, db149 has no state
+        stub.add_response(
+            "batch_get_item",
+            {
+                "Responses": {"state": [item(i) for i in ids[:100] if i != "db005"]},
+                "UnprocessedKeys": {"state": {"Keys": keys(["db005"])}},
+            },
+            {
+                "RequestItems": {
+                    "state": {"Keys": keys(ids[:100]), "ConsistentRead": True}
+                }
+            },
+        )
+        stub.add_response(
+            "batch_get_item",
+            {"Responses": {"state": [item("db005")]}},
+            {
+                "RequestItems": {
+                    "state": {"Keys": keys(["db005"]), "ConsistentRead": True}
+                }
+            },
+        )
+        stub.add_response(
+            "batch_get_item",
+            {"Responses": {"state": [item(i) for i in ids[100:149]]}},
+            {
+                "RequestItems": {
+                    "state": {"Keys": keys(ids[100:]), "ConsistentRead": True}
+                }
+            },
+        )
+
+        states = store.getMany(ids)
+        stub.assert_no_pending_responses()
+
+    assert sorted(states) == ids[:149]
+    assert states["db005"] == {"uptime": 60}
+
+
+def test_prefixed_store_reads_many(tmp_path):
+    store = JsonFileStateStore(str(tmp_path / "state.json"))
+    prefixed = PrefixedStateStore(store, "123456789012/us-west-2")
+    prefixed.put("db1", {"uptime": 1})
+    store.put("db2", {"uptime": 2})
+
+    assert prefixed.getMany(["db1", "db2"]) == {"db1": {"uptime": 1}}
+
+
+def test_memory_state_outlives_the_invocation():
+    openStateStore(loadSettings({})).put("db1", {"statements": 5})
+
+    assert openStateStore(loadSettings({})).get("db1") == {"statements": 5}
@@ -0,0 +1,132 @@
+import threading
+import time
+
+from state import MemoryStateStore
+from stops import PENDING_STOPS_KEY, confirmStops, dispatchStops
+
+from ..benchmark.run import runSweep
+from ..benchmark.simulator import SimulatedFleet
+
+
+class FakeRDS:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.filters = []
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Filters):
+        self.filters.append(Filters)
+        ids = Filters[0]["Values"]
+        yield {
+            "DBInstances": [
+                {
+                    "DBInstanceIdentifier": i,
+                    "DBInstanceStatus": self.statuses[i],
+                    "DBInstanceClass": "db.r5.large",
+                }
+                for i in ids
+                if i in self.statuses
+            ]
+        }
+
+
+def test_stops_are_dispatched_at_the_same_time_and_keep_order():
+    running = []
+    most = []
+    lock = threading.Lock()
+
+    def stop(item):
+        with lock:
+            running.append(item)
+            most.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(item)
+        return item * 10
+
+    assert dispatchStops(range(8), stop, workers=4) == [
+        0,
+        10,
+        20,
+        30,
+        40,
+        50,
+        60,
+        70,
+    ]
+    assert max(most) > 1
+
+
+def test_batch_is_confirmed_with_a_few_describes():
+    ids = [f"db{i:03d}" for i in range(250)]
+    rds = FakeRDS({i: "stopped" for i in ids})
+    store = MemoryStateStore()
+
+    report = confirmStops(rds, store, ids, now=100)
+
+    assert len(rds.filters) == 3
+    assert report["confirmed"] == 250
+    assert report["savings"][0]["instance_class"] == "db.r5.large"
+    assert report["savings"][0]["stop_issued_at"] == 100
+    assert store.get(PENDING_STOPS_KEY) == {}
+
+
+def test_instances_still_stopping_are_checked_again_next_run():
+    rds = FakeRDS({"db1": "stopping", "db2": "stopped", "db3": "available"})
+    store = MemoryStateStore()
+
+    first = confirmStops(rds, store, ["db1", "db2", "db3", "gone"], now=100)
+
+    assert [s["instance"] for s in first["savings"]] == ["db2"]
+    assert first["still_stopping"] == ["db1"]
+    assert first["not_stopped"] == [
+        {"instance": "db3", "status": "available"},
+        {"instance": "gone", "status": None},
+    ]
+    assert store.get(PENDING_STOPS_KEY) == {"db1": 100}
+
+    rds.statuses["db1"] = "stopped"
+    second = confirmStops(rds, store, [], now=400)
+
+    assert second["issued"] == 0
+    assert second["from_earlier_runs"] == 1
+    assert [(s["instance"], s["stop_issued_at"]) for s in second["savings"]] == [
+        ("db1", 100)
+    ]
+    assert store.get(PENDING_STOPS_KEY) == {}
+
+
+def test_waits_for_stopping_instances_when_allowed():
+    rds = FakeRDS({"db1": "stopping"})
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        rds.statuses["db1"] = "stopped"
+
+    report = confirmStops(rds, MemoryStateStore(), ["db1"], waitSeconds=30, sleep=sleep)
+
+    assert len(sleeps) == 1
+    assert report["confirmed"] == 1
+    assert report["still_stopping"] == []
+
+
+def test_handler_reports_confirmed_savings_across_runs(tmp_path):
+    fleet = SimulatedFleet(30, stopSeconds=60, seed=8)
+    environment = {"STATE_FILE": str(tmp_path / "state.json")}
+
+    first = runSweep(fleet, environment, measureMemory=False)
+
+    stops = first["report"]["stops"]
+    assert first["stop_calls"] > 0
+    assert stops["confirmed"] == 0
+    assert stops["still_stopping"] == sorted(fleet.stopped)
+
+    fleet.stopSeconds = 0
+    second = runSweep(fleet, environment, measureMemory=False)
+
+    stops = second["report"]["stops"]
+    assert sorted(s["instance"] for s in stops["savings"]) == sorted(fleet.stopped)
+    assert stops["still_stopping"] == []
@@ -0,0 +1,158 @@
+import time
+
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ReadTimeoutError
+
+import throttling
+from throttling import (
+    CLIENT_CONFIG,
+    TokenBucket,
+    apiStats,
+    bucketFor,
+    configureThrottling,
+    parseRates,
+    resetThrottling,
+    throttleClient,
+)
+
+THROTTLED = b"""<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code>
+<Message>Rate exceeded</Message></Error><RequestId>1</RequestId></ErrorResponse>"""
+NOT_FOUND = b"""<ErrorResponse><Error><Type>Sender</Type><Code>DBInstanceNotFound</Code>
+<Message>No such instance</Message></Error><RequestId>1</RequestId></ErrorResponse>"""
+STOPPED = b"""<StopDBInstanceResponse><StopDBInstanceResult><DBInstance>
+<DBInstanceIdentifier>db1</DBInstanceIdentifier></DBInstance></StopDBInstanceResult>
+</StopDBInstanceResponse>"""
+
+
+class Body:
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+@pytest.fixture()
+def rds(monkeypatch):
+    # an RDS client whose HTTP layer answers from a list, one response per attempt
+    resetThrottling()
+    monkeypatch.setattr(throttling, "backoff", lambda attempts, hint=None: 0)
+    client = boto3.client(
+        "rds",
+        region_name="us-west-2",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        config=CLIENT_CONFIG,
+    )
+    throttleClient(client, ("rds", "us-west-2", None))
+    answers = []
+
+    def send(request, **kwargs):
+        status, body = answers.pop(0)
+        return AWSResponse(request.url, status, {}, Body(body))
+
+    client.meta.events.register_last("before-send", send)
+    yield client, answers
+    resetThrottling()
+
+
+def test_throttled_call_is_retried_and_counted(rds):
+    client, answers = rds
+    answers.extend([(400, THROTTLED), (400, THROTTLED), (200, STOPPED)])
+
+    client.stop_db_instance(DBInstanceIdentifier="db1")
+
+    assert answers == []
+    stats = apiStats()["rds.StopDBInstance"]
+    assert (stats["calls"], stats["retries"], stats["throttles"]) == (1, 2, 2)
+    assert stats["failures"] == 0
+    # the bucket slowed down after each throttle, so the retries had to wait for tokens
+    assert stats["wait_seconds"] > 0
+
+
+def test_real_errors_are_not_retried(rds):
+    client, answers = rds
+    answers.extend([(404, NOT_FOUND), (200, STOPPED)])
+
+    with pytest.raises(client.exceptions.DBInstanceNotFoundFault):
+        client.stop_db_instance(DBInstanceIdentifier="db1")
+
+    assert len(answers) == 1
+    assert apiStats()["rds.StopDBInstance"]["retries"] == 0
+
+
+def test_gives_up_after_max_attempts(rds, monkeypatch):
+    client, answers = rds
+    monkeypatch.setitem(throttling._settings, "max_attempts", 3)
+    answers.extend([(400, THROTTLED)] * 3)
+
+    with pytest.raises(client.exceptions.ClientError):
+        client.stop_db_instance(DBInstanceIdentifier="db1")
+
+    assert apiStats()["rds.StopDBInstance"]["failures"] == 1
+
+
+def test_bucket_limits_rate_and_backs_off_on_throttle():
+    bucket = TokenBucket(rate=50.0, burst=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # the first token is already there, the other five arrive at 50 a second
+    assert time.monotonic() - started >= 0.09
+
+    bucket.throttled()
+    assert bucket.rate == 25.0
+    for _ in range(20):
+        bucket.succeeded()
+    assert bucket.rate == 50.0
+
+
+def test_parse_rates():
+    assert parseRates("rds=20, ssm=2.5") == {"rds": 20.0, "ssm": 2.5}
+    assert parseRates("") == {}
+    with pytest.raises(ValueError):
+        parseRates("rds")
+
+
+def test_state_table_has_no_bucket_unless_given_a_rate():
+    resetThrottling()
+    try:
+        assert bucketFor(("dynamodb", "us-west-2", None)) is None
+        assert bucketFor(("sts", "us-west-2", None)).maxRate == 10.0
+
+        resetThrottling()
+        configureThrottling(rates={"dynamodb": 40.0})
+        assert bucketFor(("dynamodb", "us-west-2", None)).maxRate == 40.0
+    finally:
+        configureThrottling()
+        resetThrottling()
+
+
+def test_invoke_is_not_sent_again_after_a_read_timeout(monkeypatch):
+    resetThrottling()
+    monkeypatch.setattr(throttling, "backoff", lambda attempts, hint=None: 0)
+    client = boto3.client(
+        "lambda",
+        region_name="us-west-2",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        config=CLIENT_CONFIG,
+    )
+    throttleClient(client, ("lambda", "us-west-2", None))
+    sent = []
+
+    def send(request, **kwargs):
+        sent.append(request.url)
+        raise ReadTimeoutError(endpoint_url=request.url)
+
+    client.meta.events.register_last("before-send", send)
+
+    with pytest.raises(ReadTimeoutError):
+        client.invoke(FunctionName="worker", Payload=b"{}")
+
+    # the worker may well be running, so it's left to finish rather than started again
+    assert len(sent) == 1
+    assert apiStats()["lambda.Invoke"]["retries"] == 0
+    resetThrottling()